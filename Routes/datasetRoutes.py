@@ -5,10 +5,16 @@ import pandas as pd
 from io import StringIO
 import numpy as np
 import os
-from eals import ElementwiseAlternatingLeastSquares, load_model
+from eals import ElementwiseAlternatingLeastSquares, JournaledModel, ModelCache, load_model
+# the default model and the journal of its online updates, as served by modelRoutes
+from eals.amazonMovies.model import (
+    JOURNAL_PATH as DEFAULT_JOURNAL_PATH,
+    MODEL_PATH as DEFAULT_MODEL_PATH,
+    create_journal,
+)
 
-BASE_DIR = os.path.dirname(__file__)
-DEFAULT_MODEL_PATH = os.path.join(BASE_DIR, "amazonMovies.joblib")
+# memory budget of the customer models held in memory; the others are memory-mapped
+MODEL_CACHE_BYTES = 2 << 30
 
 from customDataset import model as custom_model
 from items.database import get_db
@@ -25,6 +31,14 @@ new = db["New"]
 customer_collection = db["CustomerInfo"]
 
 
+def customer_model_path(customer_id):
+    return os.path.join("models", f"{customer_id}.inference")
+
+
+# latent vectors of the customers, read into memory in the background when they are requested
+model_cache = ModelCache(customer_model_path, max_bytes=MODEL_CACHE_BYTES)
+
+
 class Item(BaseModel):
     itemId: Optional[str]
     title: Optional[str] = None
@@ -86,7 +100,12 @@ async def upload_dataset(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Item ID conversion failed: {str(e)}")
 
     try:
-        model = load_model(DEFAULT_MODEL_PATH)
+        create_journal(DEFAULT_MODEL_PATH, DEFAULT_JOURNAL_PATH)
+        if os.path.exists(os.path.join(DEFAULT_JOURNAL_PATH, "CURRENT")):
+            # not memory-mapped, since the customer model outlives the snapshot
+            model = JournaledModel(DEFAULT_JOURNAL_PATH, mmap=False).model
+        else:
+            model = load_model(DEFAULT_MODEL_PATH)
         model_user_count = model.user_factors.shape[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Model load failed: {str(e)}")
@@ -124,19 +143,27 @@ async def upload_dataset(file: UploadFile = File(...)):
     df[['userID', 'itemID']].to_csv(dataset_path, index=False)
 
     try:
-        for _, row in df.iterrows():
-            model.update_model(int(row['userID']), int(row['itemID']))
+        valid = df[df['itemID'] >= 0]
+        model.update_model_batch(
+            valid['userID'].to_numpy(dtype=np.int64),
+            valid['itemID'].to_numpy(dtype=np.int64),
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Model update failed: {str(e)}")
 
     customer_id = get_next_customer_id()
     os.makedirs("models", exist_ok=True)
-    customer_model_path = os.path.join("models", f"{customer_id}.joblib")
+    # only the latent vectors are served, so the customer does not get a copy of the full model
+    model_path = customer_model_path(customer_id)
 
     try:
-        model.save(customer_model_path)
+        model.export_inference(model_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save model: {str(e)}")
+    # the models of an earlier export to the same directory are not served anymore
+    model_cache.invalidate(customer_id)
+    # the customer is likely to request recommendations next
+    model_cache.prefetch([customer_id])
 
     new_user_ids = list(new_user_mapping.values())
     new_user_range = (
@@ -146,7 +173,7 @@ async def upload_dataset(file: UploadFile = File(...)):
 
     customer_collection.insert_one({
         "customer_id": customer_id,
-        "model_path": customer_model_path,
+        "model_path": model_path,
         "dataset_name": dataset_name,
         "user_range": new_user_range
     })
@@ -162,12 +189,17 @@ async def recommend_items(
     customer_id: int = Query(...),
     user_id: int = Query(...)
 ):
-    model_path = os.path.join("models", f"{customer_id}.joblib")
-    if not os.path.exists(model_path):
+    model_path = customer_model_path(customer_id)
+    legacy_model_path = os.path.join("models", f"{customer_id}.joblib")
+    if not os.path.exists(model_path) and not os.path.exists(legacy_model_path):
         raise HTTPException(status_code=404, detail="Model not found for given customer ID")
 
     try:
-        model = load_model(model_path)
+        # models uploaded as full models are exported on first use
+        if not os.path.exists(model_path):
+            load_model(legacy_model_path).export_inference(model_path)
+            model_cache.invalidate(customer_id)
+        model = model_cache.get(customer_id)
         print(f"User id: {user_id}")
 
         if user_id >= model.user_factors.shape[0]:
@@ -175,10 +207,7 @@ async def recommend_items(
             return {"message": f"No recommendations: user_id {user_id} not found in model."}
 
         # Calculate recommendation scores
-        user_vector = model.user_factors[user_id]
-        pred_ratings = model.item_factors @ user_vector
-        topk_items = np.argsort(pred_ratings)[-20:][::-1]
-        recommendations = topk_items.tolist()
+        recommendations = model.recommend(user_id, 20).tolist()
         print(f"Top 20 Recommendations (item IDs): {recommendations}")
 
         if not recommendations:
@@ -1,22 +1,19 @@
 from fastapi import APIRouter
-from eals.amazonMovies.model import recommend, load_model
+from eals.amazonMovies.model import get_model_manager
 from database import get_db
 from pymongo import MongoClient
 from pydantic import BaseModel
 from typing import Optional, List, Union, Dict, Any
 from functools import lru_cache
 import os
-import numpy as np
 import json
 from  my_redis_test import r  # Import the Redis client
 
-BASE_DIR = os.path.dirname(__file__)
-MODEL_PATH = os.path.join(BASE_DIR, "amazonMovies.joblib")
-
 router = APIRouter(prefix="/model", tags=["model"])
 
 db = get_db()
 collection = db["Item"]
+watched_collection = db["Watched"]
 
 class Item(BaseModel):
     itemId: Optional[str]
@@ -25,16 +22,16 @@ class Item(BaseModel):
     images: Optional[Union[str, List[Union[str, Dict[str, Any]]]]] = None    
 
 def get_model():
-    print(f"Loading the model from {MODEL_PATH}")
-    return load_model(MODEL_PATH)
+    # loads the latent vectors once per worker and reloads them when the journal changes or
+    # fit_model() saves a new model, which trains and serves the same files
+    return get_model_manager()
 
 @router.put("/update/{user_id}/{item_id}")
 def update_route(user_id: int, item_id: int):
-    model = get_model()
+    manager = get_model()
     print("Updating model...")
-    model.update_model(user_id, item_id)
-    print(f"Saving the model to {MODEL_PATH}")
-    model.save(MODEL_PATH)
+    # appends a record to the journal instead of saving the whole model
+    manager.update(user_id, item_id)
     
     r.delete(f"recommend:{user_id}")
     
@@ -43,17 +40,21 @@ def update_route(user_id: int, item_id: int):
 
 @router.get("/recommend/{user_id}")
 def recommend_route(user_id: int):
-    model = get_model()
+    # the vectors of this request, even if another request swaps in new ones meanwhile
+    model = get_model().get()
     print(f"Generating recommendations for user_id: {user_id}")
 
-    if user_id >= len(model.user_factors):
-        return {"message": f"No recommendations: user_id {user_id} not found in model."}
-
     try:
-        user_vector = model.user_factors[user_id]
-        pred_ratings = model.item_factors @ user_vector
-        topk_items = np.argsort(pred_ratings)[-30:][::-1]
-        recommendations = topk_items.tolist()
+        if user_id < len(model.user_factors):
+            user_vector = model.user_factors[user_id]
+        else:
+            # users unknown to the model are folded in from their watch history
+            watched = watched_collection.find({"userId": str(user_id)}, {"_id": 0, "itemId": 1})
+            item_ids = [int(w["itemId"]) for w in watched if str(w["itemId"]).isdigit()]
+            if not item_ids:
+                return {"message": f"No recommendations: user_id {user_id} not found in model."}
+            user_vector = model.fold_in_users([item_ids])[0]
+        recommendations = model.recommend_vector(user_vector, 30).tolist()
 
         if not recommendations:
             return {"message": "No recommendations available."}
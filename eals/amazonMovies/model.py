@@ -2,13 +2,20 @@ import os
 import numpy as np
 import scipy.sparse as sps
 
-from eals import ElementwiseAlternatingLeastSquares, load_model
+from eals import ElementwiseAlternatingLeastSquares, JournaledModel, ModelManager, load_model
+from eals.eals.journal import snapshot_time
 
 
 import csv
 
 BASE_DIR = os.path.dirname(__file__)
+# written by fit_model() and served by the API
 MODEL_PATH = os.path.join(BASE_DIR, "amazonMovies.joblib")
+# snapshots of the model and the journal of its online updates (see JournaledModel)
+JOURNAL_PATH = os.path.join(BASE_DIR, "amazonMovies.journal")
+
+# ModelManager of each journal directory, resident in this process
+_managers = {}
 
 
 def load_ratings(file_name):
@@ -42,22 +49,38 @@ def load_ratings(file_name):
     return ratings, rows, cols, vals
 
 
+def create_journal(model_path=MODEL_PATH, journal_path=JOURNAL_PATH):
+    # a model saved after the current snapshot, e.g. retrained or redeployed, starts a new
+    # generation of the journal; so does a deployment which only has the full model
+    if not os.path.exists(model_path):
+        return
+    model_time = os.path.getmtime(model_path)
+    current = snapshot_time(journal_path) if os.path.isdir(journal_path) else None
+    if current is None or current < model_time:
+        print(f"Starting a new generation of the journal {journal_path} from {model_path}")
+        # checked again under the lock, so that only one of the workers starting together creates
+        # the generation
+        JournaledModel.create(journal_path, load_model(model_path), if_older_than=model_time)
+
+
+def get_model_manager(model_path=MODEL_PATH, journal_path=JOURNAL_PATH):
+    # the latent vectors stay in memory, and the manager loads the new generation of a
+    # replaced model file or the updates of the other workers at its next check
+    create_journal(model_path, journal_path)
+    if journal_path not in _managers:
+        _managers[journal_path] = ModelManager(journal_path)
+    return _managers[journal_path]
+
+
 def update_model(user_id, movie_id):
-    print(f"Loading the model from {MODEL_PATH}")
-    model = load_model(MODEL_PATH)
-    print("Updating the model")
-    model.update_model(user_id, movie_id)
-    print(f"Saving the model to {MODEL_PATH}")
-    model.save(MODEL_PATH)
+    print(f"Appending the update to {JOURNAL_PATH}")
+    get_model_manager().update(user_id, movie_id)
     print("Done")
 
 
 def recommend(user_id, k=20):
-    print(f"Loading the model from {MODEL_PATH}")
-    model = load_model(MODEL_PATH)
-    user_vector = model.user_factors[user_id]
-    pred_ratings = model.item_factors @ user_vector
-    topk_items = np.argsort(pred_ratings)[-k:][::-1]
+    model = get_model_manager().get()
+    topk_items = model.recommend(user_id, k)
     print(f"Recommended {k} items for user {user_id}")
     print(topk_items)
     return topk_items.tolist()
@@ -69,6 +92,8 @@ def fit_model(train_data, num_iter=5):
     
     print(f"Saving the model to {MODEL_PATH}")
     model.save(MODEL_PATH)
+    # the API serves the journal of the same model file
+    JournaledModel.create(JOURNAL_PATH, model)
     print("Model training complete")
     return model
 
@@ -0,0 +1,99 @@
+"""Cold start of the Numba kernels and the cost of explicit signatures
+
+Usage: poetry run python benchmarks/compile.py [--users N] [--items N] [--ratings N]
+
+1. Time of eals.warmup() in a fresh process without the on-disk cache,
+   with an empty cache (compile and write) and with a filled cache (load only)
+2. Time of a user sweep compiled lazily and with explicit signatures, where "any" declares
+   arrays of any layout (e.g. "f8[:,:]") and "C" declares C-contiguous arrays (e.g. "f8[:,::1]")
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from numba import njit
+
+from eals import ElementwiseAlternatingLeastSquares
+from eals.eals import _update_user_and_SU_all
+from eals.util import Timer, create_user_items
+
+WARMUP = "from eals.util import Timer; t = Timer(); import eals; eals.warmup(); print(t.elapsed())"
+
+
+def time_warmup(env):
+    """Time eals.warmup() in a new process, including the import"""
+    output = subprocess.run(
+        [sys.executable, "-c", WARMUP],
+        env={**os.environ, **env},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.split()[-1])
+
+
+def sweep_signature(layout):
+    """Signature of _update_user_and_SU_all for the default dtypes"""
+    matrix = "f8[:,::1]" if layout == "C" else "f8[:,:]"
+    vector = "{}[::1]" if layout == "C" else "{}[:]"
+    order, indptr, indices, data, Wi = (
+        vector.format(t) for t in ["i8", "i8", "i4", "f4", "f8"]
+    )
+    return (
+        f"void({order},{indptr},{indptr},{indices},{data},"
+        f"{matrix},{matrix},{matrix},{matrix},{Wi},i8,f8)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--ratings", type=int, default=1_000_000)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("cold start        sec")
+    print(f"no cache     {time_warmup({'USE_NUMBA_CACHE': '0'}):8.2f}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print(f"empty cache  {time_warmup({'NUMBA_CACHE_DIR': cache_dir}):8.2f}")
+        print(f"filled cache {time_warmup({'NUMBA_CACHE_DIR': cache_dir}):8.2f}")
+
+    user_items = create_user_items(
+        user_count=args.users, item_count=args.items, data_count=args.ratings, random_seed=1
+    )
+    model = ElementwiseAlternatingLeastSquares(factors=args.factors, random_state=1)
+    model._init_data(user_items)
+    order, chunk_ptr = model._make_chunks(model._user_items)
+    store = model._user_items
+    U0 = model.U.copy()
+
+    print("signature  compile(sec)  sweep(sec)")
+    py_func = _update_user_and_SU_all.py_func
+    for name, signature in [("lazy", None), ("any", "any"), ("C", "C")]:
+        timer = Timer()
+        if signature is None:
+            sweep = njit(parallel=True)(py_func)
+        else:
+            sweep = njit(sweep_signature(signature), parallel=True)(py_func)
+        sweep_args = (
+            order, chunk_ptr, store.indptr, store.indices, store.data,
+            U0.copy(), model.V, model.SU, model.SV, model.Wi, model.factors, model.regularization,
+        )
+        sweep(*sweep_args)
+        compile_time = timer.elapsed()
+        best = np.inf
+        for _ in range(args.repeat):
+            U = U0.copy()
+            timer = Timer()
+            sweep(*sweep_args[:5], U, *sweep_args[6:])
+            best = min(best, timer.elapsed())
+        print(f"{name:9s} {compile_time:13.2f} {best:11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Micro-benchmark of the memory layout of the user/item update kernels
+
+Usage: poetry run python benchmarks/kernels.py [--users N] [--items N] [--ratings N]
+
+Compares the time of a full user sweep for factor sizes 32 to 256 among
+- alloc: the former kernel, which allocates V[item_inds], the predictions and the weights
+  for every user
+- row: a preallocated workspace holding the gathered item vectors row by row (nnz, factors),
+  which is what eals uses by default
+- factor: a preallocated workspace holding them factor by factor (factors, nnz), so that the
+  loops over items for a fixed factor read contiguous memory; eals uses it with
+  USE_FACTOR_MAJOR=1
+Both run the kernel of eals, which indexes the workspace as work[f, i].
+
+The workspaces are allocated once per chunk of rows instead of once per row, so that the
+sweeps do not contend on the allocator when many threads run them.
+"""
+import argparse
+
+import numpy as np
+from numba import njit, prange
+
+from eals.eals import _update_user
+from eals.util import Timer, create_user_items
+
+
+@njit()
+def _update_user_alloc(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization):
+    if len(item_inds) == 0:
+        return
+    V_items = V[item_inds]
+    pred_items = V_items @ U[u]
+
+    w_diff = (item_ratings > 0) - Wi[item_inds]
+    for f in range(factors):
+        numer = 0
+        for k in range(factors):
+            if k != f:
+                numer -= U[u, k] * SV[f, k]
+
+        denom = SV[f, f] + regularization
+        for i in range(len(item_inds)):
+            pred_items[i] -= V_items[i, f] * U[u, f]
+            numer += (item_ratings[i] - w_diff[i] * pred_items[i]) * V_items[i, f]
+            denom += w_diff[i] * (V_items[i, f] ** 2)
+
+        new_u = numer / denom
+        U[u, f] = new_u
+        for i in range(len(item_inds)):
+            pred_items[i] += V_items[i, f] * new_u
+
+
+@njit(parallel=True)
+def _sweep_alloc(indptr, indices, data, U, V, SV, Wi, factors, regularization):
+    for u in prange(len(indptr) - 1):
+        item_inds = indices[indptr[u] : indptr[u + 1]]
+        item_ratings = data[indptr[u] : indptr[u + 1]]
+        _update_user_alloc(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization)
+
+
+@njit(parallel=True)
+def _sweep_row(indptr, indices, data, U, V, SV, Wi, factors, regularization, n_chunks):
+    n_users = len(indptr) - 1
+    for c in prange(n_chunks):
+        lo, hi = c * n_users // n_chunks, (c + 1) * n_users // n_chunks
+        max_nnz = 0
+        for u in range(lo, hi):
+            max_nnz = max(max_nnz, indptr[u + 1] - indptr[u])
+        # the transposed view indexed work[f, i] like the factor-major workspace
+        work = np.empty((max_nnz, factors + 2), dtype=U.dtype).T
+        for u in range(lo, hi):
+            item_inds = indices[indptr[u] : indptr[u + 1]]
+            item_ratings = data[indptr[u] : indptr[u + 1]]
+            _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization, work)
+
+
+@njit(parallel=True)
+def _sweep_factor(indptr, indices, data, U, V, SV, Wi, factors, regularization, n_chunks):
+    n_users = len(indptr) - 1
+    for c in prange(n_chunks):
+        lo, hi = c * n_users // n_chunks, (c + 1) * n_users // n_chunks
+        max_nnz = 0
+        for u in range(lo, hi):
+            max_nnz = max(max_nnz, indptr[u + 1] - indptr[u])
+        work = np.empty((factors + 2, max_nnz), dtype=U.dtype)
+        for u in range(lo, hi):
+            item_inds = indices[indptr[u] : indptr[u + 1]]
+            item_ratings = data[indptr[u] : indptr[u + 1]]
+            _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization, work)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--ratings", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    user_items = create_user_items(
+        user_count=args.users,
+        item_count=args.items,
+        data_count=args.ratings,
+        random_seed=1,
+        power_law_exponent=1.0,
+    )
+    indptr = user_items.indptr.astype(np.int64)
+    indices, data = user_items.indices, user_items.data
+    n_chunks = 64
+    print("factors  alloc(sec)  row(sec)  factor(sec)")
+    for factors in [32, 64, 128, 256]:
+        rng = np.random.default_rng(1)
+        U0 = rng.normal(0, 0.01, (args.users, factors))
+        V = rng.normal(0, 0.01, (args.items, factors))
+        Wi = np.full(args.items, 10 / args.items)
+        SV = (V.T * Wi) @ V
+        times = []
+        for sweep, extra_args in [
+            (_sweep_alloc, ()),
+            (_sweep_row, (n_chunks,)),
+            (_sweep_factor, (n_chunks,)),
+        ]:
+            # compile
+            sweep(indptr, indices, data, U0.copy(), V, SV, Wi, factors, 0.01, *extra_args)
+            best = np.inf
+            for _ in range(args.repeat):
+                U = U0.copy()
+                timer = Timer()
+                sweep(indptr, indices, data, U, V, SV, Wi, factors, 0.01, *extra_args)
+                best = min(best, timer.elapsed())
+            times.append(best)
+        print(f"{factors:7d} {times[0]:11.3f} {times[1]:9.3f} {times[2]:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Latency of update_model() per event, fused into one kernel call or step by step
+
+Usage: poetry run python benchmarks/online.py [--users N] [--items N] [--ratings N]
+
+"stepwise" replays the former update_model(): the rating is inserted with
+InteractionStore.set_row(), and U[u], SU, V[i] and SV are updated by separate calls for each
+of the num_iter_online iterations. "fused" is update_model(), which inserts the rating,
+updates the weight of the item and runs all the iterations in a single kernel call.
+Both update the same random events of existing users and items, and new ones.
+"""
+import argparse
+
+import numpy as np
+
+from eals import ElementwiseAlternatingLeastSquares, warmup
+from eals.util import Timer, create_user_items
+
+
+def update_stepwise(model, u, i):
+    model._convert_data_for_online_training()
+    model._expand_data(u, i)
+    model._user_items.set_row(u, np.array([i], dtype=np.int32), 1)
+    model._user_items_t.set_row(i, np.array([u], dtype=np.int32), 1)
+    if model.Wi[i] == 0:
+        model.Wi[i] = model.w0 / model.item_count
+        model._SV.update(np.zeros(model.factors), model.V[i], model.Wi[i])
+    for _ in range(model.num_iter_online):
+        model._update_SU(u, model._update_user(u))
+        model._update_SV(i, model._update_item(i))
+    model._maintain_grams()
+
+
+def update_fused(model, u, i):
+    model.update_model(u, i)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--items", type=int, default=5_000)
+    parser.add_argument("--ratings", type=int, default=200_000)
+    parser.add_argument("--events", type=int, default=2_000)
+    args = parser.parse_args()
+
+    user_items = create_user_items(
+        user_count=args.users, item_count=args.items, data_count=args.ratings, random_seed=1
+    )
+    warmup()
+    rng = np.random.default_rng(1)
+    users = rng.integers(0, args.users, args.events).tolist()
+    items = rng.integers(0, args.items, args.events).tolist()
+    print("factors  path      existing(us)  new(us)")
+    for factors in [32, 64, 128, 256]:
+        for name, update in [("stepwise", update_stepwise), ("fused", update_fused)]:
+            model = ElementwiseAlternatingLeastSquares(
+                factors=factors, num_iter=1, random_state=1
+            )
+            model.fit(user_items)
+            # compile for this factor size
+            update(model, 0, 0)
+            timer = Timer()
+            for u, i in zip(users, items):
+                update(model, u, i)
+            existing = timer.elapsed() / args.events
+            timer = Timer()
+            for k in range(args.events // 10):
+                update(model, args.users + k, args.items + k)
+            new = timer.elapsed() / (args.events // 10)
+            print(f"{factors:7d}  {name:8s} {existing * 1e6:13.1f} {new * 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Thread scaling of the batch sweeps for "static" and "balanced" schedules
+
+Usage: poetry run python benchmarks/schedule.py [--users N] [--items N] [--ratings N]
+                                                [--exponent S]
+
+The rating matrix is synthetic power-law data from util.create_user_items(), where a few
+users and items have most of the ratings as in the Amazon reviews datasets.
+Besides the wall time, the "imbalance" column shows the cost of the busiest thread divided by
+the average cost per thread, which is 1.0 for perfectly balanced sweeps.
+"""
+import argparse
+
+import numba
+import numpy as np
+
+from eals import ElementwiseAlternatingLeastSquares
+from eals.util import Timer, create_user_items
+
+
+def imbalance(model, store, chunks, n_threads):
+    """Cost of the busiest thread / average cost per thread
+
+    prange gives each thread a contiguous range of chunks of the same length.
+    """
+    order, chunk_ptr = chunks
+    costs = store.row_lengths()[order] + model.factors
+    chunk_costs = np.add.reduceat(costs, chunk_ptr[:-1]) * (np.diff(chunk_ptr) > 0)
+    thread_costs = [c.sum() for c in np.array_split(chunk_costs, n_threads)]
+    return max(thread_costs) / np.mean(thread_costs)
+
+
+def run(user_items, schedule, n_threads, factors, num_iter):
+    numba.set_num_threads(n_threads)
+    model = ElementwiseAlternatingLeastSquares(
+        factors=factors, num_iter=num_iter, schedule=schedule, random_state=1
+    )
+    model._init_data(user_items)
+    # compile the kernels before timing
+    model._update_user_and_SU_all()
+    model._update_item_and_SV_all()
+
+    timer = Timer()
+    for _ in range(num_iter):
+        model._update_user_and_SU_all()
+        model._update_item_and_SV_all()
+    elapsed = timer.elapsed() / num_iter
+    user_imbalance = imbalance(model, model._user_items, model._user_chunks, n_threads)
+    item_imbalance = imbalance(model, model._user_items_t, model._item_chunks, n_threads)
+    return elapsed, user_imbalance, item_imbalance
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--items", type=int, default=20_000)
+    parser.add_argument("--ratings", type=int, default=2_000_000)
+    parser.add_argument("--exponent", type=float, default=1.0)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--num-iter", type=int, default=3)
+    args = parser.parse_args()
+
+    user_items = create_user_items(
+        user_count=args.users,
+        item_count=args.items,
+        data_count=args.ratings,
+        random_seed=1,
+        power_law_exponent=args.exponent,
+    )
+    item_nnz = np.sort(user_items.getnnz(axis=0))[::-1]
+    print(f"{user_items.shape} matrix with {user_items.nnz} ratings")
+    print(f"top 1% items hold {item_nnz[: len(item_nnz) // 100].sum() / user_items.nnz:.0%}")
+
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    thread_counts = sorted({1, max_threads} | {2 ** k for k in range(8) if 2 ** k < max_threads})
+    print("threads schedule  sec/iter  imbalance(user)  imbalance(item)")
+    for n_threads in thread_counts:
+        for schedule in ["static", "balanced"]:
+            elapsed, user_imbalance, item_imbalance = run(
+                user_items, schedule, n_threads, args.factors, args.num_iter
+            )
+            print(
+                f"{n_threads:7d} {schedule:8s} {elapsed:9.3f} "
+                f"{user_imbalance:16.2f} {item_imbalance:16.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Speedup of ShardedTrainer over fit() with the number of worker processes
+
+Usage: poetry run python benchmarks/sharded.py [--users N] [--items N] [--ratings N]
+
+Each worker gets cpu_count / n_workers Numba threads, so that all the runs use the same cores.
+The time of ShardedTrainer includes starting the workers and copying the arrays to shared
+memory, which fit() does not need.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from eals import ElementwiseAlternatingLeastSquares, ShardedTrainer, warmup
+from eals.util import Timer, create_user_items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--items", type=int, default=20_000)
+    parser.add_argument("--ratings", type=int, default=2_000_000)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--num-iter", type=int, default=5)
+    args = parser.parse_args()
+
+    user_items = create_user_items(
+        user_count=args.users,
+        item_count=args.items,
+        data_count=args.ratings,
+        random_seed=1,
+        power_law_exponent=1.0,
+    )
+    # compile the kernels for this process and, through the cache, for the workers
+    warmup()
+
+    n_cpus = os.cpu_count() or 1
+    model = ElementwiseAlternatingLeastSquares(
+        factors=args.factors, num_iter=args.num_iter, random_state=1
+    )
+    timer = Timer()
+    model.fit(user_items)
+    baseline = timer.elapsed()
+    print("workers  sec/iter  speedup  max|U - U_fit|")
+    print(f"{'fit()':>7s} {baseline / args.num_iter:9.3f} {1:8.2f}")
+
+    n_workers = 1
+    while n_workers <= n_cpus:
+        sharded = ElementwiseAlternatingLeastSquares(
+            factors=args.factors, num_iter=args.num_iter, random_state=1
+        )
+        trainer = ShardedTrainer(n_workers, threads_per_worker=max(1, n_cpus // n_workers))
+        timer = Timer()
+        trainer.fit(sharded, user_items)
+        elapsed = timer.elapsed()
+        error = np.abs(sharded.U - model.U).max()
+        print(
+            f"{n_workers:7d} {elapsed / args.num_iter:9.3f} {baseline / elapsed:8.2f} "
+            f"{error:15.2e}"
+        )
+        n_workers *= 2
+
+
+if __name__ == "__main__":
+    main()
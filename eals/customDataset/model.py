@@ -6,6 +6,8 @@ from eals import ElementwiseAlternatingLeastSquares, load_model
 
 BASE_DIR = os.path.dirname(__file__)
 MODEL_PATH = os.path.join(BASE_DIR, "amazonMovies.joblib")
+# iterations between checkpoints, each of which writes the whole uncompressed model
+CHECKPOINT_INTERVAL = 5
 
 def load_ratings(dataset_filename):
     dataset_path = os.path.join("datasets", dataset_filename)
@@ -29,11 +31,46 @@ def load_ratings(dataset_filename):
     ratings = sps.csr_matrix((vals, (rows, cols)), shape=(num_users, num_items), dtype=np.float32)
     return ratings
 
+def load_checkpoint(checkpoint_path, train_data):
+    # a checkpoint is only resumed on the data it was written for
+    model = load_model(checkpoint_path)
+    train_data = sps.csr_matrix(train_data)
+    train_data.sum_duplicates()
+    if model.user_items.shape != train_data.shape or model.user_items.nnz != train_data.nnz:
+        print(f"Discarding {checkpoint_path} written for other training data")
+        os.remove(checkpoint_path)
+        return None
+    return model
+
 def fit_model(train_data, num_iter=5):
     print("Training model on custom dataset...")
-    model = ElementwiseAlternatingLeastSquares(num_iter=num_iter, alpha=0, w0=160)
-    model.fit(train_data, show_loss=True)
+    checkpoint_path = MODEL_PATH + ".checkpoint"
+    model = None
+    if os.path.exists(checkpoint_path):
+        model = load_checkpoint(checkpoint_path, train_data)
+    if model is not None:
+        # resume the interrupted training
+        print(f"Resuming from {checkpoint_path}")
+        warm_start = True
+    elif os.path.exists(MODEL_PATH):
+        # start from the previous model so that only new users and items start from scratch
+        print(f"Warm-starting from {MODEL_PATH}")
+        model = load_model(MODEL_PATH)
+        model.num_iter = num_iter
+        warm_start = True
+    else:
+        model = ElementwiseAlternatingLeastSquares(num_iter=num_iter, alpha=0, w0=160)
+        warm_start = False
+    model.fit(
+        train_data,
+        show_loss=True,
+        warm_start=warm_start,
+        checkpoint_file=checkpoint_path,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+    )
     model.save(MODEL_PATH)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
     print(f"Model saved to {MODEL_PATH}")
     return model
 
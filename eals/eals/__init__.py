@@ -1,6 +1,31 @@
 import importlib.metadata
 
-from .eals import ElementwiseAlternatingLeastSquares, load_model
+from .eals import (
+    ElementwiseAlternatingLeastSquares,
+    MmapInteractions,
+    TrainingTelemetry,
+    load_model,
+    warmup,
+)
+from .cache import ModelCache
+from .inference import InferenceModel
+from .journal import JournaledModel
+from .manager import ModelManager
+from .search import HyperparameterSearch
+from .sharded import ShardedTrainer
 
 __version__ = "1.0.0"          
-__all__ = ["ElementwiseAlternatingLeastSquares", "load_model", "__version__"]
+__all__ = [
+    "ElementwiseAlternatingLeastSquares",
+    "HyperparameterSearch",
+    "InferenceModel",
+    "JournaledModel",
+    "MmapInteractions",
+    "ModelCache",
+    "ModelManager",
+    "ShardedTrainer",
+    "TrainingTelemetry",
+    "load_model",
+    "warmup",
+    "__version__",
+]
@@ -0,0 +1,179 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, List, Union
+
+from .inference import InferenceModel
+
+
+class ModelCache:
+    """LRU cache of the InferenceModels of many tenants under a memory budget
+
+    get() opens the directory of a tenant written by export_inference() memory-mapped on first
+    use, so that a tenant is served without reading its files, from the page cache which the
+    kernel shares and shrinks under memory pressure.
+    A background thread then reads the arrays of the tenants requested into memory, and evicts
+    the least recently used ones when the sum of their sizes (see memory_report()) exceeds
+    max_bytes. Evicted tenants are served from their memory-mapped models again, which get()
+    opens anew, and tenants larger than max_bytes stay memory-mapped.
+    Memory-mapped models are kept only for tenants not held in memory, up to max_mapped of the
+    most recently used ones. Call invalidate() when the directory of a tenant is written
+    again, so that it is served from the new files.
+    Requests keep the model they got when it is evicted, dropped or replaced.
+
+    Parameters
+    ----------
+    path_of: Callable[[Hashable], Union[pathlib.Path, str]]
+        Function from a tenant to the directory of its model
+    max_bytes: int
+        Memory budget of the arrays of the tenants held in memory
+    background: bool
+        Read the tenants requested by get() into memory (default); otherwise only prefetch()
+        does
+    max_mapped: int
+        The number of memory-mapped models kept for the tenants not held in memory
+    """
+
+    def __init__(
+        self,
+        path_of: Callable[[Hashable], Union[Path, str]],
+        max_bytes: int = 1 << 30,
+        background: bool = True,
+        max_mapped: int = 64,
+    ) -> None:
+        self.path_of = path_of
+        self.max_bytes = max_bytes
+        self.background = background
+        self.max_mapped = max_mapped
+        self.evictions = 0
+        self._resident: "OrderedDict[Hashable, InferenceModel]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._resident_bytes = 0
+        self._mapped: "OrderedDict[Hashable, InferenceModel]" = OrderedDict()
+        # incremented by invalidate(), so that the models being opened meanwhile are not kept
+        self._versions: Dict[Hashable, int] = {}
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eals-cache")
+
+    @property
+    def resident(self) -> List[Hashable]:
+        """Tenants held in memory, from the least to the most recently used"""
+        with self._lock:
+            return list(self._resident)
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._resident_bytes
+
+    def get(self, key: Hashable) -> InferenceModel:
+        """Return the model of a tenant, from memory if it is held there"""
+        with self._lock:
+            model = self._resident.get(key)
+            if model is not None:
+                self._resident.move_to_end(key)
+                return model
+        model = self._open(key)
+        if self.background:
+            self._submit(key)
+        return model
+
+    @property
+    def mapped(self) -> List[Hashable]:
+        """Tenants with a memory-mapped model, from the least to the most recently used"""
+        with self._lock:
+            return list(self._mapped)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop the models of a tenant, e.g. after its directory has been exported again
+
+        The next get() opens the new files, and a read into memory running meanwhile reads
+        them again.
+        """
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._mapped.pop(key, None)
+            if self._resident.pop(key, None) is not None:
+                self._resident_bytes -= self._sizes.pop(key)
+
+    def prefetch(self, keys: Iterable[Hashable], wait: bool = False) -> None:
+        """Read the models of tenants into memory, e.g. of the recently active ones
+
+        Parameters
+        ----------
+        keys: Iterable[Hashable]
+            Tenants, from the least to the most recently active
+        wait: bool
+            Wait for the models to be read, raising the errors of reading them
+        """
+        futures = [self._submit(key) for key in keys]
+        if wait:
+            for future in futures:
+                future.result()
+
+    def wait(self) -> None:
+        """Wait for the models being read into memory"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception()
+
+    def close(self) -> None:
+        """Stop the background thread after the models being read"""
+        self._executor.shutdown(wait=True)
+
+    def _open(self, key: Hashable) -> InferenceModel:
+        """Return the memory-mapped model of a tenant"""
+        with self._lock:
+            model = self._mapped.get(key)
+            if model is not None:
+                self._mapped.move_to_end(key)
+                return model
+            version = self._versions.get(key, 0)
+        model = InferenceModel.load(self.path_of(key), mmap=True)
+        with self._lock:
+            if self._versions.get(key, 0) == version and key not in self._resident:
+                model = self._mapped.setdefault(key, model)
+                self._mapped.move_to_end(key)
+                while len(self._mapped) > self.max_mapped:
+                    self._mapped.popitem(last=False)
+        return model
+
+    def _submit(self, key: Hashable) -> Future:
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._load, key)
+                self._pending[key] = future
+            return future
+
+    def _load(self, key: Hashable) -> None:
+        try:
+            while True:
+                with self._lock:
+                    if key in self._resident:
+                        self._resident.move_to_end(key)
+                        return
+                    version = self._versions.get(key, 0)
+                # the sizes of the memory-mapped arrays are those of the arrays read
+                size = self._open(key).memory_report()["total"]
+                if size > self.max_bytes:
+                    return
+                model = InferenceModel.load(self.path_of(key), mmap=False)
+                with self._lock:
+                    # the files read may be older than an invalidate() meanwhile
+                    if self._versions.get(key, 0) != version:
+                        continue
+                    self._resident[key] = model
+                    self._sizes[key] = size
+                    self._resident_bytes += size
+                    self._mapped.pop(key, None)
+                    while self._resident_bytes > self.max_bytes:
+                        evicted, _ = self._resident.popitem(last=False)
+                        self._resident_bytes -= self._sizes.pop(evicted)
+                        self.evictions += 1
+                    return
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
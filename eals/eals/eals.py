@@ -1,33 +1,28 @@
-import gc
 import os
-from distutils.util import strtobool
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import numpy as np
 import scipy.sparse as sps
 
-
-
-_USE_NUMBA = bool(strtobool(os.environ.get("USE_NUMBA", "True")))
-_USE_NUMBA_PARALLEL = bool(strtobool(os.environ.get("USE_NUMBA_PARALLEL", "True")))
-
-if _USE_NUMBA:
-    from numba import njit, prange
-else:
-    prange = range
-
-    def njit(*args, **kwargs):
-        def nojit(f):
-            return f
-
-        return nojit
-
-import sys
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../eals")))
-
-from serializer import deserialize_eals_joblib, serialize_eals_joblib
-from util import Timer
+from .gram import GramMatrix, _update_symmetric
+from .interactions import InteractionStore, MmapInteractions
+from .jit import (
+    _USE_FACTOR_MAJOR,
+    _USE_NUMBA_CACHE,
+    _USE_NUMBA_PARALLEL,
+    get_num_threads,
+    njit,
+    prange,
+)
+from .serializer import (
+    deserialize_eals_directory,
+    deserialize_eals_joblib,
+    serialize_eals_directory,
+    serialize_eals_joblib,
+)
+from .telemetry import TrainingTelemetry
+from .util import Timer
 
 
 class ElementwiseAlternatingLeastSquares:
@@ -51,8 +46,23 @@ class ElementwiseAlternatingLeastSquares:
         The number of iterations for batch training
     num_iter_online: int
         The number of iterations for online training
+    tol: float
+        Tolerance for early stopping of batch training.
+        fit() stops when the relative decrease of the loss is less than tol
+        for patience consecutive iterations. 0 (default) disables early stopping.
+    patience: int
+        The number of iterations without sufficient improvement before fit() stops
+    schedule: str
+        How the parallel sweeps of batch training split users and items among threads.
+        "balanced" (default) gives each thread chunks of rows with about the same number of
+        ratings, which matters for skewed data where a few items have most of the ratings.
+        "static" splits rows in index order into chunks of the same number of rows.
+        Rating matrices on disk are always split into blocks of consecutive rows.
     dtype: type
         Data type of the rating matrix passed to fit()
+    factor_dtype: type
+        Data type of the latent vectors and the weights derived from them.
+        np.float32 halves the memory and the file size of the model.
     random_state: int
         Numpy random seed
 
@@ -62,6 +72,8 @@ class ElementwiseAlternatingLeastSquares:
         Latent vectors for users
     item_factors: numpy.ndarray
         Latent vectors for items
+    telemetry: TrainingTelemetry
+        Timings, throughput and memory of the last fit() and the online training since
 
     Notes
     ----------
@@ -70,6 +82,30 @@ class ElementwiseAlternatingLeastSquares:
     - https://github.com/hexiangnan/sigir16-eals
     """
 
+    # the number of ratings per block of the sweeps over a rating matrix on disk
+    _BLOCK_NNZ = 1 << 24
+    # relative change of the sum of the item popularities which rescales all the weights
+    # (see _update_item_weights())
+    _WEIGHT_RESCALE_TOL = 0.01
+    # events of update_model() between the checks of the error bounds of SU and SV, each of
+    # which computes their traces; an event adds a bound of a few ulps of its vectors
+    _GRAM_CHECK_INTERVAL = 64
+    # parameters of __init__() saved in the header of the directory format other than the dtypes
+    _HYPERPARAMETERS = [
+        "factors",
+        "w0",
+        "alpha",
+        "regularization",
+        "init_mean",
+        "init_stdev",
+        "num_iter",
+        "num_iter_online",
+        "tol",
+        "patience",
+        "schedule",
+        "random_state",
+    ]
+
     def __init__(
         self,
         factors: int = 64,
@@ -80,22 +116,35 @@ class ElementwiseAlternatingLeastSquares:
         init_stdev: float = 0.01,
         num_iter: int = 50,
         num_iter_online: int = 1,
+        tol: float = 0.0,
+        patience: int = 1,
+        schedule: str = "balanced",
         dtype: type = np.float32,
+        factor_dtype: type = np.float64,
         random_state: Optional[int] = None,
     ) -> None:
-        self.factors = factors
+        # the kernels are compiled for int and float scalars (see warmup())
+        self.factors = int(factors)
         self.w0 = w0
         self.alpha = alpha
-        self.regularization = regularization
+        self.regularization = float(regularization)
         self.init_mean = init_mean
         self.init_stdev = init_stdev
         self.num_iter = num_iter
         self.num_iter_online = num_iter_online
+        self.tol = tol
+        self.patience = patience
+        if schedule not in ("static", "balanced"):
+            raise ValueError(f"schedule must be 'static' or 'balanced', not '{schedule}'")
+        self.schedule = schedule
         self.dtype = dtype
+        self.factor_dtype = factor_dtype
         self.random_state = random_state
 
-        # "batch" (use csr/csc matrix) or "online" (use lil matrix)
+        # "batch" (interaction stores are compacted into csr/csc matrices)
+        # or "online" (interaction stores accept appends)
         self._training_mode = "batch"
+        self.telemetry = TrainingTelemetry()
 
     @property
     def user_factors(self) -> np.ndarray:
@@ -105,49 +154,214 @@ class ElementwiseAlternatingLeastSquares:
     def item_factors(self) -> np.ndarray:
         return self.V
 
+    # U, V and Wi are views of preallocated arrays (_U, _V and _Wi) whose capacity may exceed
+    # user_count or item_count. See _expand_data().
+
     @property
-    def user_items(self) -> sps.spmatrix:
-        if self._training_mode == "batch":
-            return self._user_items
-        if self._training_mode == "online":
-            return self._user_items_lil
-        raise NotImplementedError(
-            f"property user_items for self._training_mode='{self._training_mode}' is not defined"
-        )
+    def U(self) -> np.ndarray:
+        return self._U[: self.user_count]
+
+    @U.setter
+    def U(self, U: np.ndarray) -> None:
+        self._U = U
+
+    @property
+    def V(self) -> np.ndarray:
+        return self._V[: self.item_count]
+
+    @V.setter
+    def V(self, V: np.ndarray) -> None:
+        self._V = V
+
+    @property
+    def Wi(self) -> np.ndarray:
+        return self._Wi[: self.item_count]
+
+    @Wi.setter
+    def Wi(self, Wi: np.ndarray) -> None:
+        self._Wi = Wi
+
+    # SU and SV are the matrices of Gram caches (_SU and _SV) which keep them in float64 under
+    # online updates. See _maintain_grams().
+
+    @property
+    def SU(self) -> np.ndarray:
+        return self._SU.matrix
+
+    @SU.setter
+    def SU(self, SU: np.ndarray) -> None:
+        self._SU = GramMatrix(SU)
+
+    @property
+    def SV(self) -> np.ndarray:
+        return self._SV.matrix
+
+    @SV.setter
+    def SV(self, SV: np.ndarray) -> None:
+        self._SV = GramMatrix(SV)
+
+    @property
+    def user_items(self) -> sps.csr_matrix:
+        return self._user_items.to_csr()
+
+    # the item-major store is not saved with the model and is rebuilt from the user-major
+    # store on first use. See __getstate__().
+
+    @property
+    def _user_items_t(self) -> InteractionStore:
+        if self._item_store is None:
+            self._item_store = InteractionStore.from_csr(self._user_items.to_csr().tocsc().T)
+        return self._item_store
+
+    @_user_items_t.setter
+    def _user_items_t(self, store: InteractionStore) -> None:
+        self._item_store = store
 
     def fit(
-        self, user_items: sps.spmatrix, show_loss: bool = False, postprocess: bool = True
+        self,
+        user_items: Union[sps.spmatrix, MmapInteractions],
+        show_loss: bool = False,
+        postprocess: bool = True,
+        callbacks: Optional[List[Callable[..., Optional[bool]]]] = None,
+        warm_start: bool = False,
+        checkpoint_file: Optional[Union[Path, str]] = None,
+        checkpoint_interval: int = 0,
     ) -> None:
-        """Fit the model to the given rating data from scratch
+        """Fit the model to the given rating data from scratch or from the current model
 
         Parameters
         ----------
-        user_items: scipy.sparse.spmatrix
-            Rating matrix for user-item pairs
+        user_items: Union[scipy.sparse.spmatrix, MmapInteractions]
+            Rating matrix for user-item pairs.
+            For a matrix on disk (MmapInteractions), the sweeps stream over the files
+            in blocks of rows and only the latent vectors and the weights are kept in memory.
         show_loss: bool
             Whether to compute and print the loss after each iteration
         postprocess: bool
-            If True, change the format of the rating matrix from CSR to LIL
+            If True, switch the rating matrix to online mode
             in order to update_model() after fit().
-            This postprocessing may add some performance overhead for large data.
+            This is cheap because no data is copied until the first update.
+        callbacks: List[Callable[[ElementwiseAlternatingLeastSquares, int, float], Optional[bool]]]
+            Functions called as callback(model, iter, loss) after each iteration,
+            where loss is the loss per nonzero element of user_items.
+            Training stops if any of them returns True.
+        warm_start: bool
+            If True, start from the latent vectors of the current model for known users and
+            items. If the model was loaded from a checkpoint of an interrupted fit(), the
+            remaining iterations of that fit() are run.
+        checkpoint_file: Union[pathlib.Path, str]
+            File to save the model to every checkpoint_interval iterations
+        checkpoint_interval: int
+            The number of iterations between checkpoints. 0 (default) disables checkpoints.
         """
-        self._init_data(user_items)
+        self._init_data(user_items, warm_start=warm_start)
+        self._run_iterations(
+            self._update_user_and_SU_all,
+            self._update_item_and_SV_all,
+            show_loss=show_loss,
+            callbacks=callbacks,
+            checkpoint_file=checkpoint_file,
+            checkpoint_interval=checkpoint_interval,
+        )
+        if postprocess:
+            self._convert_data_for_online_training()
 
+    def _run_iterations(
+        self,
+        update_users: Callable[[], None],
+        update_items: Callable[[], float],
+        show_loss: bool = False,
+        callbacks: Optional[List[Callable[..., Optional[bool]]]] = None,
+        checkpoint_file: Optional[Union[Path, str]] = None,
+        checkpoint_interval: int = 0,
+    ) -> None:
+        """Run the iterations of fit() after _init_data()
+
+        update_users() and update_items() sweep over all users and items like
+        _update_user_and_SU_all() and _update_item_and_SV_all().
+        """
         timer = Timer()
-        for iter in range(self.num_iter):
-            self._update_user_and_SU_all()
+        callbacks = callbacks or []
+        prev_loss = np.inf
+        stalled_iters = 0
+        for iter in range(self._resume_iter, self.num_iter):
+            phase_timer = Timer()
+            update_users()
+            self._record_phase(iter + 1, "update_user", phase_timer.elapsed())
             if show_loss:
                 self._print_loss(iter + 1, "update_user", timer.elapsed())
-            self._update_item_and_SV_all()
+            phase_timer = Timer()
+            observed_loss = update_items()
+            self._record_phase(iter + 1, "update_item", phase_timer.elapsed())
+            self.telemetry.record_memory(
+                {key: size for key, size in self.memory_report().items() if key != "total"}
+            )
             if show_loss:
                 self._print_loss(iter + 1, "update_item", timer.elapsed())
 
-        if postprocess:
-            self._convert_data_for_online_training()
+            if checkpoint_file is not None and checkpoint_interval > 0:
+                if (iter + 1) % checkpoint_interval == 0:
+                    self._save_checkpoint(checkpoint_file, iter + 1)
+
+            if not callbacks and self.tol <= 0:
+                continue
+            loss = self._loss_per_rating(self._fused_loss(observed_loss))
+            stop = any([callback(self, iter + 1, loss) for callback in callbacks])
+            if self.tol > 0:
+                if prev_loss - loss < self.tol * abs(prev_loss):
+                    stalled_iters += 1
+                else:
+                    stalled_iters = 0
+                stop = stop or stalled_iters >= self.patience
+            prev_loss = loss
+            if stop:
+                break
+
+        self._resume_iter = 0
+
+    def _record_phase(self, iteration: int, phase: str, seconds: float) -> None:
+        self.telemetry.record_phase(
+            iteration, phase, seconds, self._user_items.nnz, get_num_threads()
+        )
+
+    def memory_report(self) -> Dict[str, int]:
+        """Bytes held by each component of the model
+
+        U, V and Wi include their spare capacity (see _expand_data()), SU and SV include the
+        compensation of the Gram caches, and user_items and item_users include the pools of the
+        interaction stores. item_users is 0 while the item-major store of a loaded model has not
+        been rebuilt yet, and chunks are the schedules of the parallel sweeps.
+        Arrays memory-mapped from files are counted at their full size.
+
+        Returns a dict from the names of the components to their sizes, with their sum as total.
+        """
+        chunks = [a for c in [self._user_chunks, self._item_chunks] if c is not None for a in c]
+        report = {
+            "U": self._U.nbytes,
+            "V": self._V.nbytes,
+            "Wi": self._Wi.nbytes,
+            "SU": self._SU.matrix.nbytes + self._SU.compensation.nbytes,
+            "SV": self._SV.matrix.nbytes + self._SV.compensation.nbytes,
+            "user_items": self._user_items.nbytes,
+            "item_users": self._item_store.nbytes if self._item_store is not None else 0,
+            "chunks": sum(a.nbytes for a in chunks),
+        }
+        report["total"] = sum(report.values())
+        return report
+
+    def _save_checkpoint(self, file: Union[Path, str], completed_iter: int) -> None:
+        """Save the model during fit() so that fit(warm_start=True) can resume from it"""
+        self._resume_iter = completed_iter
+        # write to a temporary file first not to leave a broken checkpoint
+        tmp_file = Path(f"{file}.tmp")
+        self.save(tmp_file, compress=False)
+        os.replace(tmp_file, file)
 
     def update_model(self, u: int, i: int, show_loss: bool = False) -> None:
         """Update the model for single, possibly new user-item pair
 
+        The weight Wi of the item follows its number of ratings as in fit().
+
         Parameters
         ----------
         u: int
@@ -161,125 +375,453 @@ class ElementwiseAlternatingLeastSquares:
         timer = Timer()
         self._convert_data_for_online_training()
         self._expand_data(u, i)
-        self._user_items_lil[u, i] = 1
-        self._user_items_lil_t[i, u] = 1
-        # a new item
-        if self.Wi[i] == 0:
-            # NOTE: This update rule for Wi does not seem to be described in the paper.
-            self.Wi[i] = self.w0 / self.item_count
-            for f in range(self.factors):
-                for k in range(f + 1):
-                    val = self.SV[f, k] + self.V[i, f] * self.V[i, k] * self.Wi[i]
-                    self.SV[f, k] = val
-                    self.SV[k, f] = val
-
-        for _ in range(self.num_iter_online):
-            old_user_vec = self._update_user(u)
-            self._update_SU(u, old_user_vec)
-            old_item_vec = self._update_item(i)
-            self._update_SV(i, old_item_vec)
+        user_store, item_store = self._user_items, self._user_items_t
+        result = self._update_online_event(u, i)
+        if not result[0]:
+            # the kernel sets the pair in place only in slots of the pools with room for it
+            user_store.reserve_append(u)
+            item_store.reserve_append(i)
+            result = self._update_online_event(u, i)
+            for store in [user_store, item_store]:
+                if store.needs_compaction():
+                    store.compact()
+        _, added, self._popularity_sum, self._popularity_norm, scale = result[:5]
+        user_store.nnz += added
+        item_store.nnz += added
+        if scale != 1.0:
+            self._SV.record_scale(scale)
+        self._SU.record_updates(result[5])
+        self._SV.record_updates(result[6])
+        self._maintain_grams(self._GRAM_CHECK_INTERVAL)
+        self._dirty_users.add(u)
+        self._dirty_items.add(i)
+
+        elapsed = timer.elapsed()
+        self.telemetry.record_online("update_model", elapsed, 1)
+        if show_loss:
+            self._print_loss(1, "update_model", elapsed)
+
+    def _update_online_event(
+        self, u: int, i: int
+    ) -> Tuple[bool, int, float, float, float, float, float]:
+        """Run _update_online_event() on the arrays of the model (see update_model())"""
+        user_store, item_store = self._user_items, self._user_items_t
+        return _update_online_event(
+            u,
+            i,
+            user_store.pool_start,
+            user_store.pool_length,
+            user_store.pool_capacity,
+            user_store.pool_indices,
+            user_store.pool_data,
+            item_store.pool_start,
+            item_store.pool_length,
+            item_store.pool_capacity,
+            item_store.pool_indices,
+            item_store.pool_data,
+            self.U,
+            self.V,
+            self._SU.matrix,
+            self._SU.compensation,
+            self._SV.matrix,
+            self._SV.compensation,
+            self.Wi,
+            self.factors,
+            self.regularization,
+            self.num_iter_online,
+            float(self.w0),
+            float(self.alpha),
+            self._popularity_sum,
+            self._popularity_norm,
+            self._WEIGHT_RESCALE_TOL,
+        )
 
+    def update_model_batch(
+        self, users: np.ndarray, items: np.ndarray, show_loss: bool = False
+    ) -> None:
+        """Update the model for a batch of possibly new user-item pairs
+
+        All pairs are inserted into the rating matrix at once, and then the latent vectors of
+        the distinct users and items in the batch are updated in parallel.
+        Calling this method with a single pair is equivalent to update_model().
+
+        Parameters
+        ----------
+        users: numpy.ndarray
+            User indices
+        items: numpy.ndarray
+            Item indices, in the same order as users
+        show_loss: bool
+            Whether to compute and print the loss after the update.
+            Enabling this option may slow down training.
+        """
+        timer = Timer()
+        users = np.asarray(users, dtype=np.int64).ravel()
+        items = np.asarray(items, dtype=np.int64).ravel()
+        if users.shape != items.shape:
+            raise ValueError("users and items must have the same length")
+        if len(users) == 0:
+            return
+        if users.min() < 0 or items.min() < 0:
+            raise ValueError("user and item indices must be non-negative")
+
+        self._convert_data_for_online_training()
+        self._expand_data(int(users.max()), int(items.max()))
+        touched_users = np.unique(users)
+        touched_items = np.unique(items)
+        old_counts = self._user_items_t.row_lengths(touched_items)
+        self._user_items.set_many(users, items, 1)
+        self._user_items_t.set_many(items, users, 1)
+
+        weight_changes = self._update_item_weights(
+            touched_items, old_counts, self._user_items_t.row_lengths(touched_items)
+        )
+        changed = weight_changes != 0
+        if changed.any():
+            V_changed = self.V[touched_items[changed]]
+            self._SV.update_rows(np.zeros_like(V_changed), V_changed, weight_changes[changed])
+
+        self._dirty_users.update(touched_users.tolist())
+        self._dirty_items.update(touched_items.tolist())
+        self._update_rows(touched_users, touched_items, self.num_iter_online)
+
+        elapsed = timer.elapsed()
+        self.telemetry.record_online("update_model_batch", elapsed, len(users))
         if show_loss:
-            self._print_loss(1, "update_model", timer.elapsed())
-
-    def _init_data(self, user_items: sps.spmatrix) -> None:
-        """Initialize parameters and hyperparameters before batch training"""
-        # coerce user_items to csr matrix with float32 type
-        if not isinstance(user_items, sps.csr_matrix):
-            print("converting user_items to CSR matrix")
-            user_items = user_items.tocsr()
-        if user_items.dtype != self.dtype:
-            print(f"converting type of user_items to {self.dtype}")
-            user_items = user_items.astype(self.dtype)
-
-        self._user_items = user_items
-        self._user_items_csc = self._user_items.tocsc()
-        self.user_count, self.item_count = self._user_items.shape
+            self._print_loss(1, "update_model_batch", elapsed)
+
+    def refit_dirty(
+        self, n_sweeps: int = 1, neighbors: bool = True, show_loss: bool = False
+    ) -> None:
+        """Re-converge the rows changed by online training since the last fit()
+
+        update_model() and update_model_batch() mark the users and items they touch as dirty.
+        This method updates the latent vectors of the dirty users and items, and with
+        neighbors=True also those of the items rated by dirty users and the users who rated
+        dirty items, n_sweeps times. SU and SV are updated incrementally, so the cost depends
+        on the ratings of these rows instead of all users and items.
+        A popular dirty item makes many users neighbors, so neighbors=False is much cheaper
+        on skewed data. The dirty marks are cleared afterwards.
+
+        Parameters
+        ----------
+        n_sweeps: int
+            The number of updates of each latent vector
+        neighbors: bool
+            Whether to update the neighbors of the dirty users and items as well
+        show_loss: bool
+            Whether to compute and print the loss after the update.
+            Enabling this option may slow down training.
+        """
+        timer = Timer()
+        users = np.array(sorted(self._dirty_users), dtype=np.int64)
+        items = np.array(sorted(self._dirty_items), dtype=np.int64)
+        if neighbors:
+            _, items_of_users, _ = self._user_items.rows_csr(users)
+            _, users_of_items, _ = self._user_items_t.rows_csr(items)
+            users = np.union1d(users, users_of_items).astype(np.int64)
+            items = np.union1d(items, items_of_users).astype(np.int64)
+        self._update_rows(users, items, n_sweeps)
+        self._dirty_users.clear()
+        self._dirty_items.clear()
+
+        elapsed = timer.elapsed()
+        self.telemetry.record_online("refit_dirty", elapsed, len(users) + len(items))
+        if show_loss:
+            self._print_loss(n_sweeps, "refit_dirty", elapsed)
+
+    def _update_item_weights(
+        self, items: np.ndarray, old_counts: np.ndarray, new_counts: np.ndarray
+    ) -> np.ndarray:
+        """Update Wi of the distinct items whose numbers of ratings changed by online training
+
+        The weight of an item with the new count c is w0 * c^alpha / sum of the popularities
+        c^alpha of all items, as in _init_data(). The sum is maintained incrementally, and the
+        weights of all the items and SV are rescaled to it lazily, when it has changed by
+        _WEIGHT_RESCALE_TOL since the last rescaling.
+        Returns the changes of Wi[items] in float64, by which the caller must update SV.
+        """
+        self._popularity_sum += float(np.sum(new_counts ** self.alpha - old_counts ** self.alpha))
+        if (
+            abs(self._popularity_sum - self._popularity_norm)
+            > self._WEIGHT_RESCALE_TOL * self._popularity_norm
+        ):
+            scale = self._popularity_norm / self._popularity_sum
+            Wi = self.Wi
+            Wi *= scale
+            self._SV.scale(scale)
+            self._popularity_norm = self._popularity_sum
+        old_weights = self.Wi[items].astype(np.float64)
+        self.Wi[items] = self.w0 * new_counts ** self.alpha / self._popularity_norm
+        weight_changes: np.ndarray = self.Wi[items] - old_weights
+        return weight_changes
+
+    def _update_rows(self, users: np.ndarray, items: np.ndarray, num_iter: int) -> None:
+        """Update the latent vectors of the given distinct users and items num_iter times
+
+        SU and SV are updated incrementally from the old and new vectors.
+        """
+        user_indptr, user_indices, user_data = self._user_items.rows_csr(users)
+        item_indptr, item_indices, item_data = self._user_items_t.rows_csr(items)
+        for _ in range(num_iter):
+            old_user_vecs = self.U[users]
+            _update_user_subset(
+                users,
+                user_indptr,
+                user_indices,
+                user_data,
+                self.U,
+                self.V,
+                self.SV,
+                self.Wi,
+                self.factors,
+                self.regularization,
+                get_num_threads(),
+            )
+            self._SU.update_rows(old_user_vecs, self.U[users])
+
+            old_item_vecs = self.V[items]
+            _update_item_subset(
+                items,
+                item_indptr,
+                item_indices,
+                item_data,
+                self.U,
+                self.V,
+                self.SU,
+                self.Wi,
+                self.factors,
+                self.regularization,
+                get_num_threads(),
+            )
+            self._SV.update_rows(old_item_vecs, self.V[items], self.Wi[items])
+        self._maintain_grams()
+
+    def fold_in_users(
+        self, item_lists: Sequence[Sequence[int]], num_iter: Optional[int] = None
+    ) -> np.ndarray:
+        """Compute latent vectors for users from the items they interacted with
+
+        The vectors are solved against the current item vectors with the same updates as
+        update_model() applies to users, in parallel over the users.
+        Unlike update_model(), the model is not modified, so this serves users unknown to
+        the model without saving it afterwards.
+        Items unknown to the model are ignored.
+
+        Parameters
+        ----------
+        item_lists: Sequence[Sequence[int]]
+            Item indices for each user
+        num_iter: int
+            The number of updates of each vector. num_iter_online by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Latent vectors of shape (len(item_lists), factors)
+        """
+        return _fold_in_users(
+            item_lists,
+            self.V,
+            self.Wi,
+            self.SV,
+            self.regularization,
+            self.num_iter_online if num_iter is None else num_iter,
+            self.dtype,
+        )
+
+    def _init_data(
+        self, user_items: Union[sps.spmatrix, MmapInteractions], warm_start: bool = False
+    ) -> None:
+        """Initialize parameters and hyperparameters before batch training
+
+        If warm_start is True, the latent vectors of the users and items known to the model
+        are kept and only those of new users and items are initialized randomly.
+        """
+        if warm_start and self._is_fitted():
+            old_U, old_V = self.U, self.V
+        else:
+            old_U = old_V = None
+            self._resume_iter = 0
+        if isinstance(user_items, MmapInteractions):
+            # converting the type would load the whole matrix into memory
+            if user_items.dtype != self.dtype:
+                raise ValueError(
+                    f"user_items on disk have type {user_items.dtype}, not {np.dtype(self.dtype)}"
+                )
+            self._user_items = user_items.user_store()
+            self._user_items_t = user_items.item_store()
+            self._out_of_core = True
+        else:
+            # coerce user_items to csr matrix with float32 type
+            if not isinstance(user_items, sps.csr_matrix):
+                print("converting user_items to CSR matrix")
+                user_items = user_items.tocsr()
+            if user_items.dtype != self.dtype:
+                print(f"converting type of user_items to {self.dtype}")
+                user_items = user_items.astype(self.dtype)
+
+            # the transposed store shares the arrays of the csc matrix
+            self._user_items = InteractionStore.from_csr(user_items)
+            self._user_items_t = InteractionStore.from_csr(user_items.tocsc().T)
+            self._out_of_core = False
+        self.user_count, self.item_count = user_items.shape
 
         # item frequencies
-        p = self._user_items_csc.getnnz(axis=0)
+        p = self._user_items_t.row_lengths()
+        # Wi[i] = w0 * p[i]^alpha / sum(p^alpha); the sum is maintained by online training
+        self._popularity_sum = self._popularity_norm = float(np.sum(p ** self.alpha))
         # item popularities
-        p = (p / p.sum()) ** self.alpha
-        # confidence that item i missed by users is a true negative assessment
-        self.Wi = p / p.sum() * self.w0
-
-        # data and weights for online training
-        self._user_items_lil = sps.lil_matrix((0, 0))
-        self._user_items_lil_t = sps.lil_matrix((0, 0))
+        p = (p / max(p.sum(), 1)) ** self.alpha
+        # confidence that item i missed by users is a true negative assessment,
+        # which is zero for all items of a matrix without ratings unless alpha is 0
+        p_sum = p.sum()
+        self.Wi = ((p / p_sum if p_sum > 0 else p) * self.w0).astype(self.factor_dtype)
 
         if self.random_state is not None:
             np.random.seed(self.random_state)
         self.U = self._init_U()
         self.V = self._init_V()
-        self.SU = self.U.T @ self.U
-        self.SV = (self.V.T * self.Wi) @ self.V
+        if old_U is not None and old_V is not None:
+            known_users = min(len(old_U), self.user_count)
+            known_items = min(len(old_V), self.item_count)
+            self.U[:known_users] = old_U[:known_users]
+            self.V[:known_items] = old_V[:known_items]
+        self._SU = GramMatrix.compute(self.U)
+        self._SV = GramMatrix.compute(self.V, self.Wi)
 
         self._training_mode = "batch"
+        self._user_chunks = None
+        self._item_chunks = None
+        # users and items touched by online training since then (see refit_dirty())
+        self._dirty_users: Set[int] = set()
+        self._dirty_items: Set[int] = set()
+        self.telemetry = TrainingTelemetry()
+
+    def _is_fitted(self) -> bool:
+        return hasattr(self, "_U")
 
     def _init_U(self) -> np.ndarray:
         U0: np.ndarray = np.random.normal(
             self.init_mean, self.init_stdev, (self.user_count, self.factors)
-        )
+        ).astype(self.factor_dtype)
         return U0
 
     def _init_V(self) -> np.ndarray:
         V0: np.ndarray = np.random.normal(
             self.init_mean, self.init_stdev, (self.item_count, self.factors)
-        )
+        ).astype(self.factor_dtype)
         return V0
 
     def _convert_data_for_online_training(self) -> None:
-        """convert matrices to lil for online training"""
-        if self._training_mode == "online":
-            return
-        del self._user_items_csc
-        gc.collect()
-
-        self._user_items_lil = self._user_items.tolil()
-        del self._user_items
-        gc.collect()
-        self._user_items_lil_t = self._user_items_lil.T
-
+        """allow appends to the interaction stores for online training"""
         self._training_mode = "online"
+        # the chunks of the parallel sweeps are outdated once rows are appended
+        self._user_chunks = None
+        self._item_chunks = None
 
     def _convert_data_for_batch_training(self) -> None:
-        """convert matrices to csr for batch training"""
+        """compact the interaction stores into csr/csc arrays for batch training"""
         if self._training_mode == "batch":
             return
-
-        del self._user_items_lil_t
-        gc.collect()
-
-        self._user_items = self._user_items_lil.tocsr()
-        del self._user_items_lil
-        gc.collect()
-        self._user_items_csc = self._user_items.tocsc()
-
+        self._user_items.compact()
+        self._user_items_t.compact()
         self._training_mode = "batch"
 
+    def __getstate__(self) -> dict:
+        # U, V and Wi are saved without their spare capacity, and the chunks and the
+        # item-major store are rebuilt on first use. Memory-mapped stores are only references
+        # to their files (see InteractionStore.open()) and are kept.
+        state = self.__dict__.copy()
+        if "_U" in state:
+            state["_U"], state["_V"], state["_Wi"] = self.U, self.V, self.Wi
+        state["_user_chunks"] = state["_item_chunks"] = None
+        item_store = state.get("_item_store")
+        if item_store is not None and item_store._source is None:
+            state["_item_store"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # models saved before capacity management store U, V and Wi directly
+        for key in ["U", "V", "Wi"]:
+            if key in state:
+                state[f"_{key}"] = state.pop(key)
+        state.setdefault("factor_dtype", state["_U"].dtype.type)
+        state.setdefault("tol", 0.0)
+        state.setdefault("schedule", "static")
+        state.setdefault("_user_chunks", None)
+        state.setdefault("_item_chunks", None)
+        state.setdefault("_resume_iter", 0)
+        state.setdefault("patience", 1)
+        state.setdefault("_out_of_core", False)
+        state.setdefault("_dirty_users", set())
+        state.setdefault("_dirty_items", set())
+        state.setdefault("telemetry", TrainingTelemetry())
+        # models saved before the Gram caches store SU and SV as arrays
+        for key in ["SU", "SV"]:
+            if key in state:
+                state[f"_{key}"] = GramMatrix(state.pop(key))
+        # models saved before InteractionStore was introduced hold scipy matrices
+        if "_user_items_lil" in state:
+            if state["_training_mode"] == "online":
+                user_items = state["_user_items_lil"].tocsr()
+            else:
+                user_items = state["_user_items"]
+            for key in ["_user_items_lil", "_user_items_lil_t", "_user_items_csc"]:
+                state.pop(key, None)
+            state["_user_items"] = InteractionStore.from_csr(user_items)
+        # models saved before the item-major store was rebuilt lazily
+        if "_user_items_t" in state:
+            state["_item_store"] = state.pop("_user_items_t")
+        state.setdefault("_item_store", None)
+        self.__dict__.update(state)
+        # models saved before the popularities were maintained start from the current counts
+        if "_popularity_sum" not in state:
+            counts = self._user_items_t.row_lengths()
+            self._popularity_sum = self._popularity_norm = float(np.sum(counts ** self.alpha))
+
     def _update_user(self, u: int) -> sps.spmatrix:
         """Update the user latent vector"""
         self._convert_data_for_online_training()
         old_user_vec = self.U[[u]]
+        item_inds, item_ratings = self._user_items.row(u)
         _update_user(
             u,
-            np.array(self._user_items_lil.rows[u], dtype=np.int32),
-            np.array(self._user_items_lil.data[u], dtype=self.dtype),
+            item_inds,
+            item_ratings,
             self.U,
             self.V,
             self.SV,
             self.Wi,
             self.factors,
             self.regularization,
+            _empty_workspace(self.factors, len(item_inds), self.U.dtype),
         )
         return old_user_vec
 
-    def _update_SU(self, u: int, old_user_vec: sps.spmatrix) -> None:
-        _update_SU(self.SU, old_user_vec, self.U[[u]])
+    def _update_SU(self, u: int, old_user_vec: np.ndarray) -> None:
+        self._SU.update(old_user_vec[0], self.U[u])
 
     def _update_user_and_SU_all(self) -> None:
         self._convert_data_for_batch_training()
+        if self._out_of_core:
+            for block in _row_blocks(self._user_items, self._BLOCK_NNZ):
+                _update_user_subset(
+                    *block,
+                    self.U,
+                    self.V,
+                    self.SV,
+                    self.Wi,
+                    self.factors,
+                    self.regularization,
+                    get_num_threads(),
+                )
+            self._SU.recompute(self.U)
+            return
+        if self._user_chunks is None:
+            self._user_chunks = self._make_chunks(self._user_items)
         _update_user_and_SU_all(
+            *self._user_chunks,
             self._user_items.indptr,
             self._user_items.indices,
             self._user_items.data,
@@ -290,35 +832,69 @@ class ElementwiseAlternatingLeastSquares:
             self.Wi,
             self.factors,
             self.regularization,
-            self.user_count,
         )
+        self._SU.reset_error()
 
     def _update_item(self, i: int) -> sps.spmatrix:
         """Update the item latent vector"""
         self._convert_data_for_online_training()
         old_item_vec = self.V[[i]]
+        user_inds, user_ratings = self._user_items_t.row(i)
         _update_item(
             i,
-            np.array(self._user_items_lil_t.rows[i], dtype=np.int32),
-            np.array(self._user_items_lil_t.data[i], dtype=self.dtype),
+            user_inds,
+            user_ratings,
             self.U,
             self.V,
             self.SU,
             self.Wi,
             self.factors,
             self.regularization,
+            _empty_workspace(self.factors, len(user_inds), self.V.dtype),
         )
         return old_item_vec
 
-    def _update_SV(self, i: int, old_item_vec: sps.spmatrix) -> None:
-        _update_SV(self.SV, old_item_vec, self.V[[i]], self.Wi[i])
+    def _update_SV(self, i: int, old_item_vec: np.ndarray) -> None:
+        self._SV.update(old_item_vec[0], self.V[i], self.Wi[i])
+
+    def _maintain_grams(self, check_every: int = 1) -> None:
+        """Recompute SU or SV if the rounding errors of online updates may have accumulated
+
+        check_every is passed to GramMatrix.needs_recompute().
+        """
+        if self._SU.needs_recompute(check_every):
+            self._SU.recompute(self.U)
+        if self._SV.needs_recompute(check_every):
+            self._SV.recompute(self.V, self.Wi)
 
-    def _update_item_and_SV_all(self) -> None:
+    def _update_item_and_SV_all(self) -> float:
+        """Update all the item latent vectors
+
+        Returns the loss terms of the non-missing user-item pairs as a by-product.
+        """
         self._convert_data_for_batch_training()
-        _update_item_and_SV_all(
-            self._user_items_csc.indptr,
-            self._user_items_csc.indices,
-            self._user_items_csc.data,
+        if self._out_of_core:
+            observed_loss = 0.0
+            for block in _row_blocks(self._user_items_t, self._BLOCK_NNZ):
+                observed_loss += _update_item_subset(
+                    *block,
+                    self.U,
+                    self.V,
+                    self.SU,
+                    self.Wi,
+                    self.factors,
+                    self.regularization,
+                    get_num_threads(),
+                )
+            self._SV.recompute(self.V, self.Wi)
+            return observed_loss
+        if self._item_chunks is None:
+            self._item_chunks = self._make_chunks(self._user_items_t)
+        observed_loss: float = _update_item_and_SV_all(
+            *self._item_chunks,
+            self._user_items_t.indptr,
+            self._user_items_t.indices,
+            self._user_items_t.data,
             self.U,
             self.V,
             self.SU,
@@ -326,33 +902,65 @@ class ElementwiseAlternatingLeastSquares:
             self.Wi,
             self.factors,
             self.regularization,
-            self.item_count,
         )
+        self._SV.reset_error()
+        return observed_loss
+
+    def _make_chunks(self, store: InteractionStore) -> Tuple[np.ndarray, np.ndarray]:
+        """Split the rows of the store into chunks for the parallel sweeps
+
+        Returns (order, chunk_ptr) where the c-th chunk consists of the rows
+        order[chunk_ptr[c] : chunk_ptr[c + 1]].
+        """
+        # prange gives one chunk to each thread
+        n_chunks = get_num_threads()
+        if self.schedule == "static":
+            order = np.arange(store.shape[0], dtype=np.int64)
+            chunk_ptr = np.linspace(0, store.shape[0], n_chunks + 1).astype(np.int64)
+            return order, chunk_ptr
+        # updating a row costs O(factors^2 + nnz * factors)
+        costs = store.row_lengths() + self.factors
+        return _balanced_chunks(costs, n_chunks)
+
+    def _fused_loss(self, observed_loss: float) -> float:
+        """Complete the loss from the by-product of _update_item_and_SV_all()
+
+        The missing data term sum_u U[u] @ SV @ U[u] equals the sum of SV * SU,
+        so this costs O(factors^2) in addition to the squared norm of V.
+        """
+        loss: float = (
+            observed_loss
+            + np.sum(self.SV * self.SU)
+            + (np.trace(self.SU) + np.vdot(self.V, self.V)) * self.regularization
+        )
+        return loss
 
     def _expand_data(self, u: int, i: int) -> None:
-        """Expand matrices for a new user-item pair if necessary"""
-        extra_count = 100
-        if u >= self.user_count:
-            new_user_count = u + extra_count
-        else:
-            new_user_count = self.user_count
-        if i >= self.item_count:
-            new_item_count = i + extra_count
-        else:
-            new_item_count = self.item_count
-
-        if new_user_count > self.user_count or new_item_count > self.item_count:
-            self._user_items_lil.resize(new_user_count, new_item_count)
-            self._user_items_lil_t.resize(new_item_count, new_user_count)
-        if new_user_count > self.user_count:
-            adding_user_count = new_user_count - self.user_count
-            # user_count, factors
-            self.U = np.vstack((self.U, np.zeros((adding_user_count, self.U.shape[1]))))
-        if new_item_count > self.item_count:
-            adding_item_count = new_item_count - self.item_count
-            # item_count, factors
-            self.V = np.vstack((self.V, np.zeros((adding_item_count, self.V.shape[1]))))
-            self.Wi = np.append(self.Wi, np.zeros(adding_item_count))
+        """Expand matrices for a new user-item pair if necessary
+
+        The capacity of U, V and Wi grows geometrically, so that adding users or items
+        one by one costs amortized O(1) per user or item.
+        New users and items get zero latent vectors, and new items the weight of no ratings,
+        which is zero unless alpha is 0.
+        """
+        new_user_count = max(self.user_count, u + 1)
+        new_item_count = max(self.item_count, i + 1)
+        if new_user_count == self.user_count and new_item_count == self.item_count:
+            return
+
+        self._user_items.resize(new_user_count, new_item_count)
+        self._user_items_t.resize(new_item_count, new_user_count)
+        if new_user_count > len(self._U):
+            self._U = _grow_rows(self._U, new_user_count)
+        if new_item_count > len(self._V):
+            self._V = _grow_rows(self._V, new_item_count)
+            self._Wi = _grow_rows(self._Wi, new_item_count)
+        # the popularity 0^alpha of the new items, as in _update_item_weights()
+        zero_popularity = 0.0**self.alpha
+        self._popularity_sum += (new_item_count - self.item_count) * zero_popularity
+        self._Wi[self.item_count : new_item_count] = (
+            self.w0 * zero_popularity / self._popularity_norm if zero_popularity else 0.0
+        )
 
         self.user_count = new_user_count
         self.item_count = new_item_count
@@ -372,17 +980,14 @@ class ElementwiseAlternatingLeastSquares:
                 self.regularization,
             )
         elif self._training_mode == "online":
-            loss = _calc_loss_lil(
-                self._user_items_lil_t.rows,
-                self._user_items_lil_t.data,
+            loss = _calc_loss_store(
+                *self._user_items.arrays(),
                 self.U,
                 self.V,
                 self.SV,
                 self.Wi,
                 self.user_count,
-                self.item_count,
                 self.regularization,
-                self.dtype,
             )
         else:
             raise NotImplementedError(
@@ -390,205 +995,727 @@ class ElementwiseAlternatingLeastSquares:
             )
         return loss
 
+    def _loss_per_rating(self, loss: float) -> float:
+        """Divide the loss by the number of nonzero elements of user_items, if any"""
+        return float(loss) / max(self._user_items.nnz, 1)
+
     def _print_loss(self, iter: int, message: str, elapsed: float) -> None:
         """Print the loss per nonzero element of user_items"""
-        loss = self.calc_loss() / self.user_items.nnz
+        loss = self._loss_per_rating(self.calc_loss())
         print(f"iter={iter} {message} loss={loss:.4f} ({elapsed:.4f} sec)")
 
-    def save(self, file: Union[Path, str], compress: Union[bool, int] = True) -> None:
-        """Save the model in joblib format
+    def save(
+        self, file: Union[Path, str], compress: Union[bool, int] = True, format: str = "joblib"
+    ) -> None:
+        """Save the model in joblib format or as a directory of arrays
 
         Parameters
         ----------
         file: Union[pathlib.Path, str]
-            File to save the model
+            File to save the model, or directory for format="directory"
         compress: Union[bool, int]
             Joblib compression level (0-9).
             False or 0 disables compression.
             True (default) is equal to compression level 3.
+            It is ignored for format="directory".
+        format: str
+            "joblib" (default) for a single pickle, or "directory" for a directory of
+            hyperparameters in header.json and one .npy file per array: U, V, Wi, SU, SV and
+            the rating matrix in the format of MmapInteractions.
+            load_model(mmap=True) opens a directory without reading the arrays.
         """
-        serialize_eals_joblib(file, self, compress=compress)
+        if format == "joblib":
+            serialize_eals_joblib(file, self, compress=compress)
+        elif format == "directory":
+            serialize_eals_directory(file, *self._directory_state())
+        else:
+            raise ValueError(f"format must be 'joblib' or 'directory', not '{format}'")
+
+    def _directory_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """Split the state of the model into a JSON header and arrays for save()"""
+        header: Dict[str, Any] = {
+            name: _json_scalar(getattr(self, name)) for name in self._HYPERPARAMETERS
+        }
+        header.update(
+            kind="model",
+            dtype=np.dtype(self.dtype).name,
+            factor_dtype=np.dtype(self.factor_dtype).name,
+            user_count=self.user_count,
+            item_count=self.item_count,
+            training_mode=self._training_mode,
+            out_of_core=self._out_of_core,
+            resume_iter=self._resume_iter,
+            popularity_sum=self._popularity_sum,
+            popularity_norm=self._popularity_norm,
+            grams={
+                key: {"tol": gram.tol, "drift": gram.drift, "recomputations": gram.recomputations}
+                for key, gram in [("SU", self._SU), ("SV", self._SV)]
+            },
+            telemetry=self.telemetry.to_dict(),
+        )
+        arrays = {
+            "U": self.U,
+            "V": self.V,
+            "Wi": self.Wi,
+            "SU": self._SU.matrix,
+            "SU_compensation": self._SU.compensation,
+            "SV": self._SV.matrix,
+            "SV_compensation": self._SV.compensation,
+            "dirty_users": np.array(sorted(self._dirty_users), dtype=np.int64),
+            "dirty_items": np.array(sorted(self._dirty_items), dtype=np.int64),
+        }
+        for prefix, store in [("user", self._user_items), ("item", self._user_items_t)]:
+            indptr, indices, data = store.to_csr_arrays()
+            arrays.update(
+                {f"{prefix}_indptr": indptr, f"{prefix}_indices": indices, f"{prefix}_data": data}
+            )
+        return header, arrays
+
+    def export_inference(self, path: Union[Path, str]) -> None:
+        """Save what InferenceModel needs to serve recommendations to the directory path
+
+        The directory holds user_factors, item_factors, Wi and SV as .npy files and the
+        hyperparameters of fold_in_users() in header.json, but no rating matrix.
+        InferenceModel.load() memory-maps it.
+
+        Parameters
+        ----------
+        path: Union[pathlib.Path, str]
+            Directory to write the files to
+        """
+        header = {
+            "kind": "inference",
+            "regularization": self.regularization,
+            "num_iter_online": _json_scalar(self.num_iter_online),
+            "dtype": np.dtype(self.dtype).name,
+            "user_count": self.user_count,
+            "item_count": self.item_count,
+        }
+        arrays = {
+            "user_factors": self.user_factors,
+            "item_factors": self.item_factors,
+            "Wi": self.Wi,
+            "SV": self.SV,
+        }
+        serialize_eals_directory(path, header, arrays)
+
+    @classmethod
+    def _from_directory(
+        cls, path: Union[Path, str], mmap: bool = False
+    ) -> "ElementwiseAlternatingLeastSquares":
+        """Load a model saved by save(format="directory")"""
+        header, arrays = deserialize_eals_directory(path, mmap=mmap)
+        if header.get("kind") != "model":
+            raise ValueError(f"{path} is not a model saved by save(); use InferenceModel.load()")
+        model = cls(
+            **{name: header[name] for name in cls._HYPERPARAMETERS},
+            dtype=np.dtype(header["dtype"]).type,
+            factor_dtype=np.dtype(header["factor_dtype"]).type,
+        )
+        model.user_count, model.item_count = header["user_count"], header["item_count"]
+        model.U, model.V, model.Wi = arrays["U"], arrays["V"], arrays["Wi"]
+        for key in ["SU", "SV"]:
+            gram = GramMatrix(arrays[key], header["grams"][key]["tol"])
+            gram.compensation = np.asarray(arrays[f"{key}_compensation"])
+            gram.drift = header["grams"][key]["drift"]
+            gram.recomputations = header["grams"][key]["recomputations"]
+            setattr(model, f"_{key}", gram)
+        if mmap:
+            # the bases of the stores are pickled as references to the files
+            model._user_items = InteractionStore.open(path, "user", model.item_count)
+            model._user_items_t = InteractionStore.open(path, "item", model.user_count)
+        else:
+            model._user_items = InteractionStore(
+                *(arrays[f"user_{key}"] for key in ["indptr", "indices", "data"]),
+                (model.user_count, model.item_count),
+            )
+            model._user_items_t = InteractionStore(
+                *(arrays[f"item_{key}"] for key in ["indptr", "indices", "data"]),
+                (model.item_count, model.user_count),
+            )
+        model._training_mode = header["training_mode"]
+        model._out_of_core = header["out_of_core"]
+        model._resume_iter = header["resume_iter"]
+        model._popularity_sum = header["popularity_sum"]
+        model._popularity_norm = header["popularity_norm"]
+        model._user_chunks = model._item_chunks = None
+        model._dirty_users = set(arrays["dirty_users"].tolist())
+        model._dirty_items = set(arrays["dirty_items"].tolist())
+        model.telemetry = TrainingTelemetry.from_dict(header["telemetry"])
+        return model
+
+
+def _grow_rows(a: np.ndarray, min_rows: int) -> np.ndarray:
+    """Return a zero-padded copy of a with at least min_rows rows and doubled capacity"""
+    rows = max(min_rows, 2 * len(a))
+    grown = np.zeros((rows,) + a.shape[1:], dtype=a.dtype)
+    grown[: len(a)] = a
+    return grown
+
+
+def _fold_in_users(
+    item_lists: Sequence[Sequence[int]],
+    V: np.ndarray,
+    Wi: np.ndarray,
+    SV: np.ndarray,
+    regularization: float,
+    num_iter: int,
+    dtype: type,
+) -> np.ndarray:
+    """Solve the latent vectors of users from their items against the item vectors V
+
+    Items beyond V are ignored, and the ratings are ones of the given dtype.
+    This is fold_in_users() of both ElementwiseAlternatingLeastSquares and InferenceModel.
+    """
+    rows = [np.unique(np.asarray(items, dtype=np.int64)) for items in item_lists]
+    rows = [items[(items >= 0) & (items < len(V))] for items in rows]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(items) for items in rows], out=indptr[1:])
+    indices = np.concatenate(rows).astype(np.int32) if rows else np.zeros(0, np.int32)
+    data = np.ones(len(indices), dtype=dtype)
+
+    users = np.arange(len(rows), dtype=np.int64)
+    factors = V.shape[1]
+    U = np.zeros((len(rows), factors), dtype=V.dtype)
+    for _ in range(num_iter):
+        _update_user_subset(
+            users,
+            indptr,
+            indices,
+            data,
+            U,
+            V,
+            SV,
+            Wi,
+            factors,
+            regularization,
+            get_num_threads(),
+        )
+    return U
+
+
+def _row_blocks(
+    store: InteractionStore, block_nnz: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Split the rows of a compact store into consecutive blocks of about block_nnz elements
+
+    Yields (rows, indptr, indices, data) for the subset kernels, where indices and data are
+    views of the store, so that a memory-mapped store is read block by block.
+    """
+    indptr = store.indptr
+    n_rows = len(indptr) - 1
+    lo = 0
+    while lo < n_rows:
+        hi = int(np.searchsorted(indptr, indptr[lo] + block_nnz, side="right")) - 1
+        hi = min(max(hi, lo + 1), n_rows)
+        yield _row_block(indptr, store.indices, store.data, lo, hi)
+        lo = hi
+
+
+def _row_block(
+    indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, lo: int, hi: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return (rows, indptr, indices, data) of the rows lo to hi - 1 for the subset kernels"""
+    start, end = indptr[lo], indptr[hi]
+    return np.arange(lo, hi), indptr[lo : hi + 1] - start, indices[start:end], data[start:end]
+
+
+def _balanced_chunks(costs: np.ndarray, n_chunks: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Split rows into n_chunks chunks with about the same total cost
+
+    Returns (order, chunk_ptr) as _make_chunks().
+    """
+    by_cost = np.argsort(-costs, kind="stable")
+    chunk_of_row = _assign_chunks(by_cost, costs.astype(np.float64), n_chunks)
+    order = np.argsort(chunk_of_row, kind="stable").astype(np.int64)
+    chunk_ptr = np.zeros(n_chunks + 1, dtype=np.int64)
+    np.cumsum(np.bincount(chunk_of_row, minlength=n_chunks), out=chunk_ptr[1:])
+    return order, chunk_ptr
+
 
+def warmup(dtype: type = np.float32, factor_dtype: type = np.float64) -> None:
+    """Compile the Numba kernels before the first training or update
 
-def load_model(file: Union[Path, str]) -> ElementwiseAlternatingLeastSquares:
-    """Load the model from a joblib file
+    The kernels are compiled on a tiny model, so that they get the same argument types as
+    for models with the given dtype and factor_dtype. Compiled kernels are cached on disk,
+    so that later processes load them instead of compiling them again.
+
+    Parameters
+    ----------
+    dtype: type
+        Data type of the rating matrix of the models to be used
+    factor_dtype: type
+        Data type of the latent vectors of the models to be used
+    """
+    user_items = sps.csr_matrix(np.array([[1, 0, 1], [0, 1, 0]], dtype=dtype))
+    model = ElementwiseAlternatingLeastSquares(
+        factors=2, num_iter=1, dtype=dtype, factor_dtype=factor_dtype, random_state=0
+    )
+    model.fit(user_items)
+    model.calc_loss()
+    # online training with a new user and a new item
+    model.update_model(2, 3)
+    model.update_model_batch(np.array([0, 3]), np.array([1, 4]))
+    model.calc_loss()
+    model.fold_in_users([[0, 1], []])
+
+
+def load_model(file: Union[Path, str], mmap: bool = False) -> ElementwiseAlternatingLeastSquares:
+    """Load the model from a joblib file or a directory saved with save(format="directory")
 
     Parameters
     ----------
     file: Union[pathlib.Path, str]
-        File to load the model from
+        File or directory to load the model from
+    mmap: bool
+        Memory-map the arrays of a directory instead of reading them.
+        The model opens in constant time, and processes loading the same directory share the
+        arrays through the page cache. U, V, Wi, SU and SV are mapped copy-on-write, so that
+        online training changes only the pages it writes, in this process, never the files.
     """
+    if Path(file).is_dir():
+        return ElementwiseAlternatingLeastSquares._from_directory(file, mmap=mmap)
+    if mmap:
+        raise ValueError("mmap=True requires a model saved with save(format='directory')")
     return deserialize_eals_joblib(file)
 
 
+def _json_scalar(value: Any) -> Any:
+    """Convert a numpy scalar to the Python scalar for JSON"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
 # Actual implementation of eALS with Numba JIT
 
 
-@njit(
-    # TODO: Explicit type annotations slow down computation. Why?
-    # "(i8,i4[:],f4[:],f8[:,:],f8[:,:],f8[:,:],f4[:],f8[:],i8,f8)"
-)
-def _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization):
-    # Matrix U will be modified. Other arguments are read-only.
-    if len(item_inds) == 0:
+@njit(cache=_USE_NUMBA_CACHE)
+def _assign_chunks(by_cost, costs, n_chunks):
+    # Longest processing time first: put each row, in descending order of cost,
+    # into the chunk with the least total cost so far.
+    chunk_costs = np.zeros(n_chunks)
+    chunk_of_row = np.empty(len(costs), dtype=np.int64)
+    for r in by_cost:
+        c = np.argmin(chunk_costs)
+        chunk_of_row[r] = c
+        chunk_costs[c] += costs[r]
+    return chunk_of_row
+
+
+# Explicit signatures such as "f8[:,:]" declare arrays of any layout, which made the
+# kernels slower (about 10% for the user sweep, see benchmarks/compile.py). C-contiguous
+# signatures such as "f8[:,::1]" are as fast as lazy compilation, but they would compile
+# every combination of dtype and factor_dtype at import. So the kernels are compiled lazily
+# and the model always passes the same types (C-contiguous arrays, int64 indptr,
+# int32 indices, dtype ratings and factor_dtype factors, int and float scalars);
+# each combination of dtype and factor_dtype is compiled once and cached on disk.
+@njit(cache=_USE_NUMBA_CACHE)
+def _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization, work):
+    # Matrix U and the workspace work will be modified. Other arguments are read-only.
+    # work must have the shape (factors + 2, n) for some n >= len(item_inds).
+    # The item vectors are gathered into it as work[f, i] (see _empty_workspace()).
+    n = len(item_inds)
+    if n == 0:
         return
-    V_items = V[item_inds]
-    pred_items = V_items @ U[u]
+    pred_items = work[factors]
+    w_diff = work[factors + 1]
+    for i in range(n):
+        pred = 0.0
+        for f in range(factors):
+            work[f, i] = V[item_inds[i], f]
+            pred += V[item_inds[i], f] * U[u, f]
+        pred_items[i] = pred
+        w_diff[i] = (item_ratings[i] > 0) - Wi[item_inds[i]]
 
-    w_diff = (item_ratings > 0) - Wi[item_inds]
     for f in range(factors):
-        numer = 0
+        # the sum over k != f, written without a branch
+        numer = U[u, f] * SV[f, f]
         for k in range(factors):
-            if k != f:
-                numer -= U[u, k] * SV[f, k]
+            numer -= U[u, k] * SV[f, k]
 
         denom = SV[f, f] + regularization
-        for i in range(len(item_inds)):
-            pred_items[i] -= V_items[i, f] * U[u, f]
-            numer += (item_ratings[i] - w_diff[i] * pred_items[i]) * V_items[i, f]
-            denom += w_diff[i] * (V_items[i, f] ** 2)
+        V_f = work[f]
+        for i in range(n):
+            pred_items[i] -= V_f[i] * U[u, f]
+            numer += (item_ratings[i] - w_diff[i] * pred_items[i]) * V_f[i]
+            denom += w_diff[i] * (V_f[i] ** 2)
 
         new_u = numer / denom
         U[u, f] = new_u
-        for i in range(len(item_inds)):
-            pred_items[i] += V_items[i, f] * new_u
+        for i in range(n):
+            pred_items[i] += V_f[i] * new_u
 
 
-@njit()
-def _update_SU(SU, old_user_vec, new_user_vec):
-    SU -= old_user_vec.T @ old_user_vec - new_user_vec.T @ new_user_vec
+if _USE_FACTOR_MAJOR:
 
+    @njit(cache=_USE_NUMBA_CACHE)
+    def _empty_workspace(factors, n, dtype):
+        # Scratch array for _update_user() and _update_item() of rows of length up to n.
+        # The factor-major layout makes the loops over the items (users) of a row contiguous.
+        return np.empty((factors + 2, n), dtype=dtype)
 
-@njit(
-    # "(i4[:],i4[:],f4[:],f8[:,:],f8[:,:],f8[:,:],f8[:,:],i4[:],f4[:],f8[:],i8,f8,i8)",
-    parallel=_USE_NUMBA_PARALLEL,
-)
+else:
+
+    @njit(cache=_USE_NUMBA_CACHE)
+    def _empty_workspace(factors, n, dtype):
+        # Scratch array for _update_user() and _update_item() of rows of length up to n.
+        # The transposed view of a row-major array keeps the vector of each item (user)
+        # contiguous, as in V and U; neither layout is consistently faster on one thread
+        # (see benchmarks/kernels.py).
+        return np.empty((n, factors + 2), dtype=dtype).T
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _workspace(rows, indptr, factors, dtype):
+    # Scratch array for _update_user() and _update_item() that fits all the given rows.
+    max_length = 0
+    for r in rows:
+        max_length = max(max_length, indptr[r + 1] - indptr[r])
+    return _empty_workspace(factors, max_length, dtype)
+
+
+@njit(parallel=_USE_NUMBA_PARALLEL, cache=_USE_NUMBA_CACHE)
 def _update_user_and_SU_all(
-    indptr, indices, data, U, V, SU, SV, Wi, factors, regularization, user_count
+    order, chunk_ptr, indptr, indices, data, U, V, SU, SV, Wi, factors, regularization
 ):
     # U and SU will be modified. Other arguments are read-only.
-    for u in prange(user_count):
-        item_inds = indices[indptr[u] : indptr[u + 1]]
-        item_ratings = data[indptr[u] : indptr[u + 1]]
-        _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization)
+    # Each thread processes a whole chunk of users (see _make_chunks()) with one workspace.
+    for c in prange(len(chunk_ptr) - 1):
+        users = order[chunk_ptr[c] : chunk_ptr[c + 1]]
+        work = _workspace(users, indptr, factors, U.dtype)
+        for u in users:
+            item_inds = indices[indptr[u] : indptr[u + 1]]
+            item_ratings = data[indptr[u] : indptr[u + 1]]
+            _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization, work)
     # in-place assignment
     SU[:] = U.T @ U
 
 
-@njit(
-    # "(i8,i4[:],f4[:],f8[:,:],f8[:,:],f8[:,:],f4[:],f8[:],i8,f8)"
-)
-def _update_item(i, user_inds, user_ratings, U, V, SU, Wi, factors, regularization):
-    # Matrix V will be modified. Other arguments are read-only.
-    if len(user_inds) == 0:
-        return
-    U_users = U[user_inds]
-    pred_users = U_users @ V[i]
+@njit(parallel=_USE_NUMBA_PARALLEL, cache=_USE_NUMBA_CACHE)
+def _update_user_subset(
+    users, indptr, indices, data, U, V, SV, Wi, factors, regularization, n_chunks
+):
+    # U will be modified. Other arguments are read-only.
+    # The j-th row of the csr arrays (indptr, indices, data) holds the ratings of users[j].
+    for c in prange(n_chunks):
+        rows = np.arange(c * len(users) // n_chunks, (c + 1) * len(users) // n_chunks)
+        work = _workspace(rows, indptr, factors, U.dtype)
+        for j in rows:
+            item_inds = indices[indptr[j] : indptr[j + 1]]
+            item_ratings = data[indptr[j] : indptr[j + 1]]
+            _update_user(
+                users[j], item_inds, item_ratings, U, V, SV, Wi, factors, regularization, work
+            )
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _update_item(i, user_inds, user_ratings, U, V, SU, Wi, factors, regularization, work):
+    # Matrix V and the workspace work will be modified. Other arguments are read-only.
+    # work must have the shape (factors + 2, n) for some n >= len(user_inds).
+    # Returns the loss terms of the non-missing users of the item i after the update.
+    n = len(user_inds)
+    if n == 0:
+        return 0.0
+    pred_users = work[factors]
+    w_diff = work[factors + 1]
+    for u in range(n):
+        pred = 0.0
+        for f in range(factors):
+            work[f, u] = U[user_inds[u], f]
+            pred += U[user_inds[u], f] * V[i, f]
+        pred_users[u] = pred
+        w_diff[u] = (user_ratings[u] > 0) - Wi[i]
 
-    w_diff = (user_ratings > 0) - Wi[i]
     for f in range(factors):
-        numer = 0
+        # the sum over k != f, written without a branch
+        numer = V[i, f] * SU[f, f]
         for k in range(factors):
-            if k != f:
-                numer -= V[i, k] * SU[f, k]
+            numer -= V[i, k] * SU[f, k]
         numer *= Wi[i]
 
         denom = SU[f, f] * Wi[i] + regularization
-        for u in range(len(user_inds)):
-            pred_users[u] -= U_users[u, f] * V[i, f]
-            numer += (user_ratings[u] - w_diff[u] * pred_users[u]) * U_users[u, f]
-            denom += w_diff[u] * (U_users[u, f] ** 2)
+        U_f = work[f]
+        for u in range(n):
+            pred_users[u] -= U_f[u] * V[i, f]
+            numer += (user_ratings[u] - w_diff[u] * pred_users[u]) * U_f[u]
+            denom += w_diff[u] * (U_f[u] ** 2)
 
         new_i = numer / denom
         V[i, f] = new_i
-        for u in range(len(user_inds)):
-            pred_users[u] += U_users[u, f] * new_i
-
+        for u in range(n):
+            pred_users[u] += U_f[u] * new_i
 
-@njit()
-def _update_SV(SV, old_item_vec, new_item_vec, Wii):
-    SV -= (old_item_vec.T @ old_item_vec - new_item_vec.T @ new_item_vec) * Wii
+    loss = 0.0
+    for u in range(n):
+        loss += (user_ratings[u] - pred_users[u]) ** 2 - Wi[i] * (pred_users[u] ** 2)
+    return loss
 
 
-@njit(
-    # "(i4[:],i4[:],f4[:],f8[:,:],f8[:,:],f8[:,:],f8[:,:],i4[:],f4[:],f8[:],i8,f8,i8)",
-    parallel=_USE_NUMBA_PARALLEL,
-)
+@njit(parallel=_USE_NUMBA_PARALLEL, cache=_USE_NUMBA_CACHE)
 def _update_item_and_SV_all(
-    indptr, indices, data, U, V, SU, SV, Wi, factors, regularization, item_count
+    order, chunk_ptr, indptr, indices, data, U, V, SU, SV, Wi, factors, regularization
 ):
     # V and SV will be modified. Other arguments are read-only.
-    for i in prange(item_count):
-        user_inds = indices[indptr[i] : indptr[i + 1]]
-        user_ratings = data[indptr[i] : indptr[i + 1]]
-        _update_item(i, user_inds, user_ratings, U, V, SU, Wi, factors, regularization)
+    # Each thread processes a whole chunk of items (see _make_chunks()) with one workspace.
+    # Returns the loss terms of all the non-missing user-item pairs (see _fused_loss()).
+    loss = 0.0
+    for c in prange(len(chunk_ptr) - 1):
+        items = order[chunk_ptr[c] : chunk_ptr[c + 1]]
+        work = _workspace(items, indptr, factors, V.dtype)
+        chunk_loss = 0.0
+        for i in items:
+            user_inds = indices[indptr[i] : indptr[i + 1]]
+            user_ratings = data[indptr[i] : indptr[i + 1]]
+            chunk_loss += _update_item(
+                i, user_inds, user_ratings, U, V, SU, Wi, factors, regularization, work
+            )
+        loss += chunk_loss
 
     # in-place assignment
     SV[:] = (V.T * Wi) @ V
+    return loss
 
 
-@njit(
-    # "(i4[:],i4[:],f4[:],f8[:,:],f8[:,:],f8[:,:],i4[:],f4[:],f8[:],i8,f8)"
-)
+@njit(parallel=_USE_NUMBA_PARALLEL, cache=_USE_NUMBA_CACHE)
+def _update_item_subset(
+    items, indptr, indices, data, U, V, SU, Wi, factors, regularization, n_chunks
+):
+    # V will be modified. Other arguments are read-only.
+    # The j-th row of the csr arrays (indptr, indices, data) holds the ratings of items[j].
+    # Returns the loss terms of the non-missing user-item pairs of the items.
+    loss = 0.0
+    for c in prange(n_chunks):
+        rows = np.arange(c * len(items) // n_chunks, (c + 1) * len(items) // n_chunks)
+        work = _workspace(rows, indptr, factors, V.dtype)
+        chunk_loss = 0.0
+        for j in rows:
+            user_inds = indices[indptr[j] : indptr[j + 1]]
+            user_ratings = data[indptr[j] : indptr[j + 1]]
+            chunk_loss += _update_item(
+                items[j], user_inds, user_ratings, U, V, SU, Wi, factors, regularization, work
+            )
+        loss += chunk_loss
+    return loss
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _update_online(
+    u,
+    i,
+    item_inds,
+    item_ratings,
+    user_inds,
+    user_ratings,
+    U,
+    V,
+    SU,
+    SU_compensation,
+    SV,
+    SV_compensation,
+    Wi,
+    factors,
+    regularization,
+    num_iter,
+    weight_change,
+):
+    # update_model() in a single call: U[u] and V[i] are updated num_iter times, and SU and SV
+    # with their Kahan compensations are updated after each of them (see GramMatrix).
+    # SV is first corrected for the change weight_change of Wi[i].
+    # Returns the magnitudes of the updates of SU and SV for the error bounds.
+    work = _empty_workspace(factors, max(len(item_inds), len(user_inds)), U.dtype)
+    # the vectors are passed to _update_symmetric() in float64
+    old = np.zeros(factors)
+    new = np.empty(factors)
+    SU_magnitude = 0.0
+    SV_magnitude = 0.0
+    if weight_change != 0:
+        new[:] = V[i]
+        SV_magnitude += _update_symmetric(SV, SV_compensation, old, new, weight_change)
+    for _ in range(num_iter):
+        old[:] = U[u]
+        _update_user(u, item_inds, item_ratings, U, V, SV, Wi, factors, regularization, work)
+        new[:] = U[u]
+        SU_magnitude += _update_symmetric(SU, SU_compensation, old, new, 1.0)
+
+        old[:] = V[i]
+        _update_item(i, user_inds, user_ratings, U, V, SU, Wi, factors, regularization, work)
+        new[:] = V[i]
+        SV_magnitude += _update_symmetric(SV, SV_compensation, old, new, float(Wi[i]))
+    return SU_magnitude, SV_magnitude
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _pool_position(r, c, pool_start, pool_length, pool_capacity, pool_indices):
+    # Position in the pool of an InteractionStore at which the element (r, c) is set in place,
+    # and whether it is new; -1 if the row must be moved to a slot with room first.
+    start = pool_start[r]
+    if start < 0:
+        return -1, False
+    length = pool_length[r]
+    for k in range(start, start + length):
+        if pool_indices[k] == c:
+            return k, False
+    if length < pool_capacity[r]:
+        return start + length, True
+    return -1, False
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _update_online_event(
+    u,
+    i,
+    user_pool_start,
+    user_pool_length,
+    user_pool_capacity,
+    user_pool_indices,
+    user_pool_data,
+    item_pool_start,
+    item_pool_length,
+    item_pool_capacity,
+    item_pool_indices,
+    item_pool_data,
+    U,
+    V,
+    SU,
+    SU_compensation,
+    SV,
+    SV_compensation,
+    Wi,
+    factors,
+    regularization,
+    num_iter,
+    w0,
+    alpha,
+    popularity_sum,
+    popularity_norm,
+    rescale_tol,
+):
+    # update_model() in a single call: the pair (u, i) is set in the pools of both stores, Wi[i]
+    # follows the new count of item i as in _update_item_weights(), rescaling Wi and SV when
+    # the sum of the popularities has drifted, and U[u] and V[i] are updated by
+    # _update_online().
+    # Returns (applied, 1 if the pair is new else 0, popularity_sum, popularity_norm, the scale
+    # of Wi and SV, and the magnitudes of the updates of SU and SV). Nothing is modified unless
+    # applied, i.e. unless both rows have a slot in the pool with room for the pair (see
+    # InteractionStore.reserve_append()).
+    user_position, user_new = _pool_position(
+        u, i, user_pool_start, user_pool_length, user_pool_capacity, user_pool_indices
+    )
+    item_position, item_new = _pool_position(
+        i, u, item_pool_start, item_pool_length, item_pool_capacity, item_pool_indices
+    )
+    if user_position < 0 or item_position < 0:
+        return False, 0, popularity_sum, popularity_norm, 1.0, 0.0, 0.0
+    user_pool_indices[user_position] = i
+    user_pool_data[user_position] = 1
+    if user_new:
+        user_pool_length[u] += 1
+    item_pool_indices[item_position] = u
+    item_pool_data[item_position] = 1
+    if item_new:
+        item_pool_length[i] += 1
+
+    new_count = item_pool_length[i]
+    old_count = new_count - 1 if item_new else new_count
+    popularity_sum += new_count**alpha - old_count**alpha
+    scale = 1.0
+    if abs(popularity_sum - popularity_norm) > rescale_tol * popularity_norm:
+        scale = popularity_norm / popularity_sum
+        Wi *= scale
+        SV *= scale
+        SV_compensation *= scale
+        popularity_norm = popularity_sum
+    old_weight = float(Wi[i])
+    Wi[i] = w0 * new_count**alpha / popularity_norm
+    weight_change = float(Wi[i]) - old_weight
+
+    user_start = user_pool_start[u]
+    user_end = user_start + user_pool_length[u]
+    item_start = item_pool_start[i]
+    item_end = item_start + item_pool_length[i]
+    SU_magnitude, SV_magnitude = _update_online(
+        u,
+        i,
+        user_pool_indices[user_start:user_end],
+        user_pool_data[user_start:user_end],
+        item_pool_indices[item_start:item_end],
+        item_pool_data[item_start:item_end],
+        U,
+        V,
+        SU,
+        SU_compensation,
+        SV,
+        SV_compensation,
+        Wi,
+        factors,
+        regularization,
+        num_iter,
+        weight_change,
+    )
+    added = 1 if user_new else 0
+    return True, added, popularity_sum, popularity_norm, scale, SU_magnitude, SV_magnitude
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _calc_loss_user(u, item_indices, ratings, U, V, SV, Wi):
+    loss = 0.0
+    for i, rating in zip(item_indices, ratings):
+        pred = U[u] @ V[i]
+        loss += (rating - pred) ** 2
+        # for non-missing items
+        loss -= Wi[i] * (pred ** 2)
+
+    # sum of (Wi[i] * (pred ** 2)) for all (= missing + non-missing) items
+    # SV is float64 even for float32 latent vectors
+    user_vec = U[u].astype(SV.dtype)
+    loss += SV @ user_vec @ user_vec
+    return loss
+
+
+@njit(parallel=_USE_NUMBA_PARALLEL, cache=_USE_NUMBA_CACHE)
 def _calc_loss_csr(
     indptr, indices, data, U, V, SV, Wi, user_count, regularization
 ):
     loss = ((U ** 2).sum() + (V ** 2).sum()) * regularization
-    for u in range(user_count):
+    for u in prange(user_count):
         item_indices = indices[indptr[u] : indptr[u + 1]]
         ratings = data[indptr[u] : indptr[u + 1]]
-
-        for i, rating in zip(item_indices, ratings):
-            pred = U[u] @ V[i]
-            loss += (rating - pred) ** 2
-            # for non-missing items
-            loss -= Wi[i] * (pred ** 2)
-
-        # sum of (Wi[i] * (pred ** 2)) for all (= missing + non-missing) items
-        loss += SV @ U[u] @ U[u]
+        loss += _calc_loss_user(u, item_indices, ratings, U, V, SV, Wi)
     return loss
 
 
-@njit(
-    # "f8(f8[:,:],f8[:,:],f8[:,:],i8,f8)"
-)
-def _calc_loss_lil_init(U, V, SV, user_count, regularization):
+@njit(cache=_USE_NUMBA_CACHE)
+def _store_row(r, indptr, indices, data, pool_start, pool_length, pool_indices, pool_data):
+    # Same as InteractionStore.row()
+    start = pool_start[r]
+    if start >= 0:
+        end = start + pool_length[r]
+        return pool_indices[start:end], pool_data[start:end]
+    if r >= len(indptr) - 1:
+        return indices[:0], data[:0]
+    return indices[indptr[r] : indptr[r + 1]], data[indptr[r] : indptr[r + 1]]
+
+
+@njit(parallel=_USE_NUMBA_PARALLEL, cache=_USE_NUMBA_CACHE)
+def _calc_loss_store(
+    indptr,
+    indices,
+    data,
+    pool_start,
+    pool_length,
+    pool_indices,
+    pool_data,
+    U,
+    V,
+    SV,
+    Wi,
+    user_count,
+    regularization,
+):
+    # The same loss as _calc_loss_csr() for the arrays of a user-major InteractionStore
     loss = ((U ** 2).sum() + (V ** 2).sum()) * regularization
-    for u in range(user_count):
-        loss += SV @ U[u] @ U[u]
+    for u in prange(user_count):
+        item_indices, ratings = _store_row(
+            u, indptr, indices, data, pool_start, pool_length, pool_indices, pool_data
+        )
+        loss += _calc_loss_user(u, item_indices, ratings, U, V, SV, Wi)
     return loss
-
-
-@njit(
-    # "f8(i8,i4[:],f4[:],f4[:],f8[:,:],f8[:,:],f8[:])"
-)
-def _calc_loss_lil_inner_loop(i, indices, ratings, U, V, Wi):
-    l = 0
-    for u, rating in zip(indices, ratings):
-        pred = U[u] @ V[i]
-        l += (rating - pred) ** 2
-        l -= Wi[i] * (pred ** 2)
-    return l
-
-
-# TODO: @njit does not improve performance of this function. Better way to implement it?
-def _calc_loss_lil(
-    cols: np.ndarray,
-    data: np.ndarray,
-    U: np.ndarray,
-    V: np.ndarray,
-    SV: np.ndarray,
-    Wi: np.ndarray,
-    user_count: int,
-    item_count: int,
-    regularization: float,
-    dtype: type,
-) -> float:
-    loss: float = _calc_loss_lil_init(U, V, SV, user_count, regularization)
-    for i in range(item_count):
-        if not cols[i]:
-            continue
-        user_indices = np.array(cols[i], dtype=np.int32)
-        ratings = np.array(data[i], dtype=dtype)
-        loss += _calc_loss_lil_inner_loop(i, user_indices, ratings, U, V, Wi)
-    return loss
\ No newline at end of file
@@ -0,0 +1,167 @@
+from typing import Optional
+
+import numpy as np
+
+from .jit import _USE_NUMBA_CACHE, njit
+
+# unit roundoff of float64
+_EPS = np.finfo(np.float64).eps / 2
+# size of the tiles in which _update_symmetric() mirrors the lower triangle
+_TILE = 16
+
+
+class GramMatrix:
+    """Gram matrix X.T @ diag(w) @ X of latent vectors X maintained under updates of rows
+
+    The matrix is accumulated in float64 with Kahan compensation whatever the dtype of X.
+    Every update adds a bound of its rounding error to drift, and needs_recompute() tells
+    when the accumulated error is no longer negligible relative to the trace of the matrix,
+    so that the owner recomputes the matrix from X only then.
+
+    Parameters
+    ----------
+    matrix: numpy.ndarray
+        Initial Gram matrix, which is assumed to be exact.
+        A float64 array is used as is, so that it may be a view of shared memory.
+    tol: float
+        Bound of the relative error above which needs_recompute() is True
+
+    Attributes
+    ----------
+    matrix: numpy.ndarray
+        The Gram matrix in float64
+    compensation: numpy.ndarray
+        Running compensation of the Kahan summation of each entry
+    drift: float
+        Bound of the absolute error of the entries of the matrix since it was computed
+    recomputations: int
+        The number of calls of recompute()
+    """
+
+    # the number of rows of X multiplied at once by recompute()
+    _BLOCK_ROWS = 1 << 16
+    # calls of needs_recompute() since it last compared the error bound (see check_every)
+    _unchecked = 0
+
+    def __init__(self, matrix: np.ndarray, tol: float = 1e-10) -> None:
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.tol = tol
+        self.recomputations = 0
+        self.compensation = np.zeros_like(self.matrix)
+        self.drift = 0.0
+
+    @classmethod
+    def compute(
+        cls, X: np.ndarray, weights: Optional[np.ndarray] = None, tol: float = 1e-10
+    ) -> "GramMatrix":
+        """Compute the Gram matrix of the rows of X with the given weights"""
+        gram = cls(np.zeros((X.shape[1], X.shape[1])), tol)
+        gram.recompute(X, weights)
+        gram.recomputations = 0
+        return gram
+
+    def recompute(self, X: np.ndarray, weights: Optional[np.ndarray] = None) -> None:
+        """Recompute the matrix in place from X in float64, in blocks of rows"""
+        self.matrix[:] = 0
+        for lo in range(0, len(X), self._BLOCK_ROWS):
+            block = np.asarray(X[lo : lo + self._BLOCK_ROWS], dtype=np.float64)
+            if weights is None:
+                self.matrix += block.T @ block
+            else:
+                self.matrix += (block.T * weights[lo : lo + self._BLOCK_ROWS]) @ block
+        self.recomputations += 1
+        self.reset_error()
+
+    def reset_error(self) -> None:
+        """Declare the matrix exact, e.g. after the caller has computed it from scratch"""
+        self.compensation[:] = 0
+        self.drift = 0.0
+
+    def needs_recompute(self, check_every: int = 1) -> bool:
+        """Whether the error bound exceeds tol relative to the trace of the matrix
+
+        With check_every > 1, only every check_every-th call computes the trace and the others
+        return False, for owners which call this after each of many tiny updates.
+        """
+        self._unchecked += 1
+        if self._unchecked < check_every:
+            return False
+        self._unchecked = 0
+        return bool(self.drift > self.tol * abs(np.trace(self.matrix)))
+
+    def scale(self, factor: float) -> None:
+        """Multiply the matrix by factor, e.g. when all the weights are rescaled"""
+        self.matrix *= factor
+        self.compensation *= factor
+        self.record_scale(factor)
+
+    def record_scale(self, factor: float) -> None:
+        """Account for the multiplication of the matrix and the compensation by a kernel"""
+        self.drift = self.drift * abs(factor) + _EPS * abs(np.trace(self.matrix))
+
+    def update(self, old: np.ndarray, new: np.ndarray, weight: float = 1.0) -> None:
+        """Replace a row old of X, whose weight is weight, with new
+
+        Only the lower triangle is computed and mirrored, which halves the multiplications.
+        A new row is added with old = 0.
+        """
+        magnitude = _update_symmetric(
+            self.matrix,
+            self.compensation,
+            np.asarray(old, dtype=np.float64),
+            np.asarray(new, dtype=np.float64),
+            float(weight),
+        )
+        self.record_updates(magnitude)
+
+    def record_updates(self, magnitude: float) -> None:
+        """Account for updates applied by a kernel with _update_symmetric()
+
+        magnitude is the sum of the magnitudes returned by _update_symmetric().
+        """
+        # each entry is a sum of two products, each rounded once, and a compensated addition
+        self.drift += 4 * _EPS * magnitude
+
+    def update_rows(
+        self, old: np.ndarray, new: np.ndarray, weights: Optional[np.ndarray] = None
+    ) -> None:
+        """Replace rows old of X, whose weights are weights, with new, in one product each"""
+        old = np.asarray(old, dtype=np.float64)
+        new = np.asarray(new, dtype=np.float64)
+        if weights is None:
+            weights = np.ones(len(old))
+        delta = (new.T * weights) @ new - (old.T * weights) @ old
+        # Kahan summation of the entries
+        y = delta - self.compensation
+        t = self.matrix + y
+        self.compensation[:] = (t - self.matrix) - y
+        self.matrix[:] = t
+        # error bound of the inner products of length len(old)
+        magnitude = np.abs(weights) @ (np.sum(old ** 2, axis=1) + np.sum(new ** 2, axis=1))
+        self.drift += (len(old) + 2) * _EPS * float(magnitude)
+
+
+@njit(cache=_USE_NUMBA_CACHE)
+def _update_symmetric(matrix, compensation, old, new, weight):
+    # matrix += weight * (new.T @ new - old.T @ old) on the lower triangle with Kahan
+    # compensation, mirrored to the upper triangle.
+    # Returns the magnitude weight * (|old|^2 + |new|^2) of the terms for the error bound.
+    factors = len(new)
+    magnitude = 0.0
+    for f in range(factors):
+        old_f = weight * old[f]
+        new_f = weight * new[f]
+        magnitude += old_f * old[f] + new_f * new[f]
+        for k in range(f + 1):
+            y = (new_f * new[k] - old_f * old[k]) - compensation[f, k]
+            t = matrix[f, k] + y
+            compensation[f, k] = (t - matrix[f, k]) - y
+            matrix[f, k] = t
+    # the columns are written in tiles, which is about twice as fast as in the loop above
+    # for 128 factors and more
+    for f0 in range(0, factors, _TILE):
+        for k0 in range(0, f0 + 1, _TILE):
+            for f in range(f0, min(f0 + _TILE, factors)):
+                for k in range(k0, min(k0 + _TILE, f)):
+                    matrix[k, f] = matrix[f, k]
+    return abs(magnitude)
@@ -0,0 +1,192 @@
+import copy
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+
+from .eals import _fold_in_users, _grow_rows
+from .serializer import deserialize_eals_directory
+
+
+class InferenceModel:
+    """Latent vectors of a trained model for serving recommendations
+
+    An InferenceModel holds user_factors and item_factors, and the item weights Wi and the Gram
+    matrix SV with which fold_in_users() computes vectors for users unknown to the model.
+    It has no rating matrix and cannot be trained.
+    Create the files with ElementwiseAlternatingLeastSquares.export_inference() and open them
+    with load().
+
+    Parameters
+    ----------
+    user_factors: numpy.ndarray
+        Latent vectors of the users
+    item_factors: numpy.ndarray
+        Latent vectors of the items
+    Wi: numpy.ndarray
+        Weights of the missing data of the items
+    SV: numpy.ndarray
+        Gram matrix of the weighted item vectors
+    regularization: float
+        Regularization parameter lambda of the model
+    num_iter_online: int
+        The number of updates of each vector folded in
+    dtype: type
+        Data type of the ratings of the model
+    """
+
+    def __init__(
+        self,
+        user_factors: np.ndarray,
+        item_factors: np.ndarray,
+        Wi: np.ndarray,
+        SV: np.ndarray,
+        regularization: float = 0.01,
+        num_iter_online: int = 1,
+        dtype: type = np.float32,
+    ) -> None:
+        self._user_factors = user_factors
+        self._item_factors = item_factors
+        self._Wi = Wi
+        self.user_count = len(user_factors)
+        self.item_count = len(item_factors)
+        self.SV = SV
+        self.regularization = float(regularization)
+        self.num_iter_online = num_iter_online
+        self.dtype = dtype
+
+    @classmethod
+    def load(cls, path: Union[Path, str], mmap: bool = True) -> "InferenceModel":
+        """Open the directory written by export_inference()
+
+        Parameters
+        ----------
+        path: Union[pathlib.Path, str]
+            Directory of the files
+        mmap: bool
+            Memory-map the arrays instead of reading them (default), so that processes
+            serving the same model share them through the page cache
+        """
+        header, arrays = deserialize_eals_directory(path, mmap=mmap)
+        if header.get("kind") != "inference":
+            raise ValueError(f"{path} is not written by export_inference(); use load_model()")
+        return cls(
+            arrays["user_factors"],
+            arrays["item_factors"],
+            arrays["Wi"],
+            arrays["SV"],
+            regularization=header["regularization"],
+            num_iter_online=header["num_iter_online"],
+            dtype=np.dtype(header["dtype"]).type,
+        )
+
+    # user_factors, item_factors and Wi are views of arrays whose capacity may exceed
+    # user_count or item_count, which grow geometrically like those of the model.
+
+    @property
+    def user_factors(self) -> np.ndarray:
+        return self._user_factors[: self.user_count]
+
+    @property
+    def item_factors(self) -> np.ndarray:
+        return self._item_factors[: self.item_count]
+
+    @property
+    def Wi(self) -> np.ndarray:
+        return self._Wi[: self.item_count]
+
+    @property
+    def factors(self) -> int:
+        return int(self.item_factors.shape[1])
+
+    def memory_report(self) -> Dict[str, int]:
+        """Bytes held by each array, with their sum as total
+
+        The arrays include their spare capacity, and arrays memory-mapped from files are
+        counted at their full size.
+        """
+        report = {
+            "user_factors": self._user_factors.nbytes,
+            "item_factors": self._item_factors.nbytes,
+            "Wi": self._Wi.nbytes,
+            "SV": self.SV.nbytes,
+        }
+        report["total"] = sum(report.values())
+        return report
+
+    def set_factors(
+        self,
+        users: np.ndarray,
+        user_vectors: np.ndarray,
+        items: np.ndarray,
+        item_vectors: np.ndarray,
+    ) -> None:
+        """Overwrite the latent vectors of users and items, e.g. from an update journal
+
+        Users and items beyond the counts are added, and new items get zero weights.
+        Memory-mapped arrays are copied into memory when they grow.
+        """
+        user_count = max(self.user_count, int(np.max(users, initial=-1)) + 1)
+        item_count = max(self.item_count, int(np.max(items, initial=-1)) + 1)
+        if user_count > len(self._user_factors):
+            self._user_factors = _grow_rows(self._user_factors, user_count)
+        if item_count > len(self._item_factors):
+            self._item_factors = _grow_rows(self._item_factors, item_count)
+            self._Wi = _grow_rows(self._Wi, item_count)
+        self._user_factors[users] = user_vectors
+        self._item_factors[items] = item_vectors
+        self.user_count = user_count
+        self.item_count = item_count
+
+    def with_factors(
+        self,
+        users: np.ndarray,
+        user_vectors: np.ndarray,
+        items: np.ndarray,
+        item_vectors: np.ndarray,
+    ) -> "InferenceModel":
+        """Return a copy of the model with the latent vectors of users and items overwritten
+
+        Like set_factors(), but this model is not modified, so that threads reading it
+        meanwhile see consistent vectors. Only the arrays of the vectors are copied; Wi and SV
+        are shared with this model.
+        """
+        model = copy.copy(self)
+        if len(users):
+            model._user_factors = np.array(self._user_factors)
+        if len(items):
+            model._item_factors = np.array(self._item_factors)
+        model.set_factors(users, user_vectors, items, item_vectors)
+        return model
+
+    def recommend(self, user: int, k: int = 20) -> np.ndarray:
+        """Return the k items with the highest scores for a user, best first"""
+        return self.recommend_vector(self.user_factors[user], k)
+
+    def recommend_vector(self, user_vector: np.ndarray, k: int = 20) -> np.ndarray:
+        """Return the k items with the highest scores for a latent vector, best first"""
+        scores = self.item_factors @ user_vector
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        # select the top k in linear time and sort only them
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k :]
+        return top[np.argsort(scores[top])[::-1]]
+
+    def fold_in_users(
+        self, item_lists: Sequence[Sequence[int]], num_iter: Optional[int] = None
+    ) -> np.ndarray:
+        """Compute latent vectors for users from the items they interacted with
+
+        The same as ElementwiseAlternatingLeastSquares.fold_in_users() of the exported model.
+        """
+        return _fold_in_users(
+            item_lists,
+            self.item_factors,
+            self.Wi,
+            self.SV,
+            self.regularization,
+            self.num_iter_online if num_iter is None else num_iter,
+            self.dtype,
+        )
+
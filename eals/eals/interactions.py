@@ -0,0 +1,550 @@
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple, Union
+
+import numpy as np
+import scipy.sparse as sps
+from numpy.lib.format import open_memmap
+
+
+# attributes of the pool of InteractionStore, which are not pickled (see __getstate__())
+_POOL_KEYS = [
+    "pool_start",
+    "pool_length",
+    "pool_capacity",
+    "pool_indices",
+    "pool_data",
+    "_pool_used",
+    "_pool_garbage",
+    "_base_garbage",
+]
+
+
+class InteractionStore:
+    """Append-friendly sparse matrix for online training
+
+    The matrix consists of an immutable CSR base (indptr, indices, data) and an append pool.
+    Rows that have never been modified are read from the base without copying.
+    The first modification of a row moves it to the pool, where it owns a contiguous slot
+    with spare capacity, so that later appends are written in place.
+    Both the base and the pool are plain numpy arrays and row slices are zero-copy views,
+    so that they can be passed to the Numba kernels directly.
+
+    The pool is garbage collected when abandoned slots dominate it, and the whole matrix is
+    merged back into a fresh CSR base by compact().
+
+    Parameters
+    ----------
+    indptr: numpy.ndarray
+        CSR index pointers of the base matrix
+    indices: numpy.ndarray
+        CSR column indices of the base matrix
+    data: numpy.ndarray
+        CSR values of the base matrix
+    shape: Tuple[int, int]
+        Shape of the matrix; it may have more rows than the base
+    """
+
+    # minimum capacity of a row slot in the pool
+    _MIN_SLOT_CAPACITY = 4
+
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        shape: Tuple[int, int],
+    ) -> None:
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data)
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.nnz = int(self.indptr[-1])
+        # (directory, prefix) of the files of a memory-mapped base (see open())
+        self._source = None
+        self._reset_pool()
+
+    @classmethod
+    def from_csr(cls, matrix: sps.spmatrix) -> "InteractionStore":
+        """Create a store sharing the arrays of a CSR (or, for the transpose, CSC) matrix"""
+        return cls(matrix.indptr, matrix.indices, matrix.data, matrix.shape)
+
+    @classmethod
+    def open(cls, path: Union[Path, str], prefix: str, n_cols: int) -> "InteractionStore":
+        """Create a store whose base is memory-mapped from the files written by MmapInteractions
+
+        The base is pickled as a reference to the files, not as data.
+        """
+        path = Path(path).resolve()
+        indptr, indices, data = _open_csr(path, prefix)
+        store = cls(indptr, indices, data, (len(indptr) - 1, n_cols))
+        store._source = (path, prefix)
+        return store
+
+    def __getstate__(self) -> dict:
+        # The pool is not pickled as is, since its spare capacity and abandoned slots may
+        # exceed its live rows. An in-memory store is pickled as compact CSR arrays, and a
+        # memory-mapped one as the reference to its files and the rows in the pool.
+        state = self.__dict__.copy()
+        for key in _POOL_KEYS:
+            del state[key]
+        if self._source is None:
+            state["indptr"], state["indices"], state["data"] = self.to_csr_arrays()
+            return state
+        del state["indptr"], state["indices"], state["data"]
+        pool_rows = np.flatnonzero(self.pool_start[: self.shape[0]] >= 0)
+        state["_pool_rows"] = (pool_rows, *self.rows_csr(pool_rows))
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # stores saved before memory-mapped bases were introduced
+        state.setdefault("_source", None)
+        pool_rows = state.pop("_pool_rows", None)
+        self.__dict__.update(state)
+        if self._source is not None:
+            self.indptr, self.indices, self.data = _open_csr(*self._source)
+        # stores saved before the pool was left out keep it as is
+        if "pool_start" not in state:
+            self._reset_pool()
+            if pool_rows is not None:
+                self._restore_pool(*pool_rows)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the arrays of the base and the pool"""
+        return sum(a.nbytes for a in self.arrays()) + self.pool_capacity.nbytes
+
+    @property
+    def base_rows(self) -> int:
+        """The number of rows in the base matrix"""
+        return len(self.indptr) - 1
+
+    def _reset_pool(self) -> None:
+        # per-row slot in the pool; pool_start[r] < 0 means row r is read from the base.
+        # These arrays may be longer than the number of rows (see resize()).
+        self.pool_start = np.full(self.shape[0], -1, dtype=np.int64)
+        self.pool_length = np.zeros(self.shape[0], dtype=np.int64)
+        self.pool_capacity = np.zeros(self.shape[0], dtype=np.int64)
+        self.pool_indices = np.empty(0, dtype=np.int32)
+        self.pool_data = np.empty(0, dtype=self.data.dtype)
+        # end of the last allocated slot
+        self._pool_used = 0
+        # total capacity of abandoned slots in the pool
+        self._pool_garbage = 0
+        # total length of base rows which have been moved to the pool
+        self._base_garbage = 0
+
+    def _restore_pool(
+        self, rows: np.ndarray, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray
+    ) -> None:
+        """Move the rows to the pool with the given contents, packed in one allocation"""
+        lengths = np.diff(indptr)
+        capacities = np.maximum(self._MIN_SLOT_CAPACITY, 2 * lengths)
+        starts = np.cumsum(capacities) - capacities
+        self._pool_used = int(capacities.sum())
+        self.pool_indices = np.empty(self._pool_used, dtype=np.int32)
+        self.pool_data = np.empty(self._pool_used, dtype=self.data.dtype)
+        positions = _ranges(starts, starts + lengths)
+        self.pool_indices[positions] = indices
+        self.pool_data[positions] = data
+        self.pool_start[rows] = starts
+        self.pool_length[rows] = lengths
+        self.pool_capacity[rows] = capacities
+        in_base = rows[rows < self.base_rows]
+        self._base_garbage = int(np.sum(self.indptr[in_base + 1] - self.indptr[in_base]))
+
+    def row(self, r: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (column indices, values) of the row r as zero-copy views"""
+        start = self.pool_start[r]
+        if start >= 0:
+            end = start + self.pool_length[r]
+            return self.pool_indices[start:end], self.pool_data[start:end]
+        if r >= self.base_rows:
+            return self.indices[:0], self.data[:0]
+        start, end = self.indptr[r], self.indptr[r + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def arrays(self) -> Tuple[np.ndarray, ...]:
+        """Return the flat arrays of the store for the Numba kernels
+
+        The arrays are (indptr, indices, data, pool_start, pool_length, pool_indices, pool_data).
+        Note that pool_start and pool_length may be longer than the number of rows.
+        """
+        return (
+            self.indptr,
+            self.indices,
+            self.data,
+            self.pool_start,
+            self.pool_length,
+            self.pool_indices,
+            self.pool_data,
+        )
+
+    def row_lengths(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the number of stored elements of each row, or of the given rows"""
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            lengths = np.zeros(len(rows), dtype=np.int64)
+            in_base = rows < self.base_rows
+            lengths[in_base] = self.indptr[rows[in_base] + 1] - self.indptr[rows[in_base]]
+            in_pool = self.pool_start[rows] >= 0
+            lengths[in_pool] = self.pool_length[rows[in_pool]]
+            return lengths
+        lengths = np.zeros(self.shape[0], dtype=np.int64)
+        lengths[: self.base_rows] = np.diff(self.indptr)
+        in_pool = self.pool_start[: self.shape[0]] >= 0
+        lengths[in_pool] = self.pool_length[: self.shape[0]][in_pool]
+        return lengths
+
+    def is_compact(self) -> bool:
+        """Whether all rows are read from the base"""
+        return self._pool_used == 0 and self.base_rows == self.shape[0]
+
+    def resize(self, n_rows: int, n_cols: int) -> None:
+        """Grow the matrix to the given shape
+
+        The per-row arrays grow geometrically, so that adding rows one by one costs
+        amortized O(1) per row.
+        """
+        if n_rows < self.shape[0] or n_cols < self.shape[1]:
+            raise ValueError("InteractionStore cannot shrink")
+        if n_rows > len(self.pool_start):
+            capacity = max(n_rows, 2 * len(self.pool_start))
+            adding = capacity - len(self.pool_start)
+            self.pool_start = np.append(self.pool_start, np.full(adding, -1, dtype=np.int64))
+            self.pool_length = np.append(self.pool_length, np.zeros(adding, dtype=np.int64))
+            self.pool_capacity = np.append(self.pool_capacity, np.zeros(adding, dtype=np.int64))
+        self.shape = (n_rows, n_cols)
+
+    def set(self, r: int, c: int, value: float) -> None:
+        """Set the element (r, c) to value"""
+        # a single comparison instead of the set operations of set_row(),
+        # since this is called for every event of online training
+        row_indices, _ = self.row(r)
+        exists = (row_indices == c).any()
+        start = self._writable_slot(r, 0 if exists else 1)
+        length = self.pool_length[r]
+        if exists:
+            position = np.flatnonzero(self.pool_indices[start : start + length] == c)[0]
+            self.pool_data[start + position] = value
+            return
+        self.pool_indices[start + length] = c
+        self.pool_data[start + length] = value
+        self.pool_length[r] = length + 1
+        self.nnz += 1
+        if self.needs_compaction():
+            self.compact()
+
+    def set_many(self, rows: np.ndarray, cols: np.ndarray, value: float) -> None:
+        """Set the elements (rows[k], cols[k]) to value"""
+        order = np.lexsort((cols, rows))
+        rows = rows[order]
+        cols = cols[order].astype(np.int32)
+        bounds = np.flatnonzero(np.diff(rows)) + 1
+        for r, row_cols in zip(rows[np.r_[0, bounds]], np.split(cols, bounds)):
+            self.set_row(int(r), np.unique(row_cols), value)
+
+    def set_row(self, r: int, cols: np.ndarray, value: float) -> None:
+        """Set the elements (r, cols[k]) to value; cols must not contain duplicates"""
+        row_indices, _ = self.row(r)
+        exists = np.isin(cols, row_indices)
+        new_cols = cols[~exists]
+        start = self._writable_slot(r, len(new_cols))
+        length = self.pool_length[r]
+        if exists.any():
+            positions = np.flatnonzero(np.isin(self.pool_indices[start : start + length], cols))
+            self.pool_data[start + positions] = value
+        end = start + length + len(new_cols)
+        self.pool_indices[start + length : end] = new_cols
+        self.pool_data[start + length : end] = value
+        self.pool_length[r] = length + len(new_cols)
+        self.nnz += len(new_cols)
+        if self.needs_compaction():
+            self.compact()
+
+    def reserve_append(self, r: int) -> None:
+        """Move the row r to a slot of the pool with room for one more element
+
+        A kernel may then set an element of the row in the pool in place, as update_model()
+        does; the caller accounts for it in nnz and compacts the store if needs_compaction().
+        """
+        self._writable_slot(r, 1)
+
+    def _writable_slot(self, r: int, extra: int) -> int:
+        """Make sure the row r lives in the pool with room for extra elements
+
+        Returns the start of its slot.
+        """
+        start = self.pool_start[r]
+        length = self.pool_length[r]
+        if start >= 0 and length + extra <= self.pool_capacity[r]:
+            return int(start)
+
+        row_indices, row_data = self.row(r)
+        length = len(row_indices)
+        capacity = max(self._MIN_SLOT_CAPACITY, 2 * (length + extra))
+        if self._pool_used + capacity > len(self.pool_indices):
+            self._reserve_pool(capacity)
+            # _reserve_pool may have moved the slot of the row
+            row_indices, row_data = self.row(r)
+        new_start = self._pool_used
+        self.pool_indices[new_start : new_start + length] = row_indices
+        self.pool_data[new_start : new_start + length] = row_data
+        if start >= 0:
+            self._pool_garbage += self.pool_capacity[r]
+        else:
+            self._base_garbage += length
+        self.pool_start[r] = new_start
+        self.pool_length[r] = length
+        self.pool_capacity[r] = capacity
+        self._pool_used += capacity
+        return new_start
+
+    def _reserve_pool(self, capacity: int) -> None:
+        """Make room for a new slot of the given capacity at the end of the pool"""
+        if self._pool_garbage * 2 > self._pool_used:
+            self._collect_pool_garbage()
+        if self._pool_used + capacity <= len(self.pool_indices):
+            return
+        size = max(2 * len(self.pool_indices), self._pool_used + capacity, 1024)
+        pool_indices = np.empty(size, dtype=np.int32)
+        pool_data = np.empty(size, dtype=self.data.dtype)
+        pool_indices[: self._pool_used] = self.pool_indices[: self._pool_used]
+        pool_data[: self._pool_used] = self.pool_data[: self._pool_used]
+        self.pool_indices = pool_indices
+        self.pool_data = pool_data
+
+    def _collect_pool_garbage(self) -> None:
+        """Pack the live slots of the pool to its head"""
+        rows = np.flatnonzero(self.pool_start[: self.shape[0]] >= 0)
+        rows = rows[np.argsort(self.pool_start[rows], kind="stable")]
+        used = 0
+        for r in rows:
+            start, capacity = self.pool_start[r], self.pool_capacity[r]
+            # slots are moved towards the head in order, so they never overlap their targets
+            self.pool_indices[used : used + capacity] = self.pool_indices[start : start + capacity]
+            self.pool_data[used : used + capacity] = self.pool_data[start : start + capacity]
+            self.pool_start[r] = used
+            used += capacity
+        self._pool_used = used
+        self._pool_garbage = 0
+
+    def needs_compaction(self) -> bool:
+        """Whether the base contains more moved-out rows than live ones"""
+        return self._base_garbage * 2 > len(self.indices)
+
+    def to_csr_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the whole matrix as CSR arrays (indptr, indices, data)
+
+        The base arrays are returned without copying if the store is compact.
+        """
+        if self.is_compact():
+            return self.indptr, self.indices, self.data
+        lengths = self.row_lengths()
+        indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        data = np.empty(indptr[-1], dtype=self.data.dtype)
+
+        # rows read from the base are copied in one vectorized step
+        base_rows = np.flatnonzero(self.pool_start[: self.base_rows] < 0)
+        src = _ranges(self.indptr[base_rows], self.indptr[base_rows + 1])
+        dst = _ranges(indptr[base_rows], indptr[base_rows + 1])
+        indices[dst] = self.indices[src]
+        data[dst] = self.data[src]
+
+        pool_rows = np.flatnonzero(self.pool_start[: self.shape[0]] >= 0)
+        src = _ranges(self.pool_start[pool_rows], self.pool_start[pool_rows] + lengths[pool_rows])
+        dst = _ranges(indptr[pool_rows], indptr[pool_rows + 1])
+        indices[dst] = self.pool_indices[src]
+        data[dst] = self.pool_data[src]
+        return indptr, indices, data
+
+    def compact(self) -> None:
+        """Merge the pool into a new CSR base"""
+        if self.is_compact():
+            return
+        self.indptr, self.indices, self.data = self.to_csr_arrays()
+        self._source = None
+        self._reset_pool()
+
+    def rows_csr(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return CSR arrays (indptr, indices, data) whose j-th row is the row rows[j]"""
+        row_slices = [self.row(r) for r in rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(indices) for indices, _ in row_slices], out=indptr[1:])
+        if not row_slices:
+            return indptr, self.indices[:0], self.data[:0]
+        indices = np.concatenate([indices for indices, _ in row_slices])
+        data = np.concatenate([data for _, data in row_slices])
+        return indptr, indices, data
+
+    def to_csr(self) -> sps.csr_matrix:
+        """Return the whole matrix as a scipy CSR matrix"""
+        indptr, indices, data = self.to_csr_arrays()
+        return sps.csr_matrix((data, indices, indptr), shape=self.shape)
+
+
+class MmapInteractions:
+    """Rating matrix on disk for out-of-core training
+
+    A directory holds the matrix in CSR (user-major) and CSC (item-major) order as the files
+    user_indptr.npy, user_indices.npy, user_data.npy, item_indptr.npy, item_indices.npy and
+    item_data.npy, which are opened with mmap_mode="r".
+    fit() streams over them block by block, so that they need not fit in memory.
+    Create the files with save() from a scipy matrix or with build() from chunks of ratings.
+
+    Parameters
+    ----------
+    path: Union[pathlib.Path, str]
+        Directory of the files
+    """
+
+    def __init__(self, path: Union[Path, str]) -> None:
+        self.path = Path(path).resolve()
+        user_indptr, _, data = _open_csr(self.path, "user")
+        item_indptr, _, _ = _open_csr(self.path, "item")
+        self.shape = (len(user_indptr) - 1, len(item_indptr) - 1)
+        self.nnz = int(user_indptr[-1])
+        self.dtype = data.dtype
+
+    def user_store(self) -> InteractionStore:
+        """Return a user-major store over the files"""
+        return InteractionStore.open(self.path, "user", self.shape[1])
+
+    def item_store(self) -> InteractionStore:
+        """Return an item-major store over the files"""
+        return InteractionStore.open(self.path, "item", self.shape[0])
+
+    @classmethod
+    def save(
+        cls, path: Union[Path, str], user_items: sps.spmatrix, dtype: type = np.float32
+    ) -> "MmapInteractions":
+        """Write a rating matrix to the directory path
+
+        Parameters
+        ----------
+        path: Union[pathlib.Path, str]
+            Directory to write the files to
+        user_items: scipy.sparse.spmatrix
+            Rating matrix for user-item pairs
+        dtype: type
+            Data type of the ratings, which must be the dtype of the model to fit
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        user_items = sps.csr_matrix(user_items, dtype=dtype)
+        for prefix, matrix in [("user", user_items), ("item", user_items.tocsc().T)]:
+            np.save(path / f"{prefix}_indptr.npy", matrix.indptr.astype(np.int64))
+            np.save(path / f"{prefix}_indices.npy", matrix.indices.astype(np.int32))
+            np.save(path / f"{prefix}_data.npy", matrix.data)
+        return cls(path)
+
+    @classmethod
+    def build(
+        cls,
+        path: Union[Path, str],
+        read_chunks: Callable[[], Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]],
+        shape: Tuple[int, int],
+        dtype: type = np.float32,
+    ) -> "MmapInteractions":
+        """Write a rating matrix given in chunks to the directory path
+
+        Only one chunk and the per-row counters are held in memory.
+        The files are filled in two passes, so read_chunks is called twice.
+
+        Parameters
+        ----------
+        path: Union[pathlib.Path, str]
+            Directory to write the files to
+        read_chunks: Callable[[], Iterable[Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]]
+            Function returning an iterable of (users, items, ratings) arrays,
+            e.g. reading a large file with pandas.read_csv(chunksize=...).
+            Each user-item pair must appear only once.
+        shape: Tuple[int, int]
+            The number of users and items
+        dtype: type
+            Data type of the ratings, which must be the dtype of the model to fit
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        n_users, n_items = shape
+        user_counts = np.zeros(n_users, dtype=np.int64)
+        item_counts = np.zeros(n_items, dtype=np.int64)
+        for users, items, _ in read_chunks():
+            if len(users) and (users.max() >= n_users or items.max() >= n_items):
+                raise ValueError(f"user or item IDs exceed the shape {shape}")
+            user_counts += np.bincount(users, minlength=n_users)
+            item_counts += np.bincount(items, minlength=n_items)
+
+        files = {}
+        for prefix, counts in [("user", user_counts), ("item", item_counts)]:
+            indptr = open_memmap(
+                path / f"{prefix}_indptr.npy", mode="w+", dtype=np.int64, shape=(len(counts) + 1,)
+            )
+            indptr[0] = 0
+            np.cumsum(counts, out=indptr[1:])
+            nnz = int(indptr[-1])
+            indices = open_memmap(
+                path / f"{prefix}_indices.npy", mode="w+", dtype=np.int32, shape=(nnz,)
+            )
+            data = open_memmap(path / f"{prefix}_data.npy", mode="w+", dtype=dtype, shape=(nnz,))
+            files[prefix] = (indptr, indices, data)
+
+        # the next free position of each row
+        user_next = np.array(files["user"][0][:-1])
+        item_next = np.array(files["item"][0][:-1])
+        for users, items, ratings in read_chunks():
+            _scatter(users, items, ratings, user_next, *files["user"][1:])
+            _scatter(items, users, ratings, item_next, *files["item"][1:])
+        for arrays in files.values():
+            for a in arrays:
+                a.flush()
+        return cls(path)
+
+
+def _open_csr(path: Path, prefix: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Open the CSR arrays (indptr, indices, data) written by MmapInteractions"""
+    return (
+        np.load(path / f"{prefix}_indptr.npy", mmap_mode="r"),
+        np.load(path / f"{prefix}_indices.npy", mmap_mode="r"),
+        np.load(path / f"{prefix}_data.npy", mmap_mode="r"),
+    )
+
+
+def _scatter(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    values: np.ndarray,
+    next_pos: np.ndarray,
+    indices: np.ndarray,
+    data: np.ndarray,
+) -> None:
+    """Append the elements (rows[k], cols[k]) to their rows of the CSR arrays"""
+    order = np.argsort(rows, kind="stable")
+    rows = rows[order]
+    # rank of each element among the elements of the same row in this chunk
+    group_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    ranks = np.arange(len(rows)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(rows)]))
+    positions = next_pos[rows] + ranks
+    indices[positions] = cols[order]
+    data[positions] = values[order]
+    next_pos += np.bincount(rows, minlength=len(next_pos))
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenate np.arange(starts[k], ends[k]) for all k"""
+    lengths = ends - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    nonempty = lengths > 0
+    starts, ends, lengths = starts[nonempty], ends[nonempty], lengths[nonempty]
+    steps = np.ones(total, dtype=np.int64)
+    steps[0] = starts[0]
+    bounds = np.cumsum(lengths)[:-1]
+    steps[bounds] = starts[1:] - ends[:-1] + 1
+    return np.cumsum(steps)
@@ -0,0 +1,61 @@
+import multiprocessing as mp
+import os
+from distutils.util import strtobool
+from multiprocessing.context import BaseContext
+from typing import Optional
+
+_USE_NUMBA = bool(strtobool(os.environ.get("USE_NUMBA", "True")))
+_USE_NUMBA_PARALLEL = bool(strtobool(os.environ.get("USE_NUMBA_PARALLEL", "True")))
+# The update kernels gather the vectors of a row into a row-major workspace,
+# or a factor-major one with USE_FACTOR_MAJOR=1 (see eals._empty_workspace()).
+_USE_FACTOR_MAJOR = bool(strtobool(os.environ.get("USE_FACTOR_MAJOR", "False")))
+# Compiled kernels are cached on disk (see warmup()).
+# Numba does not distinguish parallel and serial builds in its cache, nor the workspace
+# layouts, so only the parallel kernels of the default layout are cached.
+_USE_NUMBA_CACHE = (
+    _USE_NUMBA_PARALLEL
+    and not _USE_FACTOR_MAJOR
+    and bool(strtobool(os.environ.get("USE_NUMBA_CACHE", "True")))
+)
+
+if _USE_NUMBA:
+    from numba import get_num_threads, njit, prange
+else:
+    prange = range
+
+    def njit(*args, **kwargs):
+        def nojit(f):
+            return f
+
+        return nojit
+
+    def get_num_threads():
+        return 1
+
+
+def worker_threads(n_workers: int, threads_per_worker: Optional[int] = None) -> int:
+    """Return the number of Numba threads of each of n_workers worker processes
+
+    threads_per_worker if given, otherwise the threads of this process divided among the
+    workers. Raises ValueError unless n_workers is positive.
+    """
+    if n_workers < 1:
+        raise ValueError(f"n_workers must be positive, not {n_workers}")
+    return threads_per_worker or max(1, get_num_threads() // n_workers)
+
+
+def worker_context() -> BaseContext:
+    """Return the multiprocessing context of worker processes
+
+    Workers are started with the "spawn" method, since forking a process whose Numba threads
+    are running is unsafe.
+    """
+    return mp.get_context("spawn")
+
+
+def init_worker_threads(n_threads: int) -> None:
+    """Limit the Numba threads of a worker process to n_threads (see worker_threads())"""
+    if _USE_NUMBA:
+        from numba import set_num_threads
+
+        set_num_threads(min(n_threads, get_num_threads()))
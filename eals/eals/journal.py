@@ -0,0 +1,456 @@
+import copy
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .eals import ElementwiseAlternatingLeastSquares, load_model
+from .inference import InferenceModel
+from .serializer import deserialize_eals_directory, serialize_eals_directory
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None  # type: ignore
+
+# file holding the generation of the current snapshot of a JournaledModel
+CURRENT_FILE = "CURRENT"
+# file locked by the processes writing to the directory of a JournaledModel
+LOCK_FILE = "LOCK"
+
+
+class UpdateJournal:
+    """Append-only file of the events of online training
+
+    Each record holds the user and the item of an event and their latent vectors after
+    update_model() has applied it. The records have a fixed size, so that a record is appended
+    with a single write and the records are read back with one numpy.frombuffer.
+    A record torn by a crash at the end of the file is ignored by read() and removed by
+    repair().
+
+    Parameters
+    ----------
+    file: Union[pathlib.Path, str]
+        File of the journal, which is created by the first append()
+    factors: int
+        Dimension of the latent vectors
+    dtype: type
+        Data type of the latent vectors
+    fsync: bool
+        Whether append() waits until the record is on disk.
+        Otherwise, a record survives a crash of the process but not of the machine.
+    """
+
+    def __init__(
+        self,
+        file: Union[Path, str],
+        factors: int,
+        dtype: type = np.float64,
+        fsync: bool = False,
+    ) -> None:
+        self.file = Path(file)
+        self.record_dtype = np.dtype(
+            [
+                ("user", "<i8"),
+                ("item", "<i8"),
+                ("user_vector", dtype, (factors,)),
+                ("item_vector", dtype, (factors,)),
+            ]
+        )
+        self.fsync = fsync
+
+    def __len__(self) -> int:
+        """The number of complete records"""
+        return self._size() // self.record_dtype.itemsize
+
+    def _size(self) -> int:
+        try:
+            return self.file.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(
+        self, user: int, item: int, user_vector: np.ndarray, item_vector: np.ndarray
+    ) -> None:
+        """Append the record of an event"""
+        record = np.zeros(1, dtype=self.record_dtype)
+        record["user"] = user
+        record["item"] = item
+        record["user_vector"] = user_vector
+        record["item_vector"] = item_vector
+        fd = os.open(self.file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record.tobytes())
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def read(self, start: int = 0) -> np.ndarray:
+        """Return the complete records from the start-th one as a structured array"""
+        itemsize = self.record_dtype.itemsize
+        try:
+            with open(self.file, "rb") as f:
+                f.seek(start * itemsize)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        return np.frombuffer(data, dtype=self.record_dtype, count=len(data) // itemsize)
+
+    def repair(self) -> None:
+        """Remove a torn record at the end of the file"""
+        size = self._size()
+        torn = size % self.record_dtype.itemsize
+        if torn:
+            os.truncate(self.file, size - torn)
+
+
+class JournaledModel:
+    """ElementwiseAlternatingLeastSquares saved as a snapshot and a journal of the updates since
+
+    update() applies an event with update_model() and appends it to the journal, so that its
+    I/O is a record of O(factors) bytes whatever the size of the model, instead of saving the
+    whole model. When the journal holds compact_every records, a background thread writes a
+    new snapshot of the model and the updates go on to a new journal (see compact()).
+
+    The directory path holds:
+
+    - snapshot-<g>: the model after the updates of the journals before g, saved by
+      save(format="directory")
+    - journal-<g>: the updates after those of journal-<g-1>, as an UpdateJournal
+    - CURRENT: the generation g of the latest complete snapshot
+
+    Opening the directory loads the current snapshot and replays the current journal and the
+    later ones on top of it. Several processes may open the same directory, e.g. the workers
+    of a web server: update() locks the directory and first replays the events appended by
+    the other processes (see refresh()), so that all of them apply the events in the order of
+    the journal. Create the directory with create().
+
+    Parameters
+    ----------
+    path: Union[pathlib.Path, str]
+        Directory of the snapshots and the journals
+    compact_every: int
+        The number of records of a journal after which update() starts a compaction.
+        0 disables automatic compactions.
+    mmap: bool
+        Memory-map the snapshot (see load_model())
+    fsync: bool
+        Whether update() waits until its record is on disk (see UpdateJournal)
+
+    Attributes
+    ----------
+    model: ElementwiseAlternatingLeastSquares
+        The model with all the updates replayed or applied by this object
+    generation: int
+        Generation of the journal to which update() appends
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, str],
+        compact_every: int = 10_000,
+        mmap: bool = True,
+        fsync: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        self.compact_every = compact_every
+        self.mmap = mmap
+        self.fsync = fsync
+        # guards the model against the threads of this process;
+        # the lock file guards the directory against the other processes
+        self._lock = threading.RLock()
+        self._compaction: Optional[threading.Thread] = None
+        with self._lock, _locked(self.path):
+            self._load()
+
+    @classmethod
+    def create(
+        cls,
+        path: Union[Path, str],
+        model: ElementwiseAlternatingLeastSquares,
+        if_older_than: Optional[float] = None,
+        **kwargs: Any,
+    ) -> "JournaledModel":
+        """Start the directory path from the model and open it
+
+        An existing directory starts a new generation from the model, which replaces its
+        snapshot and its journals. kwargs are passed to JournaledModel.
+
+        Parameters
+        ----------
+        if_older_than: float
+            Start the new generation only if the directory has no snapshot yet or its current
+            snapshot is older than this time in seconds since the epoch, e.g. the mtime of the
+            file of the model (see snapshot_time()). The check holds the lock of the directory,
+            so that of the processes starting together from the same model only one creates it.
+            float("-inf") creates the directory only if it has no snapshot.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with _locked(path):
+            current = snapshot_time(path)
+            if if_older_than is None or current is None or current < if_older_than:
+                generations = _generations(path, "snapshot-") + _generations(path, "journal-")
+                generation = max(generations, default=-1) + 1
+                _write_snapshot(path, generation, *model._directory_state())
+                _switch_generation(path, generation)
+        return cls(path, **kwargs)
+
+    def _journal(self, generation: int) -> UpdateJournal:
+        return UpdateJournal(
+            self.path / f"journal-{generation}",
+            self.model.factors,
+            self.model.factor_dtype,
+            fsync=self.fsync,
+        )
+
+    def _load(self) -> None:
+        """Remove the old generations, load the current snapshot and replay the journals"""
+        self.generation = _current_generation(self.path)
+        # e.g. a snapshot written by a process which has crashed before removing the old ones
+        _prune(self.path, self.generation)
+        self.model = load_model(self.path / f"snapshot-{self.generation}", mmap=self.mmap)
+        # the number of records of the journal of this generation which have been applied
+        self._applied = 0
+        self._replay()
+
+    def _replay(self) -> int:
+        """Apply the records appended since the last call; returns their number"""
+        replayed = 0
+        while True:
+            journal = self._journal(self.generation)
+            journal.repair()
+            records = journal.read(self._applied)
+            for user, item in zip(records["user"].tolist(), records["item"].tolist()):
+                self.model.update_model(user, item)
+            self._applied += len(records)
+            replayed += len(records)
+            if not (self.path / f"journal-{self.generation + 1}").exists():
+                return replayed
+            self.generation += 1
+            self._applied = 0
+
+    def refresh(self) -> int:
+        """Apply the updates appended to the journals by other processes
+
+        If a compaction of another process has removed a journal before this process has
+        replayed it, the model is loaded again from the new snapshot.
+
+        Returns the number of updates applied, or -1 if the model has been loaded again.
+        """
+        with self._lock, _locked(self.path):
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        if _current_generation(self.path) > self.generation:
+            self._load()
+            return -1
+        return self._replay()
+
+    def update(self, u: int, i: int) -> None:
+        """Apply an event with update_model() and append it to the journal
+
+        The updates of the other processes are applied first (see refresh()).
+        """
+        with self._lock, _locked(self.path):
+            self._refresh()
+            self.model.update_model(u, i)
+            self._journal(self.generation).append(u, i, self.model.U[u], self.model.V[i])
+            self._applied += 1
+            start = self.compact_every > 0 and self._applied >= self.compact_every
+        if start and (self._compaction is None or not self._compaction.is_alive()):
+            self.compact(wait=False)
+
+    def compact(self, wait: bool = True) -> None:
+        """Write a snapshot of the model and start a new journal
+
+        The arrays of the model are copied and the journal is switched while the updates are
+        blocked, and the snapshot is then written from the copies. The old snapshot and
+        journals are removed once the new snapshot is complete.
+
+        Parameters
+        ----------
+        wait: bool
+            Whether to wait for the snapshot to be written, or to write it in a background
+            thread
+        """
+        with self._lock, _locked(self.path):
+            self._refresh()
+            generation = self.generation + 1
+            header, arrays = self.model._directory_state()
+            # the other arrays are either new or immutable (see InteractionStore)
+            for key in ["U", "V", "Wi", "SU", "SU_compensation", "SV", "SV_compensation"]:
+                arrays[key] = np.array(arrays[key])
+            header = copy.deepcopy(header)
+            (self.path / f"journal-{generation}").touch()
+            self.generation = generation
+            self._applied = 0
+        self._compaction = threading.Thread(
+            target=self._write_snapshot, args=(generation, header, arrays)
+        )
+        self._compaction.start()
+        if wait:
+            self._compaction.join()
+
+    def _write_snapshot(
+        self, generation: int, header: Dict[str, Any], arrays: Dict[str, np.ndarray]
+    ) -> None:
+        _write_snapshot(self.path, generation, header, arrays)
+        with _locked(self.path):
+            _switch_generation(self.path, generation)
+
+    def close(self) -> None:
+        """Wait for a running compaction"""
+        if self._compaction is not None:
+            self._compaction.join()
+
+
+def load_inference(path: Union[Path, str]) -> InferenceModel:
+    """Open the latent vectors of a JournaledModel for serving
+
+    The vectors of the current snapshot are memory-mapped, and those of the users and items
+    in the journals are overwritten with their latest versions in the records, without
+    replaying the updates.
+    Wi and SV of fold_in_users() are those of the snapshot.
+
+    Parameters
+    ----------
+    path: Union[pathlib.Path, str]
+        Directory of a JournaledModel
+    """
+    path = Path(path)
+    # the snapshot is mapped before a compaction can remove it
+    with _locked(path):
+        generation = _current_generation(path)
+        header, arrays = deserialize_eals_directory(path / f"snapshot-{generation}", mmap=True)
+    model = InferenceModel(
+        arrays["U"],
+        arrays["V"],
+        arrays["Wi"],
+        arrays["SV"],
+        regularization=header["regularization"],
+        num_iter_online=header["num_iter_online"],
+        dtype=np.dtype(header["dtype"]).type,
+    )
+    records: List[np.ndarray] = []
+    while (path / f"journal-{generation}").exists():
+        journal = UpdateJournal(
+            path / f"journal-{generation}",
+            header["factors"],
+            np.dtype(header["factor_dtype"]).type,
+        )
+        records.append(journal.read())
+        generation += 1
+    if records:
+        model.set_factors(*_latest_factors(records))
+    return model
+
+
+def journal_version(path: Union[Path, str]) -> Tuple[int, Tuple[int, ...]]:
+    """Version of the directory of a JournaledModel, which changes with every update
+
+    It consists of the current generation and the sizes of the journals to replay.
+    """
+    path = Path(path)
+    generation = _current_generation(path)
+    sizes = []
+    while True:
+        try:
+            sizes.append((path / f"journal-{generation + len(sizes)}").stat().st_size)
+        except FileNotFoundError:
+            return generation, tuple(sizes)
+
+
+def _latest_factors(
+    records: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return the users and items of the records with their latest vectors (see set_factors())"""
+    record = np.concatenate(records)
+    users, user_vectors = _latest(record["user"], record["user_vector"])
+    items, item_vectors = _latest(record["item"], record["item_vector"])
+    return users, user_vectors, items, item_vectors
+
+
+def snapshot_time(path: Union[Path, str]) -> Optional[float]:
+    """Modification time of the current snapshot of a JournaledModel, or None if there is none"""
+    path = Path(path)
+    try:
+        return (path / f"snapshot-{_current_generation(path)}").stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _latest(ids: np.ndarray, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the distinct ids and the last of their vectors in the order of the records"""
+    unique, first_of_reversed = np.unique(ids[::-1], return_index=True)
+    return unique, vectors[::-1][first_of_reversed]
+
+
+def _write_snapshot(
+    path: Path, generation: int, header: Dict[str, Any], arrays: Dict[str, np.ndarray]
+) -> None:
+    """Write snapshot-<generation>, which appears under its name only when complete"""
+    tmp_dir = path / f"snapshot-{generation}.{os.getpid()}.tmp"
+    serialize_eals_directory(tmp_dir, header, arrays)
+    os.replace(tmp_dir, path / f"snapshot-{generation}")
+
+
+def _switch_generation(path: Path, generation: int) -> None:
+    """Make snapshot-<generation> current and remove the older generations
+
+    If a later generation is already current, e.g. started by create() while a compaction was
+    writing snapshot-<generation>, the snapshot is removed instead.
+    The caller must hold the lock of the directory.
+    """
+    if not (path / CURRENT_FILE).exists() or _current_generation(path) < generation:
+        tmp_file = path / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+        tmp_file.write_text(str(generation))
+        os.replace(tmp_file, path / CURRENT_FILE)
+    _prune(path, _current_generation(path))
+
+
+def _prune(path: Path, generation: int) -> None:
+    """Remove the snapshots and the journals of the generations before generation
+
+    The caller must hold the lock of the directory.
+    """
+    for old in _generations(path, "snapshot-"):
+        if old < generation:
+            shutil.rmtree(path / f"snapshot-{old}")
+    for old in _generations(path, "journal-"):
+        if old < generation:
+            os.remove(path / f"journal-{old}")
+
+
+def _current_generation(path: Path) -> int:
+    return int((path / CURRENT_FILE).read_text())
+
+
+def _generations(path: Path, prefix: str) -> List[int]:
+    """Generations of the complete files or directories with the prefix"""
+    return [
+        int(entry.name[len(prefix) :])
+        for entry in path.iterdir()
+        if entry.name.startswith(prefix) and entry.name[len(prefix) :].isdigit()
+    ]
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Lock the directory path against the other processes
+
+    Without fcntl, e.g. on Windows, only a single process may write to the directory.
+    """
+    with open(path / LOCK_FILE, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
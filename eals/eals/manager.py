@@ -0,0 +1,153 @@
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from .inference import InferenceModel
+from .journal import (
+    JournaledModel,
+    UpdateJournal,
+    _latest_factors,
+    journal_version,
+    load_inference,
+)
+
+
+class ModelManager:
+    """Serve the latent vectors of a JournaledModel from memory and serialize its updates
+
+    get() returns an InferenceModel kept in memory, which load_inference() loads once, and
+    compares the version of the directory at most every check_interval seconds.
+    When updates have been appended to the journals since, by this process or another one,
+    only their records are read instead of the whole journal, and the model is loaded again
+    only when a new snapshot is current. Either way, get() then returns a new InferenceModel
+    (see InferenceModel.with_factors()), which replaces the reference to the old one, so that
+    the requests being served keep the vectors they started with. A single thread checks the
+    version while the other ones go on with the old vectors.
+
+    The records hold the vectors of the users and the items, but not the weights Wi and the
+    Gram matrix SV, which stay those of the snapshot until the next compaction.
+    fold_in_users() thus folds in unknown users against the SV of the snapshot, and items
+    added since have zero weights.
+
+    update() is the single path of the updates of this process: they are applied in turn to a
+    JournaledModel opened on first use, and the next get() reads them.
+
+    Parameters
+    ----------
+    path: Union[pathlib.Path, str]
+        Directory of a JournaledModel
+    check_interval: float
+        Seconds between the checks of the version of the directory
+    compact_every: int
+        Passed to the JournaledModel of update()
+
+    Attributes
+    ----------
+    reloads: int
+        The number of times the model has been loaded from a snapshot
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, str],
+        check_interval: float = 1.0,
+        compact_every: int = 10_000,
+    ) -> None:
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self.compact_every = compact_every
+        self.reloads = 0
+        self._model: Optional[InferenceModel] = None
+        self._version: Optional[Tuple[int, Tuple[int, ...]]] = None
+        # the number of records of each journal of the version which have been applied
+        self._applied: List[int] = []
+        self._checked = -float("inf")
+        # update() increments _updates, and a check covers the updates counted when it starts
+        self._updates = 0
+        self._checked_updates = -1
+        self._reload_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._journaled: Optional[JournaledModel] = None
+
+    def get(self) -> InferenceModel:
+        """Return the latent vectors, with the changes of the directory applied"""
+        model = self._model
+        if (
+            model is not None
+            and self._checked_updates == self._updates
+            and time.monotonic() - self._checked < self.check_interval
+        ):
+            return model
+        if model is None:
+            # nothing to serve yet, so that every caller waits for the first load
+            with self._reload_lock:
+                if self._model is None:
+                    self._reload()
+        elif self._reload_lock.acquire(blocking=False):
+            try:
+                updates = self._updates
+                if journal_version(self.path) != self._version:
+                    self._reload()
+                self._checked = time.monotonic()
+                self._checked_updates = updates
+            finally:
+                self._reload_lock.release()
+        assert self._model is not None
+        return self._model
+
+    def reload(self) -> InferenceModel:
+        """Apply the changes of the directory now"""
+        with self._reload_lock:
+            self._reload()
+        assert self._model is not None
+        return self._model
+
+    def _reload(self) -> None:
+        # the version is taken first, so that a change during the load triggers another one
+        updates = self._updates
+        version = journal_version(self.path)
+        generation, sizes = version
+        if self._model is None or self._version is None or self._version[0] != generation:
+            model = load_inference(self.path)
+            # the records appended during the load are applied again by the next check,
+            # which overwrites their vectors with the same ones
+            itemsize = self._journal(model, generation).record_dtype.itemsize
+            self._applied = [size // itemsize for size in sizes]
+            self._model = model
+            self.reloads += 1
+        else:
+            # journals started by compactions since are read from their start; a journal
+            # removed by a compaction meanwhile reads as empty, and the next check loads the
+            # snapshot of the new generation
+            starts = self._applied + [0] * (len(sizes) - len(self._applied))
+            records = [
+                self._journal(self._model, generation + k).read(start)
+                for k, start in enumerate(starts)
+            ]
+            self._applied = [start + len(r) for start, r in zip(starts, records)]
+            if sum(len(r) for r in records):
+                self._model = self._model.with_factors(*_latest_factors(records))
+        self._version = version
+        self._checked = time.monotonic()
+        self._checked_updates = updates
+
+    def _journal(self, model: InferenceModel, generation: int) -> UpdateJournal:
+        return UpdateJournal(
+            self.path / f"journal-{generation}", model.factors, model.item_factors.dtype.type
+        )
+
+    def update(self, u: int, i: int) -> None:
+        """Apply an event with JournaledModel.update()"""
+        with self._write_lock:
+            if self._journaled is None:
+                self._journaled = JournaledModel(self.path, compact_every=self.compact_every)
+            self._journaled.update(u, i)
+            # the next get() checks the version, so that this process reads its own updates
+            self._updates += 1
+
+    def close(self) -> None:
+        """Wait for a running compaction of update()"""
+        with self._write_lock:
+            if self._journaled is not None:
+                self._journaled.close()
@@ -0,0 +1,301 @@
+import csv
+import itertools
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import scipy.sparse as sps
+
+from .eals import ElementwiseAlternatingLeastSquares, MmapInteractions
+from .jit import init_worker_threads, worker_context, worker_threads
+from .util import Timer
+
+# columns of the results table after the parameters of the configurations
+RESULT_COLUMNS = ["iterations", "loss", "fit_sec", "eval_sec", "hr", "ndcg", "wall_sec"]
+
+
+def prepare_search_data(
+    path: Union[Path, str],
+    user_items: sps.spmatrix,
+    dtype: type = np.float32,
+    random_state: Optional[int] = None,
+) -> MmapInteractions:
+    """Split the ratings for leave-one-out evaluation and write them to the directory path
+
+    One random rating of each user with two or more ratings is held out as the test rating,
+    and the others are written as the training matrix in the format of MmapInteractions.
+    The test ratings are written as test_users.npy and test_items.npy.
+    HyperparameterSearch workers open these files instead of receiving the data.
+
+    Parameters
+    ----------
+    path: Union[pathlib.Path, str]
+        Directory to write the files to
+    user_items: scipy.sparse.spmatrix
+        Rating matrix for user-item pairs
+    dtype: type
+        Data type of the ratings in the files
+    random_state: int
+        Numpy random seed of the split
+
+    Returns the training matrix.
+    """
+    user_items = sps.csr_matrix(user_items)
+    user_items.sum_duplicates()
+    rng = np.random.default_rng(random_state)
+    lengths = np.diff(user_items.indptr)
+    test_users = np.flatnonzero(lengths >= 2)
+    offsets = (rng.random(len(test_users)) * lengths[test_users]).astype(np.int64)
+    held_out = user_items.indptr[test_users] + offsets
+    test_items = user_items.indices[held_out]
+
+    keep = np.ones(user_items.nnz, dtype=bool)
+    keep[held_out] = False
+    users = np.repeat(np.arange(user_items.shape[0]), lengths)
+    train = sps.csr_matrix(
+        (user_items.data[keep], (users[keep], user_items.indices[keep])), shape=user_items.shape
+    )
+    data = MmapInteractions.save(path, train, dtype=dtype)
+    np.save(Path(path) / "test_users.npy", test_users.astype(np.int64))
+    np.save(Path(path) / "test_items.npy", test_items.astype(np.int64))
+    return data
+
+
+def load_search_data(path: Union[Path, str]) -> Tuple[MmapInteractions, np.ndarray, np.ndarray]:
+    """Open the files written by prepare_search_data()
+
+    Returns (training matrix, test users, test items).
+    """
+    path = Path(path)
+    return (
+        MmapInteractions(path),
+        np.load(path / "test_users.npy"),
+        np.load(path / "test_items.npy"),
+    )
+
+
+def hit_ratio_and_ndcg(
+    model: ElementwiseAlternatingLeastSquares,
+    user_items: Union[sps.spmatrix, MmapInteractions],
+    test_users: np.ndarray,
+    test_items: np.ndarray,
+    k: int = 10,
+    block_size: int = 1024,
+) -> Tuple[float, float]:
+    """Hit ratio and NDCG of the top-k recommendations for the test ratings
+
+    As in the evaluation of the eALS paper, the test item of each user is ranked among all
+    items except those in the user's training ratings.
+
+    Parameters
+    ----------
+    model: ElementwiseAlternatingLeastSquares
+        Model trained on user_items
+    user_items: Union[scipy.sparse.spmatrix, MmapInteractions]
+        Training rating matrix
+    test_users: numpy.ndarray
+        Users of the test ratings
+    test_items: numpy.ndarray
+        Items of the test ratings, in the same order as test_users
+    k: int
+        The number of recommendations
+    block_size: int
+        The number of users whose scores are computed at once
+
+    Returns the means of the hit ratios and the NDCGs.
+    """
+    if isinstance(user_items, MmapInteractions):
+        store = user_items.user_store()
+        indptr, indices = store.indptr, store.indices
+    else:
+        user_items = sps.csr_matrix(user_items)
+        indptr, indices = user_items.indptr, user_items.indices
+    hits = 0.0
+    ndcg = 0.0
+    for lo in range(0, len(test_users), block_size):
+        users = test_users[lo : lo + block_size]
+        items = test_items[lo : lo + block_size]
+        scores = model.user_factors[users] @ model.item_factors.T
+        target = scores[np.arange(len(users)), items]
+        # exclude the training items
+        starts, lengths = indptr[users], indptr[users + 1] - indptr[users]
+        rows = np.repeat(np.arange(len(users)), lengths)
+        offsets = starts - (np.cumsum(lengths) - lengths)
+        positions = np.arange(len(rows)) + np.repeat(offsets, lengths)
+        scores[rows, indices[positions]] = -np.inf
+        ranks = np.sum(scores > target[:, None], axis=1)
+        hit = ranks < k
+        hits += np.sum(hit)
+        ndcg += np.sum(1 / np.log2(ranks[hit] + 2))
+    n = max(len(test_users), 1)
+    return float(hits / n), float(ndcg / n)
+
+
+def grid_configs(grid: Mapping[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """All the combinations of the given values of the parameters"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def random_configs(
+    distributions: Mapping[str, Union[Sequence[Any], Callable[[np.random.Generator], Any]]],
+    n_configs: int,
+    random_state: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Random configurations of the parameters
+
+    Each parameter is drawn uniformly from a sequence of values, or by calling a function
+    with a numpy random Generator, e.g. lambda rng: 10 ** rng.uniform(-3, 0).
+    """
+    rng = np.random.default_rng(random_state)
+    configs = []
+    for _ in range(n_configs):
+        config = {}
+        for key, distribution in distributions.items():
+            if callable(distribution):
+                config[key] = distribution(rng)
+            else:
+                config[key] = distribution[rng.integers(len(distribution))]
+        configs.append(config)
+    return configs
+
+
+class HyperparameterSearch:
+    """Fit and evaluate configurations of ElementwiseAlternatingLeastSquares in parallel
+
+    The data prepared by prepare_search_data() is memory-mapped by each worker process,
+    so that the rating matrix in CSR and CSC order is built once and shared read-only through
+    the page cache instead of being rebuilt or copied for each configuration.
+    Each configuration is fitted for at most num_iter iterations, stopping early when the loss
+    decreases by less than tol for patience consecutive iterations, and then evaluated with
+    hit_ratio_and_ndcg().
+    Each worker evaluates one configuration at a time, so a run uses up to
+    n_workers * threads_per_worker threads.
+
+    Parameters
+    ----------
+    path: Union[pathlib.Path, str]
+        Directory written by prepare_search_data()
+    n_workers: int
+        The number of configurations evaluated at the same time
+    threads_per_worker: int
+        The number of Numba threads with which each configuration is fitted
+        (see jit.worker_threads())
+    k: int
+        The number of recommendations for the hit ratio and NDCG
+    num_iter: int
+        The maximum number of iterations of each fit
+    tol: float
+        Tolerance for early stopping (see ElementwiseAlternatingLeastSquares)
+    patience: int
+        Patience for early stopping (see ElementwiseAlternatingLeastSquares)
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, str],
+        n_workers: int = 2,
+        threads_per_worker: Optional[int] = None,
+        k: int = 10,
+        num_iter: int = 50,
+        tol: float = 1e-4,
+        patience: int = 2,
+    ) -> None:
+        worker_threads(n_workers, threads_per_worker)
+        self.path = Path(path).resolve()
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        self.k = k
+        self.num_iter = num_iter
+        self.tol = tol
+        self.patience = patience
+
+    def run(
+        self,
+        configs: Iterable[Mapping[str, Any]],
+        results_file: Optional[Union[Path, str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Evaluate the configurations
+
+        Each configuration is a dict of keyword arguments of ElementwiseAlternatingLeastSquares,
+        e.g. from grid_configs() or random_configs(). The keys num_iter, tol and patience
+        override those of the search.
+
+        Parameters
+        ----------
+        configs: Iterable[Mapping[str, Any]]
+            Configurations to evaluate
+        results_file: Union[pathlib.Path, str]
+            CSV file to which a row is written as soon as a configuration is evaluated,
+            with the parameters followed by RESULT_COLUMNS. wall_sec is the time from the start
+            of the search, so that the quality reached can be plotted against wall time.
+
+        Returns the rows of the results table in the order of completion.
+        """
+        configs = [dict(config) for config in configs]
+        params = sorted({key for config in configs for key in config})
+        threads_per_worker = worker_threads(self.n_workers, self.threads_per_worker)
+        defaults = {"num_iter": self.num_iter, "tol": self.tol, "patience": self.patience}
+        timer = Timer()
+        wall_sec = 0.0
+        rows: List[Dict[str, Any]] = []
+        writer = None
+        file = open(results_file, "w", newline="") if results_file is not None else None
+        try:
+            if file is not None:
+                writer = csv.DictWriter(file, fieldnames=params + RESULT_COLUMNS)
+                writer.writeheader()
+            with worker_context().Pool(
+                self.n_workers,
+                initializer=_init_worker,
+                initargs=(str(self.path), threads_per_worker),
+            ) as pool:
+                tasks = [(j, {**defaults, **config}, self.k) for j, config in enumerate(configs)]
+                for j, result in pool.imap_unordered(_evaluate, tasks):
+                    wall_sec += timer.elapsed()
+                    row = {**configs[j], **result, "wall_sec": wall_sec}
+                    rows.append(row)
+                    if writer is not None and file is not None:
+                        writer.writerow({key: row.get(key, "") for key in writer.fieldnames})
+                        file.flush()
+        finally:
+            if file is not None:
+                file.close()
+        return rows
+
+
+# data of a worker process of HyperparameterSearch, set by _init_worker()
+_data: Optional[Tuple[MmapInteractions, np.ndarray, np.ndarray]] = None
+
+
+def _init_worker(path: str, n_threads: int) -> None:
+    global _data
+    init_worker_threads(n_threads)
+    _data = load_search_data(path)
+
+
+def _evaluate(task: Tuple[int, Dict[str, Any], int]) -> Tuple[int, Dict[str, Any]]:
+    """Fit and evaluate the j-th configuration in a worker process"""
+    assert _data is not None
+    user_items, test_users, test_items = _data
+    j, config, k = task
+    model = ElementwiseAlternatingLeastSquares(**{"dtype": user_items.dtype.type, **config})
+    iterations = 0
+    loss = np.nan
+
+    def record(model: ElementwiseAlternatingLeastSquares, iter: int, iter_loss: float) -> None:
+        nonlocal iterations, loss
+        iterations, loss = iter, iter_loss
+
+    timer = Timer()
+    model.fit(user_items, postprocess=False, callbacks=[record])
+    fit_sec = timer.elapsed()
+    hr, ndcg = hit_ratio_and_ndcg(model, user_items, test_users, test_items, k)
+    return j, {
+        "iterations": iterations,
+        "loss": loss,
+        "fit_sec": fit_sec,
+        "eval_sec": timer.elapsed(),
+        "hr": hr,
+        "ndcg": ndcg,
+    }
@@ -1,11 +1,17 @@
+import json
+import os
 from pathlib import Path
-from typing import Union
+from typing import Any, Dict, Tuple, Union
 import numpy
 
 import joblib
 
 import eals
 
+# version of the directory format written by serialize_eals_directory()
+DIRECTORY_FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+
 
 def serialize_eals_joblib(
     file: Union[Path, str],
@@ -22,28 +28,44 @@ def deserialize_eals_joblib(
     return model
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+def serialize_eals_directory(
+    path: Union[Path, str], header: Dict[str, Any], arrays: Dict[str, numpy.ndarray]
+) -> None:
+    """Write a model as a JSON header and one .npy file per array to the directory path
+
+    Each file is written under a temporary name and renamed over the old one, so that
+    processes which have memory-mapped the old files keep reading them intact.
+    The header is written last and lists the arrays.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, a in arrays.items():
+        # the process ID avoids collisions between processes writing the same files
+        tmp_file = path / f"{name}.npy.{os.getpid()}.tmp"
+        # np.save pads the header so that the data is aligned to 64 bytes
+        with open(tmp_file, "wb") as f:
+            numpy.save(f, numpy.ascontiguousarray(a))
+        os.replace(tmp_file, path / f"{name}.npy")
+    header = {"format_version": DIRECTORY_FORMAT_VERSION, **header, "arrays": sorted(arrays)}
+    tmp_file = path / f"{HEADER_FILE}.{os.getpid()}.tmp"
+    tmp_file.write_text(json.dumps(header, indent=2))
+    os.replace(tmp_file, path / HEADER_FILE)
+
+
+def deserialize_eals_directory(
+    path: Union[Path, str], mmap: bool = False
+) -> Tuple[Dict[str, Any], Dict[str, numpy.ndarray]]:
+    """Read the header and the arrays written by serialize_eals_directory()
+
+    If mmap is True, the arrays are memory-mapped copy-on-write: processes opening the same
+    files share their pages in the page cache until they write to them.
+    """
+    path = Path(path)
+    header: Dict[str, Any] = json.loads((path / HEADER_FILE).read_text())
+    if header.get("format_version") != DIRECTORY_FORMAT_VERSION:
+        raise ValueError(f"unsupported model format version {header.get('format_version')}")
+    mmap_mode = "c" if mmap else None
+    arrays = {
+        name: numpy.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in header["arrays"]
+    }
+    return header, arrays
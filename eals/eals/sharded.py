@@ -0,0 +1,296 @@
+import multiprocessing as mp
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import scipy.sparse as sps
+
+from .eals import (
+    ElementwiseAlternatingLeastSquares,
+    MmapInteractions,
+    _row_block,
+    _update_item_subset,
+    _update_user_subset,
+)
+from .jit import init_worker_threads, worker_context, worker_threads
+
+# how a worker attaches an array: the .npy file of a memory-mapped rating matrix, or the name,
+# shape and dtype of a shared memory block
+_Spec = Union[Path, Tuple[str, Tuple[int, ...], str]]
+
+
+class ShardedTrainer:
+    """Train ElementwiseAlternatingLeastSquares in several worker processes
+
+    Users and items are split into ranges of consecutive rows with about the same cost,
+    one range per worker. The latent vectors, the weights and the Gram matrices SU and SV are
+    placed in shared memory, so that each worker updates its ranges in place with the same
+    Numba kernels as fit(). So is the rating matrix, unless it is a MmapInteractions, whose
+    files each worker memory-maps instead. After each phase, the workers return the
+    Gram matrices of their ranges, whose sum becomes SU or SV for the next phase.
+    Since the vectors of a phase are updated independently of each other,
+    the result equals that of ElementwiseAlternatingLeastSquares.fit() up to rounding errors.
+    The workers are started for each fit() and stopped at its end.
+
+    Parameters
+    ----------
+    n_workers: int
+        The number of worker processes, i.e. of the ranges of users and items
+    threads_per_worker: int
+        The number of Numba threads with which each worker updates its ranges
+        (see jit.worker_threads())
+    """
+
+    def __init__(self, n_workers: int = 2, threads_per_worker: Optional[int] = None) -> None:
+        worker_threads(n_workers, threads_per_worker)
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+
+    def fit(
+        self,
+        model: ElementwiseAlternatingLeastSquares,
+        user_items: Union[sps.spmatrix, MmapInteractions],
+        show_loss: bool = False,
+        postprocess: bool = True,
+        callbacks: Optional[List[Callable[..., Optional[bool]]]] = None,
+        warm_start: bool = False,
+        checkpoint_file: Optional[Union[Path, str]] = None,
+        checkpoint_interval: int = 0,
+    ) -> None:
+        """Fit the model to the given rating data
+
+        The parameters other than model are the same as ElementwiseAlternatingLeastSquares.fit().
+        """
+        threads_per_worker = worker_threads(self.n_workers, self.threads_per_worker)
+        model._init_data(user_items, warm_start=warm_start)
+        with _Workers(model, self.n_workers, threads_per_worker) as workers:
+            model._run_iterations(
+                workers.update_users,
+                workers.update_items,
+                show_loss=show_loss,
+                callbacks=callbacks,
+                checkpoint_file=checkpoint_file,
+                checkpoint_interval=checkpoint_interval,
+            )
+        if postprocess:
+            model._convert_data_for_online_training()
+
+
+class _Workers:
+    """Worker processes sharing the arrays of a model during ShardedTrainer.fit()
+
+    While the context is active, U, V, Wi, SU and SV of the model are views of shared memory.
+    They are copied back to ordinary arrays on exit.
+    """
+
+    def __init__(
+        self, model: ElementwiseAlternatingLeastSquares, n_workers: int, threads_per_worker: int
+    ) -> None:
+        self.model = model
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        self._shared: Dict[str, SharedMemory] = {}
+        self._views: Dict[str, np.ndarray] = {}
+        self._connections: List[Connection] = []
+        self._processes: List[mp.process.BaseProcess] = []
+
+    def __enter__(self) -> "_Workers":
+        model = self.model
+        user_store, item_store = model._user_items, model._user_items_t
+        user_store.compact()
+        item_store.compact()
+        try:
+            specs: Dict[str, _Spec] = {}
+            for prefix, store in [("user", user_store), ("item", item_store)]:
+                for part in ["indptr", "indices", "data"]:
+                    key = f"{prefix}_{part}"
+                    if store._source is None:
+                        specs[key] = self._share(key, getattr(store, part))
+                    else:
+                        # a compact memory-mapped base is read from its files
+                        path, source_prefix = store._source
+                        specs[key] = path / f"{source_prefix}_{part}.npy"
+            for key in ["U", "V", "Wi", "SU", "SV"]:
+                specs[key] = self._share(key, getattr(model, key))
+            model.U, model.V, model.Wi = self._views["U"], self._views["V"], self._views["Wi"]
+            model.SU, model.SV = self._views["SU"], self._views["SV"]
+
+            user_bounds = _balanced_ranges(user_store.indptr, model.factors, self.n_workers)
+            item_bounds = _balanced_ranges(item_store.indptr, model.factors, self.n_workers)
+            context = worker_context()
+            for k in range(self.n_workers):
+                connection, worker_connection = context.Pipe()
+                process = context.Process(
+                    target=_work,
+                    args=(
+                        worker_connection,
+                        specs,
+                        (user_bounds[k], user_bounds[k + 1]),
+                        (item_bounds[k], item_bounds[k + 1]),
+                        model.factors,
+                        model.regularization,
+                        self.threads_per_worker,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+                worker_connection.close()
+                self._connections.append(connection)
+                self._processes.append(process)
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        model = self.model
+        if self._views:
+            model.U, model.V, model.Wi = (
+                self._views[key].copy() for key in ["U", "V", "Wi"]
+            )
+            model.SU, model.SV = self._views["SU"].copy(), self._views["SV"].copy()
+        # the views must be released before the shared memory is closed
+        self._views.clear()
+        for shm in self._shared.values():
+            try:
+                shm.close()
+            except BufferError:
+                # the traceback of an exception may still refer to a view;
+                # the memory is unmapped once it is released
+                pass
+            shm.unlink()
+        self._shared.clear()
+
+    def _share(self, key: str, a: np.ndarray) -> Tuple[str, Tuple[int, ...], str]:
+        """Copy the array to a new shared memory block and return how to attach it"""
+        shm = SharedMemory(create=True, size=max(a.nbytes, 1))
+        self._shared[key] = shm
+        view: np.ndarray = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+        view[...] = a
+        self._views[key] = view
+        return shm.name, a.shape, a.dtype.str
+
+    def _run(self, command: str) -> List[Any]:
+        for connection in self._connections:
+            connection.send(command)
+        results = [connection.recv() for connection in self._connections]
+        for result in results:
+            if isinstance(result, BaseException):
+                raise RuntimeError(f"A worker failed to update {command}") from result
+        return results
+
+    def update_users(self) -> None:
+        """Update all the user latent vectors and SU"""
+        grams = self._run("users")
+        self.model.SU[:] = np.sum(grams, axis=0)
+        self.model._SU.reset_error()
+
+    def update_items(self) -> float:
+        """Update all the item latent vectors and SV
+
+        Returns the loss terms of the non-missing user-item pairs as a by-product.
+        """
+        results = self._run("items")
+        self.model.SV[:] = np.sum([gram for gram, _ in results], axis=0)
+        self.model._SV.reset_error()
+        return sum(loss for _, loss in results)
+
+
+def _balanced_ranges(indptr: np.ndarray, factors: int, n_ranges: int) -> List[int]:
+    """Split rows into n_ranges ranges of consecutive rows with about the same cost
+
+    Returns the boundaries of the ranges.
+    """
+    # updating a row costs O(factors^2 + nnz * factors), see _make_chunks()
+    n_rows = len(indptr) - 1
+    costs = np.diff(indptr) + factors
+    cum_costs = np.cumsum(costs)
+    total = cum_costs[-1] if n_rows > 0 else 0
+    targets = total * np.arange(1, n_ranges) / n_ranges
+    # a row belongs to the first range whose end is beyond the middle of the row
+    inner = np.searchsorted(cum_costs - costs / 2, targets, side="right")
+    return [0] + inner.tolist() + [n_rows]
+
+
+def _work(
+    connection: Connection,
+    specs: Dict[str, _Spec],
+    user_range: Tuple[int, int],
+    item_range: Tuple[int, int],
+    factors: int,
+    regularization: float,
+    n_threads: int,
+) -> None:
+    """Main loop of a worker process of ShardedTrainer"""
+    init_worker_threads(n_threads)
+    # the process which created the shared memory is responsible for unlinking it
+    shared: Dict[str, SharedMemory] = {}
+    a: Dict[str, np.ndarray] = {}
+    for key, spec in specs.items():
+        if isinstance(spec, Path):
+            a[key] = np.load(spec, mmap_mode="r")
+        else:
+            name, shape, dtype = spec
+            shared[key] = SharedMemory(name=name)
+            a[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shared[key].buf)
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        try:
+            if command == "users":
+                connection.send(_sweep_users(a, user_range, factors, regularization, n_threads))
+            else:
+                connection.send(_sweep_items(a, item_range, factors, regularization, n_threads))
+        except Exception as e:
+            connection.send(e)
+    # the views must be released before the shared memory is closed
+    a.clear()
+    for shm in shared.values():
+        shm.close()
+
+
+def _sweep_users(
+    a: Dict[str, np.ndarray],
+    user_range: Tuple[int, int],
+    factors: int,
+    regularization: float,
+    n_threads: int,
+) -> np.ndarray:
+    """Update the user latent vectors of the range and return their part of SU"""
+    lo, hi = user_range
+    rows = _row_block(a["user_indptr"], a["user_indices"], a["user_data"], lo, hi)
+    _update_user_subset(
+        *rows, a["U"], a["V"], a["SV"], a["Wi"], factors, regularization, n_threads
+    )
+    U = a["U"][lo:hi]
+    gram: np.ndarray = U.T @ U
+    return gram
+
+
+def _sweep_items(
+    a: Dict[str, np.ndarray],
+    item_range: Tuple[int, int],
+    factors: int,
+    regularization: float,
+    n_threads: int,
+) -> Tuple[np.ndarray, float]:
+    """Update the item latent vectors of the range and return their part of SV and the loss"""
+    lo, hi = item_range
+    rows = _row_block(a["item_indptr"], a["item_indices"], a["item_data"], lo, hi)
+    loss: float = _update_item_subset(
+        *rows, a["U"], a["V"], a["SU"], a["Wi"], factors, regularization, n_threads
+    )
+    V, Wi = a["V"][lo:hi], a["Wi"][lo:hi]
+    return (V.T * Wi) @ V, loss
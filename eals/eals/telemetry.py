@@ -0,0 +1,187 @@
+import json
+import sys
+from typing import Any, Dict, List, Mapping, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+
+class TrainingTelemetry:
+    """Measurements of the training of a model
+
+    fit() records the wall time and the ratings processed per second of each phase of each
+    iteration, the number of threads, and after each iteration the peak RSS of the process and
+    the sizes of the arrays of the model. update_model(), update_model_batch() and
+    refit_dirty() add up their calls, events and wall time.
+    A model starts a new TrainingTelemetry at each fit().
+
+    Attributes
+    ----------
+    iterations: List[Dict[str, Any]]
+        One dict per iteration of fit(), e.g. {"iteration": 1, "threads": 8,
+        "update_user": {"seconds": 0.5, "nnz_per_sec": 2e6}, "update_item": {...},
+        "memory": {...}}
+    online: Dict[str, Dict[str, float]]
+        Totals of the online training methods by name, e.g. {"update_model": {"calls": 3,
+        "events": 3, "seconds": 0.01, "max_seconds": 0.005}}
+    memory: Dict[str, Optional[int]]
+        The last memory snapshot: "peak_rss_bytes" (None where unavailable) and
+        "<array>_bytes" for each array of the model
+    """
+
+    def __init__(self) -> None:
+        self.iterations: List[Dict[str, Any]] = []
+        self.online: Dict[str, Dict[str, float]] = {}
+        self.memory: Dict[str, Optional[int]] = {}
+
+    def record_phase(
+        self, iteration: int, phase: str, seconds: float, nnz: int, threads: int
+    ) -> None:
+        """Record a phase of fit() which processed nnz ratings"""
+        if not self.iterations or self.iterations[-1]["iteration"] != iteration:
+            self.iterations.append({"iteration": iteration, "threads": threads})
+        self.iterations[-1][phase] = {
+            "seconds": seconds,
+            "nnz_per_sec": nnz / seconds if seconds > 0 else None,
+        }
+
+    def record_memory(self, array_bytes: Mapping[str, int]) -> None:
+        """Record the peak RSS and the sizes of the given arrays after an iteration"""
+        self.memory = {"peak_rss_bytes": peak_rss_bytes()}
+        self.memory.update({f"{name}_bytes": int(size) for name, size in array_bytes.items()})
+        if self.iterations:
+            self.iterations[-1]["memory"] = dict(self.memory)
+
+    def record_online(self, method: str, seconds: float, events: int) -> None:
+        """Record a call of an online training method which processed events"""
+        totals = self.online.setdefault(
+            method, {"calls": 0, "events": 0, "seconds": 0.0, "max_seconds": 0.0}
+        )
+        totals["calls"] += 1
+        totals["events"] += events
+        totals["seconds"] += seconds
+        totals["max_seconds"] = max(totals["max_seconds"], seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"iterations": self.iterations, "online": self.online, "memory": self.memory}
+
+    @classmethod
+    def from_dict(cls, measurements: Mapping[str, Any]) -> "TrainingTelemetry":
+        """Restore the measurements exported by to_dict()"""
+        telemetry = cls()
+        telemetry.iterations = list(measurements["iterations"])
+        telemetry.online = dict(measurements["online"])
+        telemetry.memory = dict(measurements["memory"])
+        return telemetry
+
+    def to_json(self, indent: Optional[int] = None) -> str:
+        """Export the measurements as JSON"""
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(
+        self, prefix: str = "eals", labels: Optional[Mapping[str, str]] = None
+    ) -> str:
+        """Export the measurements in the Prometheus text format
+
+        Parameters
+        ----------
+        prefix: str
+            Prefix of the metric names
+        labels: Mapping[str, str]
+            Labels added to every sample, e.g. {"model": "movies"}
+        """
+        metrics = _PrometheusText(prefix, labels or {})
+        iterations = [({}, len(self.iterations))]
+        metrics.add("fit_iterations", "gauge", "Iterations run by the last fit()", iterations)
+        phases = sorted(
+            {key for it in self.iterations for key in it if key.startswith("update_")}
+        )
+        seconds = [
+            ({"phase": phase}, sum(it[phase]["seconds"] for it in self.iterations if phase in it))
+            for phase in phases
+        ]
+        metrics.add(
+            "fit_phase_seconds_total",
+            "counter",
+            "Wall time of the phases of the last fit()",
+            seconds,
+        )
+        if self.iterations:
+            last = self.iterations[-1]
+            throughputs = [
+                ({"phase": phase}, last[phase]["nnz_per_sec"]) for phase in phases if phase in last
+            ]
+            metrics.add(
+                "fit_phase_nnz_per_second",
+                "gauge",
+                "Ratings processed per second by the phases of the last iteration",
+                throughputs,
+            )
+            metrics.add(
+                "fit_threads", "gauge", "Threads of the last iteration", [({}, last["threads"])]
+            )
+
+        online = sorted(self.online.items())
+        for key, kind, help in [
+            ("calls", "counter", "Calls of the online training methods"),
+            ("events", "counter", "Events processed by the online training methods"),
+            ("seconds", "counter", "Wall time of the online training methods"),
+            ("max_seconds", "gauge", "Longest call of the online training methods"),
+        ]:
+            name = f"online_{key}" if kind == "gauge" else f"online_{key}_total"
+            metrics.add(name, kind, help, [({"method": m}, t[key]) for m, t in online])
+
+        peak_rss = [({}, self.memory.get("peak_rss_bytes"))]
+        metrics.add("peak_rss_bytes", "gauge", "Peak resident set size of the process", peak_rss)
+        sizes = [
+            ({"array": key[: -len("_bytes")]}, size)
+            for key, size in self.memory.items()
+            if key != "peak_rss_bytes"
+        ]
+        metrics.add("array_bytes", "gauge", "Sizes of the arrays of the model", sizes)
+        return metrics.text()
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process, or None where it is unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+class _PrometheusText:
+    """Builder of metrics in the Prometheus text exposition format"""
+
+    def __init__(self, prefix: str, labels: Mapping[str, str]) -> None:
+        self.prefix = prefix
+        self.labels = dict(labels)
+        self.lines: List[str] = []
+
+    def add(self, name: str, kind: str, help: str, samples: List[Any]) -> None:
+        """Add a metric with samples of (labels, value); samples whose value is None are skipped"""
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        name = f"{self.prefix}_{name}"
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{self._format_labels({**self.labels, **labels})} {value}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels: Mapping[str, str]) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            for value in labels.values()
+        )
+        pairs = ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+        return "{" + pairs + "}"
@@ -11,6 +11,7 @@ def create_user_items(
     # rating_fn must return a float array of shape (data_count,)
     rating_fn=lambda data_count: (np.random.rand(data_count) * 10 + 2).astype(np.float32),
     random_seed=None,
+    power_law_exponent: float = 0.0,
 ) -> sps.spmatrix:
     """Create random rating matrix
 
@@ -26,15 +27,30 @@ def create_user_items(
         The function to generate the rating matrix
     random_seed: int
         The random seed
+    power_law_exponent: float
+        If positive, the user and the item of the k-th rank are chosen with probability
+        proportional to 1 / k ** power_law_exponent, which imitates the long-tailed activity
+        of real data. 0 (default) chooses users and items uniformly.
     """
     if random_seed:
         np.random.seed(random_seed)
     data = rating_fn(data_count)
-    u = np.random.randint(0, user_count, size=data_count)
-    i = np.random.randint(0, item_count, size=data_count)
+    if power_law_exponent > 0:
+        u = _power_law_choice(user_count, data_count, power_law_exponent)
+        i = _power_law_choice(item_count, data_count, power_law_exponent)
+    else:
+        u = np.random.randint(0, user_count, size=data_count)
+        i = np.random.randint(0, item_count, size=data_count)
     return sps.csr_matrix((data, (u, i)), shape=(user_count, item_count))
 
 
+def _power_law_choice(n: int, size: int, exponent: float) -> np.ndarray:
+    """Choose size integers in [0, n) whose ranks follow a power law in random order"""
+    p = 1 / np.arange(1, n + 1) ** exponent
+    ranks = np.random.choice(n, size=size, p=p / p.sum())
+    return np.random.permutation(n)[ranks]
+
+
 class Timer:
     """Measure elapsed time"""
 
@@ -61,7 +61,7 @@ def load_ratings():
 def fit():
     ratings, user_map, item_map = load_ratings()
     print("Fitting the model")
-    model = ElementwiseAlternatingLeastSquares(num_iter=50)
+    model = ElementwiseAlternatingLeastSquares(num_iter=50, tol=1e-4, patience=2)
     model.fit(ratings, show_loss=True)
     print(f"Saving the model to {MODEL_PATH}")
     model.save(MODEL_PATH)
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import eals
+from eals import ElementwiseAlternatingLeastSquares
+from eals.util import create_user_items
+
+
+@pytest.fixture
+def spawnable_eals(monkeypatch):
+    # pytest puts the parent directory of the outer eals package at the head of sys.path,
+    # where "eals" would resolve to the outer package in the spawned workers
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(eals.__file__)))
+
+
+@pytest.fixture
+def fitted_model():
+    # returns a new model for each call, so that a test can compare one with another
+    def fit(user_count=50, random_state=1):
+        user_items = create_user_items(
+            user_count=user_count, item_count=30, data_count=300, random_seed=random_state
+        )
+        model = ElementwiseAlternatingLeastSquares(
+            factors=4, num_iter=2, random_state=random_state
+        )
+        model.fit(user_items)
+        return model
+
+    return fit
+
+
+@pytest.fixture
+def events():
+    # events of online training for fitted_model(), with a new user and a new item
+    return [(0, 1), (50, 3), (2, 30), (0, 1), (7, 5), (3, 3), (51, 31)]
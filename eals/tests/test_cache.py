@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from eals import InferenceModel, ModelCache
+
+
+@pytest.fixture
+def tenants(tmp_path, fitted_model):
+    # tenants of different sizes
+    for k, user_count in enumerate([50, 60, 70]):
+        fitted_model(user_count=user_count, random_state=k).export_inference(tmp_path / str(k))
+    return lambda key: tmp_path / str(key)
+
+
+def test_model_cache_evicts_to_mmap(tenants):
+    # float64 vectors of 4 factors, Wi and SV
+    sizes = [((user_count + 30) * 4 + 30 + 4 * 4) * 8 for user_count in [50, 60, 70]]
+    cache = ModelCache(tenants, max_bytes=sizes[0] + sizes[2])
+    model = cache.get(0)
+    # served memory-mapped until read into memory in the background
+    assert isinstance(model.user_factors, np.memmap) and model.memory_report()["total"] == sizes[0]
+    cache.wait()
+    assert cache.resident == [0] and not isinstance(cache.get(0).user_factors, np.memmap)
+    assert np.array_equal(cache.get(0).user_factors, model.user_factors)
+
+    cache.get(1)
+    cache.wait()
+    cache.get(0)
+    cache.get(2)
+    cache.wait()
+    # the least recently used tenant is evicted and served memory-mapped again
+    assert cache.resident == [0, 2] and cache.resident_bytes == sizes[0] + sizes[2]
+    assert cache.evictions == 1
+    assert isinstance(cache.get(1).user_factors, np.memmap) and cache.get(1).user_count == 60
+    cache.close()
+
+
+def test_model_cache_prefetch(tenants):
+    cache = ModelCache(tenants, background=False)
+    cache.get(0)
+    cache.wait()
+    assert cache.resident == []
+    cache.prefetch([2, 1], wait=True)
+    assert cache.resident == [2, 1]
+    expected = InferenceModel.load(tenants(2)).recommend(0, k=5)
+    assert cache.get(2).recommend(0, k=5).tolist() == expected.tolist()
+
+    # tenants larger than the budget stay memory-mapped
+    cache.max_bytes = 1
+    cache.prefetch([0], wait=True)
+    assert cache.resident == [1, 2]
+    with pytest.raises(FileNotFoundError):
+        cache.prefetch([3], wait=True)
+    cache.close()
+
+
+def test_model_cache_maps_only_tenants_not_resident(tenants):
+    cache = ModelCache(tenants, background=False, max_mapped=2)
+    for key in [0, 1, 2]:
+        cache.get(key)
+    # only the most recently used memory-mapped models are kept
+    assert cache.mapped == [1, 2]
+    cache.prefetch([2], wait=True)
+    assert cache.resident == [2] and cache.mapped == [1]
+
+    # an evicted tenant is memory-mapped again by its next get()
+    cache.max_bytes = 1
+    cache.prefetch([1], wait=True)
+    cache.invalidate(2)
+    assert cache.resident == [] and cache.resident_bytes == 0
+    assert isinstance(cache.get(2).user_factors, np.memmap) and cache.mapped == [1, 2]
+    cache.close()
+
+
+def test_model_cache_invalidate(tenants, fitted_model):
+    cache = ModelCache(tenants)
+    cache.get(0)
+    cache.wait()
+    assert cache.resident == [0]
+    fitted_model(user_count=80, random_state=3).export_inference(tenants(0))
+    # the old model is served until the tenant is invalidated
+    assert cache.get(0).user_count == 50
+    cache.invalidate(0)
+    assert cache.resident == [] and cache.mapped == []
+    assert cache.get(0).user_count == 80
+    cache.wait()
+    assert cache.resident == [0] and cache.get(0).user_count == 80
+    cache.close()
@@ -1,9 +1,13 @@
 from unittest import mock
 
 import numpy as np
+import pytest
 import scipy.sparse as sps
 
-from eals import ElementwiseAlternatingLeastSquares, load_model
+from eals import ElementwiseAlternatingLeastSquares, MmapInteractions, load_model, warmup
+from eals import eals as eals_module
+from eals.eals import _balanced_chunks
+from eals.util import create_user_items
 
 
 def assert_model_equality(model1, model2):
@@ -15,11 +19,12 @@ def assert_model_equality(model1, model2):
     assert model1.init_stdev == model2.init_stdev
     assert model1.num_iter == model2.num_iter
     assert model1.num_iter_online == model2.num_iter_online
+    assert model1.factor_dtype == model2.factor_dtype
     assert model1.random_state == model2.random_state
     assert np.allclose(model1.U, model2.U)
     assert np.allclose(model1.V, model2.V)
-    assert (model1._user_items_lil.data == model2._user_items_lil.data).all()
-    assert (model1._user_items_lil.rows == model2._user_items_lil.rows).all()
+    assert (model1.user_items != model2.user_items).nnz == 0
+    assert (model1._user_items_t.to_csr() != model2._user_items_t.to_csr()).nnz == 0
 
 
 def test_init_data():
@@ -184,9 +189,169 @@ def test_fit_one_iteration(mock_init_V, mock_init_U):
     assert np.allclose(model_actual.V, model_expected.V)
 
 
+def test_fit_callbacks_receive_loss():
+    user_items = create_user_items(user_count=50, item_count=30, data_count=300, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    history = []
+
+    def callback(model, iter, loss):
+        # the loss fused with the item update equals calc_loss()
+        assert np.allclose(loss, model.calc_loss() / user_items.nnz)
+        history.append(iter)
+
+    model.fit(user_items, callbacks=[callback])
+    assert history == [1, 2, 3]
+
+    # training stops when a callback returns True
+    history = []
+    model.fit(user_items, callbacks=[callback, lambda model, iter, loss: iter == 2])
+    assert history == [1, 2]
+
+
+def test_fit_without_ratings():
+    user_items = sps.csr_matrix((5, 4), dtype=np.float32)
+    model = ElementwiseAlternatingLeastSquares(factors=2, num_iter=2, tol=1e-3, random_state=1)
+    losses = []
+    model.fit(
+        user_items, show_loss=True, callbacks=[lambda model, iter, loss: losses.append(loss)]
+    )
+    assert len(losses) == 2 and np.all(np.isfinite(losses))
+    assert np.array_equal(model.Wi, np.zeros(4))
+
+
+def test_fit_early_stopping():
+    user_items = create_user_items(user_count=50, item_count=30, data_count=300, random_seed=1)
+    losses = []
+    model = ElementwiseAlternatingLeastSquares(
+        factors=8, num_iter=100, tol=1e-3, patience=2, random_state=1
+    )
+    model.fit(user_items, callbacks=[lambda model, iter, loss: losses.append(loss)])
+    assert 2 < len(losses) < 100
+    assert losses[-3] - losses[-1] < 2e-3 * losses[-3]
+
+
+def test_fit_warm_start_keeps_known_latent_vectors():
+    user_items = create_user_items(user_count=50, item_count=30, data_count=300, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    model.fit(user_items)
+    U_fitted = model.U.copy()
+    V_fitted = model.V.copy()
+
+    # 10 new users and 5 new items
+    user_items_new = sps.lil_matrix((60, 35), dtype=np.float32)
+    user_items_new[:50, :30] = user_items
+    user_items_new[55, 32] = 1
+    model.num_iter = 0
+    model.fit(user_items_new.tocsr(), warm_start=True)
+    assert model.U.shape == (60, 8)
+    assert model.V.shape == (35, 8)
+    assert np.allclose(model.U[:50], U_fitted)
+    assert np.allclose(model.V[:30], V_fitted)
+    assert np.allclose(model.SU, model.U.T @ model.U)
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
+
+
+def test_fit_warm_start_converges_faster():
+    user_items = create_user_items(user_count=50, item_count=30, data_count=300, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(
+        factors=8, num_iter=100, tol=1e-3, patience=2, random_state=1
+    )
+    history_cold = []
+    model.fit(user_items, callbacks=[lambda model, iter, loss: history_cold.append(iter)])
+    history_warm = []
+    model.fit(
+        user_items,
+        warm_start=True,
+        callbacks=[lambda model, iter, loss: history_warm.append(iter)],
+    )
+    assert len(history_warm) < len(history_cold)
+
+
+def test_fit_resume_from_checkpoint(tmp_path):
+    user_items = create_user_items(user_count=50, item_count=30, data_count=300, random_seed=1)
+    checkpoint_file = tmp_path / "checkpoint.joblib"
+    model_expected = ElementwiseAlternatingLeastSquares(factors=8, num_iter=5, random_state=1)
+    model_expected.fit(user_items)
+
+    def crash(model, iter, loss):
+        if iter == 3:
+            raise KeyboardInterrupt()
+
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=5, random_state=1)
+    try:
+        model.fit(
+            user_items, callbacks=[crash], checkpoint_file=checkpoint_file, checkpoint_interval=2
+        )
+    except KeyboardInterrupt:
+        pass
+    model_actual = load_model(checkpoint_file)
+    assert model_actual._resume_iter == 2
+    history = []
+    model_actual.fit(
+        user_items, warm_start=True, callbacks=[lambda model, iter, loss: history.append(iter)]
+    )
+    assert history == [3, 4, 5]
+    assert model_actual._resume_iter == 0
+    assert np.allclose(model_actual.U, model_expected.U)
+    assert np.allclose(model_actual.V, model_expected.V)
+
+
+def test_balanced_chunks():
+    costs = np.array([100, 1, 1, 50, 50, 1, 1, 1, 1, 1])
+    order, chunk_ptr = _balanced_chunks(costs, 3)
+    assert sorted(order) == list(range(10))
+    chunk_costs = [costs[order[chunk_ptr[c] : chunk_ptr[c + 1]]].sum() for c in range(3)]
+    assert sorted(chunk_costs) == [53, 54, 100]
+
+
+def test_fit_with_static_and_balanced_schedules():
+    user_items = create_user_items(
+        user_count=50, item_count=30, data_count=300, random_seed=1, power_law_exponent=1.0
+    )
+    models = []
+    for schedule in ["static", "balanced"]:
+        model = ElementwiseAlternatingLeastSquares(
+            factors=8, num_iter=3, schedule=schedule, random_state=1
+        )
+        model.fit(user_items)
+        models.append(model)
+    assert np.allclose(models[0].U, models[1].U)
+    assert np.allclose(models[0].V, models[1].V)
+
+
 def test_update_model():
-    # TODO: Implement it.
-    pass
+    # update_model() equals the single updates of U[u], SU, V[i] and SV, repeated
+    user_items = sps.csc_matrix([[1, 0, 0, 2], [1, 1, 0, 0], [0, 0, 1, 2]])
+    model_actual = ElementwiseAlternatingLeastSquares(
+        factors=3, num_iter=1, num_iter_online=2, random_state=1
+    )
+    model_actual.fit(user_items)
+    model_expected = ElementwiseAlternatingLeastSquares(
+        factors=3, num_iter=1, num_iter_online=2, random_state=1
+    )
+    model_expected.fit(user_items)
+    for u, i in [(0, 1), (2, 4)]:
+        model_actual.update_model(u, i)
+
+        model_expected._convert_data_for_online_training()
+        model_expected._expand_data(u, i)
+        old_count = model_expected._user_items_t.row_lengths([i])
+        model_expected._user_items.set(u, i, 1)
+        model_expected._user_items_t.set(i, u, 1)
+        weight_change = model_expected._update_item_weights(
+            np.array([i]), old_count, model_expected._user_items_t.row_lengths([i])
+        )[0]
+        model_expected._SV.update(np.zeros(3), model_expected.V[i], weight_change)
+        for _ in range(2):
+            model_expected._update_SU(u, model_expected._update_user(u))
+            model_expected._update_SV(i, model_expected._update_item(i))
+
+        assert np.allclose(model_actual.U, model_expected.U)
+        assert np.allclose(model_actual.V, model_expected.V)
+        assert np.allclose(model_actual.Wi, model_expected.Wi)
+        assert np.allclose(model_actual.SU, model_expected.SU)
+        assert np.allclose(model_actual.SV, model_expected.SV)
+        assert np.isclose(model_actual._SV.drift, model_expected._SV.drift)
 
 
 def test_update_model_for_existing_user_and_item():
@@ -203,7 +368,7 @@ def test_update_model_for_new_user():
     model = ElementwiseAlternatingLeastSquares(num_iter=1)
     model.fit(user_items)
     model.update_model(3, 3)
-    assert model.user_factors.shape[0] == 103
+    assert model.user_factors.shape[0] == 4
     assert model.item_factors.shape[0] == 4
 
 
@@ -213,7 +378,7 @@ def test_update_model_for_new_item():
     model.fit(user_items)
     model.update_model(2, 4)
     assert model.user_factors.shape[0] == 3
-    assert model.item_factors.shape[0] == 104
+    assert model.item_factors.shape[0] == 5
 
 
 def test_update_model_for_new_user_and_item():
@@ -221,8 +386,101 @@ def test_update_model_for_new_user_and_item():
     model = ElementwiseAlternatingLeastSquares(num_iter=1)
     model.fit(user_items)
     model.update_model(3, 4)
-    assert model.user_factors.shape[0] == 103
-    assert model.item_factors.shape[0] == 104
+    assert model.user_factors.shape[0] == 4
+    assert model.item_factors.shape[0] == 5
+
+
+def test_update_model_sets_existing_and_repeated_pairs():
+    user_items = sps.csc_matrix([[1, 0, 0, 2], [1, 1, 0, 0], [0, 0, 1, 2]])
+    model = ElementwiseAlternatingLeastSquares(num_iter=1)
+    model.fit(user_items)
+    # a rating of the base, and a new pair twice, which fills the slots of the rows
+    events = [(0, 3), (1, 3)] + [(1, 3)] + [(1, i) for i in range(4, 12)]
+    for u, i in events:
+        model.update_model(u, i)
+    expected = sps.lil_matrix((3, 12))
+    expected[:, :4] = user_items.toarray()
+    for u, i in events:
+        expected[u, i] = 1
+    assert (model.user_items != expected).nnz == 0
+    assert model._user_items.nnz == model._user_items_t.nnz == expected.nnz == 15
+    assert (model._user_items_t.to_csr() != expected.T).nnz == 0
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
+
+
+def test_update_model_batch_with_single_pair():
+    # update_model_batch() for a single pair is equivalent to update_model()
+    user_items = sps.csc_matrix([[1, 0, 0, 2], [1, 1, 0, 0], [0, 0, 1, 2]])
+    model_actual = ElementwiseAlternatingLeastSquares(num_iter=1, random_state=1)
+    model_actual.fit(user_items)
+    model_actual.update_model_batch(np.array([2]), np.array([1]))
+    model_expected = ElementwiseAlternatingLeastSquares(num_iter=1, random_state=1)
+    model_expected.fit(user_items)
+    model_expected.update_model(2, 1)
+    assert np.allclose(model_actual.U, model_expected.U)
+    assert np.allclose(model_actual.V, model_expected.V)
+    assert np.allclose(model_actual.SU, model_expected.SU)
+    assert np.allclose(model_actual.SV, model_expected.SV)
+
+
+def test_update_model_batch_for_new_users_and_items():
+    user_items = sps.csc_matrix([[1, 0, 0, 2], [1, 1, 0, 0], [0, 0, 1, 2]])
+    model = ElementwiseAlternatingLeastSquares(num_iter=1)
+    model.fit(user_items)
+    users = np.array([0, 3, 3, 5])
+    items = np.array([4, 1, 4, 2])
+    model.update_model_batch(users, items)
+    assert model.user_factors.shape[0] == 6
+    assert model.item_factors.shape[0] == 5
+    for u, i in zip(users, items):
+        assert model.user_items[u, i] == 1
+    assert np.allclose(model.SU, model.U.T @ model.U)
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
+
+
+def test_update_model_for_new_users_grows_capacity_geometrically():
+    user_items = sps.csc_matrix([[1, 0, 0, 2], [1, 1, 0, 0], [0, 0, 1, 2]])
+    model = ElementwiseAlternatingLeastSquares(num_iter=1, factors=4)
+    model.fit(user_items)
+    reallocations = 0
+    for u in range(3, 1000):
+        buffer = model._U
+        model.update_model(u, u % 4)
+        reallocations += model._U is not buffer
+        assert model.user_factors.shape[0] == u + 1
+    assert reallocations <= 10
+    assert model.user_items.shape == (1000, 4)
+    assert np.allclose(model.SU, model.U.T @ model.U)
+
+
+def test_float32_factors():
+    user_items = create_user_items(user_count=200, item_count=100, data_count=2000, random_seed=1)
+    model32 = ElementwiseAlternatingLeastSquares(
+        factors=16, num_iter=10, factor_dtype=np.float32, random_state=1
+    )
+    model32.fit(user_items)
+    model64 = ElementwiseAlternatingLeastSquares(
+        factors=16, num_iter=10, factor_dtype=np.float64, random_state=1
+    )
+    model64.fit(user_items)
+    for name in ["U", "V", "Wi"]:
+        assert getattr(model32, name).dtype == np.float32
+    # the Gram matrices are accumulated in float64
+    for name in ["SU", "SV"]:
+        assert getattr(model32, name).dtype == np.float64
+    # the loss of float32 training stays close to that of float64 training
+    loss32 = model32.calc_loss()
+    loss64 = model64.calc_loss()
+    assert abs(loss32 - loss64) / loss64 < 1e-4
+
+    # online training for new users and items keeps the dtype
+    model32.update_model(200, 100)
+    model32.update_model_batch(np.array([201, 0]), np.array([101, 102]))
+    for name in ["U", "V", "Wi"]:
+        assert getattr(model32, name).dtype == np.float32
+    for name in ["SU", "SV"]:
+        assert getattr(model32, name).dtype == np.float64
+    assert (model32.item_factors @ model32.user_factors[0]).dtype == np.float32
 
 
 @mock.patch.object(ElementwiseAlternatingLeastSquares, "_init_U")
@@ -252,7 +510,7 @@ def test_calc_loss_csr(mock_init_V, mock_init_U):
 
 @mock.patch.object(ElementwiseAlternatingLeastSquares, "_init_U")
 @mock.patch.object(ElementwiseAlternatingLeastSquares, "_init_V")
-def test_calc_loss_lil(mock_init_V, mock_init_U):
+def test_calc_loss_store(mock_init_V, mock_init_U):
     # 2 users, 1 item
     user_items = sps.csc_matrix([[1.0], [0.0]])
     U0 = np.array([[0.9], [0.5]])
@@ -276,6 +534,118 @@ def test_calc_loss_lil(mock_init_V, mock_init_U):
     assert np.allclose(model.calc_loss(), loss_expected)
 
 
+def test_calc_loss_store_matches_calc_loss_csr():
+    user_items = create_user_items(user_count=50, item_count=30, data_count=300, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=2, random_state=1)
+    model.fit(user_items)
+    # move some rows to the append pool and add new users and items
+    model.update_model(0, 1)
+    model.update_model(10, 29)
+    model.update_model_batch(np.array([49, 52, 3]), np.array([31, 2, 5]))
+    assert not model._user_items.is_compact()
+    loss_online = model.calc_loss()
+    model._convert_data_for_batch_training()
+    loss_batch = model.calc_loss()
+    assert np.allclose(loss_online, loss_batch)
+
+
+def test_refit_dirty():
+    user_items = create_user_items(user_count=200, item_count=50, data_count=2000, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=5, random_state=1)
+    model.fit(user_items)
+    model.update_model(0, 1)
+    model.update_model_batch(np.array([200, 3, 3]), np.array([50, 1, 7]))
+    assert model._dirty_users == {0, 3, 200}
+    assert model._dirty_items == {1, 7, 50}
+
+    loss = model.calc_loss()
+    U = model.U.copy()
+    model.refit_dirty(n_sweeps=2)
+    assert model.calc_loss() < loss
+    assert not model._dirty_users and not model._dirty_items
+    # only the dirty users and their neighbors are updated
+    updated = np.flatnonzero((model.U != U).any(axis=1))
+    users_of_items = model.user_items[:, [1, 7, 50]].nonzero()[0]
+    assert set(updated) <= {0, 3, 200} | set(users_of_items)
+    # SU and SV are kept up to date
+    assert np.allclose(model.SU, model.U.T @ model.U)
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
+
+    # nothing to do
+    model.refit_dirty()
+    assert np.allclose(model.SU, model.U.T @ model.U)
+
+
+def test_fold_in_users():
+    user_items = create_user_items(user_count=100, item_count=30, data_count=500, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=4, num_iter=2, random_state=1)
+    model.fit(user_items)
+    U, V, SU, SV = model.U.copy(), model.V.copy(), model.SU.copy(), model.SV.copy()
+
+    # unknown items and duplicates are ignored
+    vecs = model.fold_in_users([[1, 5, 5, 30], [], [2]])
+    assert vecs.shape == (3, 4)
+    assert (vecs[1] == 0).all()
+    # the model is not modified
+    assert model.user_count == 100
+    assert np.array_equal(model.U, U) and np.array_equal(model.V, V)
+    assert np.array_equal(model.SU, SU) and np.array_equal(model.SV, SV)
+
+    # the same vector as update_model() gives to a new user
+    model.update_model(100, 2)
+    assert np.allclose(model.U[100], vecs[2])
+
+
+def test_fit_out_of_core(tmp_path):
+    user_items = create_user_items(user_count=200, item_count=50, data_count=2000, random_seed=1)
+    model_in_memory = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    model_in_memory.fit(user_items)
+
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    # sweep in blocks of a few rows
+    with mock.patch.object(ElementwiseAlternatingLeastSquares, "_BLOCK_NNZ", 50):
+        model.fit(MmapInteractions.save(tmp_path / "user_items", user_items))
+    assert np.allclose(model.U, model_in_memory.U)
+    assert np.allclose(model.V, model_in_memory.V)
+    assert np.isclose(model.calc_loss(), model_in_memory.calc_loss())
+
+    # the rating matrix is saved as a reference to the files
+    model.update_model(0, 1)
+    model.save(tmp_path / "model.joblib", compress=False)
+    model_in_memory.update_model(0, 1)
+    model_in_memory.save(tmp_path / "model_in_memory.joblib", compress=False)
+    size = (tmp_path / "model.joblib").stat().st_size
+    size_in_memory = (tmp_path / "model_in_memory.joblib").stat().st_size
+    assert size < size_in_memory - user_items.data.nbytes
+    assert_model_equality(model, load_model(tmp_path / "model.joblib"))
+
+
+def test_fit_out_of_core_rejects_other_dtype(tmp_path):
+    user_items = create_user_items(user_count=20, item_count=10, data_count=50, random_seed=1)
+    interactions = MmapInteractions.save(tmp_path, user_items, dtype=np.float64)
+    model = ElementwiseAlternatingLeastSquares(dtype=np.float32)
+    with pytest.raises(ValueError):
+        model.fit(interactions)
+
+
+def test_warmup_compiles_the_kernels_used_by_a_model():
+    warmup()
+    # kernels are plain Python functions with USE_NUMBA=0
+    kernels = [k for k in vars(eals_module).values() if hasattr(k, "signatures")]
+    n_signatures = [len(k.signatures) for k in kernels]
+
+    user_items = create_user_items(user_count=200, item_count=50, data_count=1000, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=2, regularization=0)
+    model.fit(user_items)
+    model.calc_loss()
+    model.update_model(200, 10)
+    model.update_model_batch(np.array([0, 201]), np.array([50, 3]))
+    model.calc_loss()
+    model.fold_in_users([[1, 2, 3]])
+    # no kernel has been compiled again for other argument types
+    assert [len(k.signatures) for k in kernels] == n_signatures
+
+
 def test_save_and_load_model(tmp_path):
     # setup: 3 users x 2 items
     user_items = sps.csr_matrix([[1.0, 0.0], [1.0, 1.0], [0.0, 0.0]])
@@ -302,3 +672,102 @@ def test_save_and_load_model(tmp_path):
     model.save(file_joblib, compress=True)
     model_actual = load_model(file_joblib)
     assert_model_equality(model, model_actual)
+
+
+def test_load_model_with_lil_matrices():
+    # models saved by older versions hold the rating matrix as lil matrices in online mode
+    user_items = sps.csr_matrix([[1.0, 0.0], [1.0, 1.0], [0.0, 0.0]], dtype=np.float32)
+    model = ElementwiseAlternatingLeastSquares(num_iter=1)
+    model.fit(user_items)
+    state = model.__dict__.copy()
+    del state["_user_items"], state["_item_store"]
+    state["_user_items_lil"] = user_items.tolil()
+    state["_user_items_lil_t"] = user_items.T.tolil()
+    model_legacy = ElementwiseAlternatingLeastSquares.__new__(ElementwiseAlternatingLeastSquares)
+    model_legacy.__setstate__(state)
+    assert (model_legacy.user_items != user_items).nnz == 0
+    model_legacy.update_model(2, 1)
+    assert model_legacy.user_items[2, 1] == 1
+
+
+def test_saved_model_is_compact(tmp_path):
+    user_items = create_user_items(user_count=200, item_count=50, data_count=2000, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=2, random_state=1)
+    model.fit(user_items)
+    # grow the capacity of U and V
+    model.update_model(200, 50)
+    report = model.memory_report()
+    assert report["U"] == model._U.nbytes > model.U.nbytes
+    assert report["item_users"] > 0
+    assert report["total"] == sum(size for key, size in report.items() if key != "total")
+
+    model.save(tmp_path / "model.joblib", compress=False)
+    size = (tmp_path / "model.joblib").stat().st_size
+    assert size < report["total"] - report["item_users"]
+    loaded = load_model(tmp_path / "model.joblib")
+    assert loaded.memory_report()["U"] == model.U.nbytes
+    assert loaded.memory_report()["item_users"] == 0
+
+    # the item-major store is rebuilt by the first update
+    loaded.update_model(3, 4)
+    model.update_model(3, 4)
+    assert loaded.memory_report()["item_users"] > 0
+    assert np.allclose(loaded.U, model.U) and np.allclose(loaded.V, model.V)
+    assert (loaded._user_items_t.to_csr() != model._user_items_t.to_csr()).nnz == 0
+
+
+def test_drifted_grams_are_recomputed():
+    user_items = create_user_items(user_count=50, item_count=20, data_count=300, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=4, num_iter=2, random_state=1)
+    model.fit(user_items)
+    model.update_model(0, 1)
+    assert model._SU.recomputations == 0 and model._SU.drift > 0
+    assert np.allclose(model.SU, model.U.T @ model.U)
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
+
+    # any rounding error exceeds tol=0, which update_model() checks every
+    # _GRAM_CHECK_INTERVAL events
+    model._SU.tol = model._SV.tol = 0
+    model._SU._unchecked = model._SV._unchecked = 0
+    for _ in range(model._GRAM_CHECK_INTERVAL - 1):
+        model.update_model(2, 3)
+    assert model._SU.recomputations == 0
+    model.update_model(2, 3)
+    assert model._SU.recomputations == 1 and model._SV.recomputations == 1
+    assert model._SU.drift == 0
+    assert np.array_equal(model.SU, model.U.T @ model.U)
+
+
+def test_online_item_weights_follow_popularity():
+    user_items = create_user_items(user_count=300, item_count=40, data_count=2000, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=4, num_iter=2, random_state=1)
+    model.fit(user_items)
+    norm = model._popularity_norm
+    rng = np.random.default_rng(1)
+    # popular items get more popular, and new items appear
+    for u, i in zip(rng.integers(0, 320, 1500), rng.zipf(1.5, 1500) % 45):
+        model.update_model(int(u), int(i))
+    model.update_model_batch(rng.integers(0, 320, 300), rng.integers(0, 50, 300))
+    # the weights have been rescaled
+    assert model._popularity_norm > norm
+
+    # the weights are those of a batch model on the current ratings up to the lazy rescaling
+    counts = model.user_items.getnnz(axis=0)
+    expected = model.w0 * counts ** model.alpha / np.sum(counts ** model.alpha)
+    assert np.allclose(model.Wi, expected, rtol=model._WEIGHT_RESCALE_TOL, atol=0)
+    refit = ElementwiseAlternatingLeastSquares(factors=4, num_iter=1)
+    refit._init_data(model.user_items)
+    assert np.allclose(refit.Wi, expected)
+    # SV is kept consistent with the weights
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
+
+
+def test_online_item_weights_without_popularity():
+    # alpha=0 weights all items equally, including the items without ratings
+    user_items = create_user_items(user_count=100, item_count=20, data_count=500, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=4, num_iter=1, alpha=0, w0=160)
+    model.fit(user_items)
+    model.update_model(0, 29)
+    model.update_model_batch(np.array([1, 2]), np.array([35, 36]))
+    assert np.allclose(model.Wi, 160 / 37)
+    assert np.allclose(model.SV, (model.V.T * model.Wi) @ model.V)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from eals.gram import GramMatrix
+
+
+def test_update_matches_recomputation():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(50, 6)).astype(np.float32)
+    w = rng.uniform(size=50)
+    gram = GramMatrix.compute(X, w)
+    assert np.allclose(gram.matrix, (X.T.astype(np.float64) * w) @ X)
+
+    for row in rng.integers(0, 50, 200):
+        old, X[row] = X[row].copy(), rng.normal(size=6)
+        gram.update(old, X[row], w[row])
+    expected = (X.T.astype(np.float64) * w) @ X
+    assert np.allclose(gram.matrix, expected)
+    # the lower triangle is mirrored
+    assert np.array_equal(gram.matrix, gram.matrix.T)
+    # drift bounds the accumulated error
+    assert 0 < np.abs(gram.matrix - expected).max() <= gram.drift
+    assert not gram.needs_recompute()
+
+    gram.recompute(X, w)
+    assert gram.drift == 0 and gram.recomputations == 1
+    assert np.allclose(gram.matrix, expected)
+
+
+def test_update_rows():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(30, 4))
+    gram = GramMatrix.compute(X)
+    rows = np.array([3, 7, 8])
+    old, X[rows] = X[rows].copy(), rng.normal(size=(3, 4))
+    gram.update_rows(old, X[rows])
+    assert np.allclose(gram.matrix, X.T @ X)
+    assert 0 < gram.drift
+    gram.tol = 0
+    assert gram.needs_recompute()
+
+
+def test_accumulation_stays_accurate_for_float32_vectors():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(100, 8)).astype(np.float32)
+    gram = GramMatrix.compute(X)
+    naive = X.T @ X
+    for row in rng.integers(0, 100, 20000):
+        old, X[row] = X[row].copy(), rng.normal(size=8)
+        gram.update(old, X[row])
+        naive -= np.outer(old, old) - np.outer(X[row], X[row])
+    expected = X.T.astype(np.float64) @ X
+    error = np.abs(gram.matrix - expected).max()
+    assert error <= gram.drift
+    assert error < 1e-3 * np.abs(naive - expected).max()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from eals import InferenceModel, load_model
+
+
+@pytest.fixture
+def model(fitted_model):
+    return fitted_model()
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_export_inference(tmp_path, model, mmap):
+    model.export_inference(tmp_path / "inference")
+    inference = InferenceModel.load(tmp_path / "inference", mmap=mmap)
+    assert inference.user_count == 50 and inference.item_count == 30
+    assert np.array_equal(inference.user_factors, model.user_factors)
+    assert np.array_equal(inference.item_factors, model.item_factors)
+    assert isinstance(inference.item_factors, np.memmap) == mmap
+
+    for u in [0, 7]:
+        scores = model.item_factors @ model.user_factors[u]
+        assert inference.recommend(u, k=5).tolist() == np.argsort(scores)[::-1][:5].tolist()
+    assert len(inference.recommend(0, k=100)) == 30
+    item_lists = [[0, 3, 5], [], [29, 100]]
+    assert np.allclose(inference.fold_in_users(item_lists), model.fold_in_users(item_lists))
+
+
+def test_export_inference_is_not_a_model(tmp_path, model):
+    model.export_inference(tmp_path / "inference")
+    with pytest.raises(ValueError):
+        load_model(tmp_path / "inference")
+    model.save(tmp_path / "model", format="directory")
+    with pytest.raises(ValueError):
+        InferenceModel.load(tmp_path / "model")
+
+
+def test_set_factors_adds_users_and_items(tmp_path, model):
+    model.export_inference(tmp_path / "inference")
+    inference = InferenceModel.load(tmp_path / "inference")
+    inference.set_factors(np.array([50]), np.ones((1, 4)), np.array([31]), np.ones((1, 4)))
+    assert inference.user_count == 51 and inference.item_count == 32
+    assert inference.user_factors.shape == (51, 4) and inference.Wi.tolist()[30:] == [0, 0]
+    assert inference.item_factors[30].tolist() == [0] * 4
+    assert inference.recommend(50, k=1).tolist() == [31]
+    # the capacity doubles, so that adding users one by one does not copy every time
+    capacity = inference.memory_report()["user_factors"]
+    no_items = np.zeros(0, dtype=np.int64)
+    for u in range(51, 90):
+        inference.set_factors(np.array([u]), np.ones((1, 4)), no_items, np.ones((0, 4)))
+    assert inference.memory_report()["user_factors"] == capacity == 100 * 4 * 8
+
+
+def test_with_factors_leaves_model_unchanged(tmp_path, model):
+    model.export_inference(tmp_path / "inference")
+    inference = InferenceModel.load(tmp_path / "inference")
+    no_users = np.zeros(0, dtype=np.int64)
+    updated = inference.with_factors(no_users, np.ones((0, 4)), np.array([30]), np.ones((1, 4)))
+    assert updated.item_count == 31 and inference.item_count == 30
+    assert np.allclose(inference.item_factors, model.V)
+    # the arrays which do not change are shared
+    assert updated._user_factors is inference._user_factors and updated.SV is inference.SV
+    assert updated.item_factors[30].tolist() == [1] * 4 and updated.Wi[30] == 0
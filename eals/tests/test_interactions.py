@@ -0,0 +1,108 @@
+import pickle
+
+import numpy as np
+import scipy.sparse as sps
+
+from eals import MmapInteractions
+from eals.interactions import InteractionStore
+
+
+def test_row_is_zero_copy_view_of_base():
+    matrix = sps.csr_matrix([[1.0, 0.0, 2.0], [0.0, 3.0, 0.0]])
+    store = InteractionStore.from_csr(matrix)
+    indices, data = store.row(0)
+    assert np.shares_memory(data, matrix.data)
+    assert indices.tolist() == [0, 2]
+    assert data.tolist() == [1.0, 2.0]
+
+
+def test_set_does_not_modify_base():
+    matrix = sps.csr_matrix([[1.0, 0.0, 2.0], [0.0, 3.0, 0.0]])
+    store = InteractionStore.from_csr(matrix)
+    store.set(0, 1, 5.0)
+    store.set(0, 2, 6.0)
+    assert matrix.toarray().tolist() == [[1.0, 0.0, 2.0], [0.0, 3.0, 0.0]]
+    assert store.to_csr().toarray().tolist() == [[1.0, 5.0, 6.0], [0.0, 3.0, 0.0]]
+    assert store.nnz == 4
+
+
+def test_resize_and_set_many():
+    store = InteractionStore.from_csr(sps.csr_matrix([[1.0, 0.0], [0.0, 1.0]]))
+    store.resize(4, 3)
+    store.set_many(np.array([3, 0, 3, 3]), np.array([2, 1, 0, 2]), 1.0)
+    expected = [[1.0, 1.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 0.0], [1.0, 0.0, 1.0]]
+    assert store.to_csr().toarray().tolist() == expected
+    assert store.row_lengths().tolist() == [2, 1, 0, 2]
+
+
+def test_compact_matches_random_appends():
+    rng = np.random.default_rng(0)
+    dense = (rng.random((30, 20)) < 0.2).astype(np.float32)
+    store = InteractionStore.from_csr(sps.csr_matrix(dense))
+    for _ in range(500):
+        r, c = rng.integers(30), rng.integers(20)
+        dense[r, c] = 1.0
+        store.set(r, c, 1.0)
+    assert np.array_equal(store.to_csr().toarray(), dense)
+    store.compact()
+    assert store.is_compact()
+    assert np.array_equal(store.to_csr().toarray(), dense)
+    assert store.nnz == np.count_nonzero(dense)
+
+
+def test_rows_csr():
+    store = InteractionStore.from_csr(sps.csr_matrix([[1.0, 0.0], [0.0, 2.0], [3.0, 4.0]]))
+    indptr, indices, data = store.rows_csr(np.array([2, 0]))
+    assert indptr.tolist() == [0, 2, 3]
+    assert indices.tolist() == [0, 1, 0]
+    assert data.tolist() == [3.0, 4.0, 1.0]
+
+
+def test_mmap_interactions_build_matches_save(tmp_path):
+    matrix = sps.random(30, 20, density=0.2, format="csr", dtype=np.float32, random_state=1)
+    saved = MmapInteractions.save(tmp_path / "saved", matrix)
+    coo = matrix.tocoo()
+    # three chunks in random order
+    order = np.random.default_rng(1).permutation(coo.nnz)
+
+    def read_chunks():
+        for chunk in np.array_split(order, 3):
+            yield coo.row[chunk], coo.col[chunk], coo.data[chunk]
+
+    built = MmapInteractions.build(tmp_path / "built", read_chunks, matrix.shape)
+    for interactions in [saved, built]:
+        assert interactions.shape == (30, 20)
+        assert interactions.nnz == matrix.nnz
+        assert (interactions.user_store().to_csr() != matrix).nnz == 0
+        assert (interactions.item_store().to_csr() != matrix.T).nnz == 0
+
+
+def test_store_is_pickled_compact():
+    matrix = sps.random(100, 20, density=0.2, format="csr", dtype=np.float32, random_state=1)
+    store = InteractionStore.from_csr(matrix)
+    store.resize(101, 20)
+    store.set(100, 3, 1.0)
+    store.set(0, 19, 2.0)
+    loaded = pickle.loads(pickle.dumps(store))
+    assert loaded.is_compact()
+    assert loaded.nnz == store.nnz == matrix.nnz + 2
+    assert (loaded.to_csr() != store.to_csr()).nnz == 0
+    # the pool is rebuilt for appends
+    loaded.set(100, 4, 1.0)
+    assert loaded.row(100)[0].tolist() == [3, 4]
+
+
+def test_mmap_store_is_pickled_as_reference(tmp_path):
+    matrix = sps.random(1000, 100, density=0.1, format="csr", dtype=np.float32, random_state=1)
+    store = MmapInteractions.save(tmp_path, matrix).user_store()
+    store.set(0, 1, 5.0)
+    dumped = pickle.dumps(store)
+    assert len(dumped) < matrix.data.nbytes
+    loaded = pickle.loads(dumped)
+    assert (loaded.to_csr() != store.to_csr()).nnz == 0
+    # the rows in the pool accept appends
+    loaded.set(0, 2, 5.0)
+    assert loaded.to_csr()[0, 2] == 5.0 and loaded.nnz == store.nnz + (matrix[0, 2] == 0)
+    # compaction replaces the files by arrays in memory
+    loaded.compact()
+    assert len(pickle.dumps(loaded)) > matrix.data.nbytes
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from eals import JournaledModel
+from eals.journal import UpdateJournal, load_inference, snapshot_time
+
+
+def assert_same_model(model1, model2):
+    assert np.allclose(model1.U, model2.U)
+    assert np.allclose(model1.V, model2.V)
+    assert np.allclose(model1.SV, model2.SV)
+    assert (model1.user_items != model2.user_items).nnz == 0
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_journaled_model_replays_updates(tmp_path, mmap, fitted_model, events):
+    expected = fitted_model()
+    journaled = JournaledModel.create(tmp_path, fitted_model(), compact_every=0, mmap=mmap)
+    for u, i in events:
+        journaled.update(u, i)
+        expected.update_model(u, i)
+    assert_same_model(journaled.model, expected)
+    assert len(UpdateJournal(tmp_path / "journal-0", 4)) == len(events)
+
+    reopened = JournaledModel(tmp_path, mmap=mmap)
+    assert_same_model(reopened.model, expected)
+    inference = load_inference(tmp_path)
+    assert np.allclose(inference.user_factors, expected.U)
+    assert np.allclose(inference.item_factors, expected.V)
+
+
+def test_journaled_model_compacts(tmp_path, fitted_model, events):
+    expected = fitted_model()
+    journaled = JournaledModel.create(tmp_path, fitted_model(), compact_every=3)
+    for u, i in events:
+        journaled.update(u, i)
+        # a compaction is not started while the previous one is running
+        journaled.close()
+        expected.update_model(u, i)
+    assert journaled.generation == 2
+    assert sorted(p.name for p in tmp_path.glob("snapshot-*")) == ["snapshot-2"]
+    assert sorted(p.name for p in tmp_path.glob("journal-*")) == ["journal-2"]
+    assert_same_model(JournaledModel(tmp_path).model, expected)
+
+    # a new model starts a new generation
+    JournaledModel.create(tmp_path, fitted_model())
+    assert (tmp_path / "CURRENT").read_text() == "3"
+    assert_same_model(JournaledModel(tmp_path).model, fitted_model())
+
+
+def test_journaled_models_share_directory(tmp_path, fitted_model, events):
+    # like two worker processes of a web server
+    expected = fitted_model()
+    worker1 = JournaledModel.create(tmp_path, fitted_model(), compact_every=0)
+    worker2 = JournaledModel(tmp_path, compact_every=0)
+    for k, (u, i) in enumerate(events):
+        (worker1 if k % 2 else worker2).update(u, i)
+        expected.update_model(u, i)
+    assert worker1.refresh() == 1
+    assert_same_model(worker1.model, expected)
+
+    # a compaction removes the journal worker2 was reading, so that it loads the snapshot
+    worker1.compact()
+    worker1.update(4, 4)
+    expected.update_model(4, 4)
+    worker1.compact()
+    assert worker2.refresh() == -1
+    assert_same_model(worker2.model, expected)
+
+
+def test_journal_ignores_torn_record(tmp_path):
+    journal = UpdateJournal(tmp_path / "journal", factors=2)
+    journal.append(1, 2, np.array([1.0, 2.0]), np.array([3.0, 4.0]))
+    with open(journal.file, "ab") as f:
+        f.write(b"\0" * 5)
+    assert len(journal) == 1
+    assert journal.read()["item_vector"].tolist() == [[3.0, 4.0]]
+    journal.repair()
+    journal.append(5, 6, np.zeros(2), np.zeros(2))
+    assert journal.read()["user"].tolist() == [1, 5]
+
+
+def test_compaction_concurrent_with_create(tmp_path, fitted_model):
+    journaled = JournaledModel.create(tmp_path, fitted_model(), compact_every=0)
+    journaled.update(0, 1)
+    # a compaction starts generation 1, and create() starts generation 2 while the snapshot
+    # of the compaction is being written
+    header, arrays = journaled.model._directory_state()
+    (tmp_path / "journal-1").touch()
+    JournaledModel.create(tmp_path, fitted_model())
+    journaled._write_snapshot(1, header, arrays)
+    assert sorted(p.name for p in tmp_path.glob("snapshot-*")) == ["snapshot-2"]
+    assert sorted(p.name for p in tmp_path.glob("journal-*")) == []
+    assert_same_model(JournaledModel(tmp_path).model, fitted_model())
+
+
+def test_journaled_model_removes_old_generations(tmp_path, fitted_model):
+    JournaledModel.create(tmp_path, fitted_model())
+    JournaledModel.create(tmp_path, fitted_model())
+    # left by a process which has crashed after switching the generation
+    (tmp_path / "journal-0").touch()
+    (tmp_path / "snapshot-0").mkdir()
+    JournaledModel(tmp_path)
+    assert sorted(p.name for p in tmp_path.glob("*-*")) == ["snapshot-1"]
+
+
+def test_create_if_older_than(tmp_path, fitted_model, events):
+    journaled = JournaledModel.create(tmp_path, fitted_model(), if_older_than=float("-inf"))
+    for u, i in events:
+        journaled.update(u, i)
+    # e.g. another worker starting from the same model file
+    created = snapshot_time(tmp_path)
+    assert JournaledModel.create(tmp_path, fitted_model(), if_older_than=created).generation == 0
+    assert len(UpdateJournal(tmp_path / "journal-0", 4)) == len(events)
+    # a model saved after the snapshot starts a new generation
+    reopened = JournaledModel.create(tmp_path, fitted_model(5), if_older_than=created + 1)
+    assert reopened.generation == 1 and reopened.model.user_count == 5
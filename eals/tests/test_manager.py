@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+
+from eals import JournaledModel, ModelManager
+from eals.journal import UpdateJournal
+
+
+def test_model_manager_reads_its_updates(tmp_path, fitted_model, events):
+    JournaledModel.create(tmp_path, fitted_model(), compact_every=0)
+    manager = ModelManager(tmp_path, check_interval=3600, compact_every=0)
+    model = manager.get()
+    assert manager.get() is model and manager.reloads == 1
+
+    expected = fitted_model()
+    for u, i in events:
+        manager.update(u, i)
+        expected.update_model(u, i)
+    # only the records of the updates are read, into a new model
+    updated = manager.get()
+    assert updated is not model and manager.reloads == 1
+    assert np.allclose(updated.user_factors, expected.U)
+    assert np.allclose(updated.item_factors, expected.V)
+    assert updated.SV is model.SV
+    # the vectors being served are not modified
+    assert model.user_count == 50 and np.allclose(model.user_factors, fitted_model().U)
+    assert manager.get() is updated
+    manager.close()
+
+
+def test_model_manager_loads_new_snapshots(tmp_path, fitted_model, events):
+    JournaledModel.create(tmp_path, fitted_model(), compact_every=0)
+    manager = ModelManager(tmp_path, check_interval=3600, compact_every=3)
+    model = manager.get()
+
+    expected = fitted_model()
+    for u, i in events:
+        manager.update(u, i)
+        expected.update_model(u, i)
+        # a compaction is not started while the previous one is running
+        manager.close()
+        updated = manager.get()
+        assert np.allclose(updated.user_factors, expected.U)
+        assert np.allclose(updated.item_factors, expected.V)
+    # each of the 2 compactions has written a snapshot, which replaces the model
+    assert manager.reloads == 3
+    assert updated is not model
+
+
+def test_model_manager_detects_other_writers(tmp_path, fitted_model):
+    JournaledModel.create(tmp_path, fitted_model(), compact_every=0)
+    manager = ModelManager(tmp_path, check_interval=3600)
+    eager = ModelManager(tmp_path, check_interval=0)
+    model, eager_model = manager.get(), eager.get()
+
+    # another worker process
+    JournaledModel(tmp_path, compact_every=0).update(50, 3)
+    assert manager.get() is model
+    assert eager.get() is not eager_model and eager.get().user_count == 51
+    assert manager.reload().user_count == 51
+
+    # a new model starts a new generation
+    JournaledModel.create(tmp_path, fitted_model())
+    assert eager.get() is not eager_model and eager.get().user_count == 50
+
+
+def test_model_manager_is_thread_safe(tmp_path, fitted_model):
+    JournaledModel.create(tmp_path, fitted_model(), compact_every=0)
+    manager = ModelManager(tmp_path, check_interval=0, compact_every=0)
+    errors = []
+
+    def write(events):
+        try:
+            for u, i in events:
+                manager.update(u, i)
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    def read():
+        try:
+            for _ in range(20):
+                assert len(manager.get().recommend(0, k=5)) == 5
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    events = [(45 + u % 15, u % 35) for u in range(40)]
+    threads = [threading.Thread(target=write, args=(events[k::2],)) for k in range(2)]
+    threads += [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(UpdateJournal(tmp_path / "journal-0", 4)) == len(events)
+    assert manager.get().user_count == 60
@@ -0,0 +1,72 @@
+import csv
+
+import numpy as np
+import scipy.sparse as sps
+
+from eals import ElementwiseAlternatingLeastSquares, HyperparameterSearch
+from eals.search import (
+    RESULT_COLUMNS,
+    grid_configs,
+    hit_ratio_and_ndcg,
+    load_search_data,
+    prepare_search_data,
+    random_configs,
+)
+from eals.util import create_user_items
+
+
+def test_prepare_search_data(tmp_path):
+    user_items = sps.csr_matrix([[1.0, 1.0, 0.0, 1.0], [0.0, 1.0, 0.0, 0.0], [1.0, 0.0, 1.0, 0.0]])
+    prepare_search_data(tmp_path, user_items, random_state=1)
+    train, test_users, test_items = load_search_data(tmp_path)
+    # users with a single rating keep it for training
+    assert test_users.tolist() == [0, 2]
+    train_matrix = train.user_store().to_csr()
+    assert train_matrix.nnz == user_items.nnz - 2
+    for u, i in zip(test_users, test_items):
+        assert user_items[u, i] == 1 and train_matrix[u, i] == 0
+    held_out = sps.csr_matrix((np.ones(2), (test_users, test_items)), shape=user_items.shape)
+    assert (train_matrix + held_out != user_items).nnz == 0
+
+
+def test_hit_ratio_and_ndcg():
+    model = ElementwiseAlternatingLeastSquares(factors=1)
+    model.user_count, model.item_count = 1, 4
+    model.U = np.array([[1.0]])
+    model.V = np.array([[4.0], [3.0], [2.0], [1.0]])
+    # the training item 0 is excluded, so that the test item 2 ranks second
+    user_items = sps.csr_matrix([[1.0, 0.0, 0.0, 0.0]])
+    hr, ndcg = hit_ratio_and_ndcg(model, user_items, np.array([0]), np.array([2]), k=2)
+    assert hr == 1 and np.isclose(ndcg, 1 / np.log2(3))
+    assert hit_ratio_and_ndcg(model, user_items, np.array([0]), np.array([2]), k=1) == (0, 0)
+
+
+def test_configs():
+    assert grid_configs({"factors": [8, 16], "w0": [1]}) == [
+        {"factors": 8, "w0": 1},
+        {"factors": 16, "w0": 1},
+    ]
+    configs = random_configs(
+        {"factors": [8, 16], "alpha": lambda rng: rng.uniform(0, 1)}, 5, random_state=1
+    )
+    assert len(configs) == 5
+    assert all(c["factors"] in (8, 16) and 0 <= c["alpha"] < 1 for c in configs)
+
+
+def test_search(spawnable_eals, tmp_path):
+    user_items = create_user_items(user_count=200, item_count=50, data_count=3000, random_seed=1)
+    prepare_search_data(tmp_path / "data", user_items, random_state=1)
+    search = HyperparameterSearch(tmp_path / "data", n_workers=2, num_iter=20, tol=1e-2)
+    configs = grid_configs({"factors": [2, 4], "regularization": [0.01, 0.1]})
+    rows = search.run(configs, results_file=tmp_path / "results.csv")
+
+    evaluated = [(row["factors"], row["regularization"]) for row in rows]
+    assert sorted(evaluated) == sorted((c["factors"], c["regularization"]) for c in configs)
+    for row in rows:
+        assert 0 < row["iterations"] < 20
+        assert 0 <= row["ndcg"] <= row["hr"] <= 1
+    assert [row["wall_sec"] for row in rows] == sorted(row["wall_sec"] for row in rows)
+    with open(tmp_path / "results.csv") as f:
+        table = list(csv.DictReader(f))
+    assert len(table) == 4
+    assert list(table[0]) == ["factors", "regularization"] + RESULT_COLUMNS
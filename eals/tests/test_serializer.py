@@ -1,10 +1,13 @@
 import filecmp
+import json
 
 import numpy as np
+import pytest
 import scipy.sparse as sps
 
-from eals import ElementwiseAlternatingLeastSquares
+from eals import ElementwiseAlternatingLeastSquares, MmapInteractions, load_model
 from eals.serializer import deserialize_eals_joblib, serialize_eals_joblib
+from eals.util import create_user_items
 
 
 def assert_model_equality(model1, model2):
@@ -16,11 +19,12 @@ def assert_model_equality(model1, model2):
     assert model1.init_stdev == model2.init_stdev
     assert model1.num_iter == model2.num_iter
     assert model1.num_iter_online == model2.num_iter_online
+    assert model1.factor_dtype == model2.factor_dtype
     assert model1.random_state == model2.random_state
     assert np.allclose(model1.U, model2.U)
     assert np.allclose(model1.V, model2.V)
-    assert (model1._user_items_lil.data == model2._user_items_lil.data).all()
-    assert (model1._user_items_lil.rows == model2._user_items_lil.rows).all()
+    assert (model1.user_items != model2.user_items).nnz == 0
+    assert (model1._user_items_t.to_csr() != model2._user_items_t.to_csr()).nnz == 0
 
 
 def test_serialize_and_deserialize(tmp_path):
@@ -74,3 +78,48 @@ def test_serialize_and_deserialize(tmp_path):
         tmp_path / "model_compress-true.joblib",
         shallow=False,
     )
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_and_load_directory(tmp_path, mmap):
+    user_items = create_user_items(user_count=50, item_count=20, data_count=300, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(
+        factors=4, num_iter=2, factor_dtype=np.float32, random_state=1
+    )
+    model.fit(user_items)
+    model.update_model(50, 3)
+    model.save(tmp_path / "model", format="directory")
+    header = json.loads((tmp_path / "model" / "header.json").read_text())
+    assert header["factors"] == 4 and header["factor_dtype"] == "float32"
+    # the rating matrix is readable as MmapInteractions
+    user_items = MmapInteractions(tmp_path / "model").user_store().to_csr()
+    assert (user_items != model.user_items).nnz == 0
+
+    loaded = load_model(tmp_path / "model", mmap=mmap)
+    assert_model_equality(model, loaded)
+    assert np.array_equal(loaded.SU, model.SU) and np.array_equal(loaded.SV, model.SV)
+    assert np.array_equal(loaded.Wi, model.Wi)
+    assert loaded.factor_dtype == np.float32 and loaded.U.dtype == np.float32
+    assert loaded._dirty_users == model._dirty_users
+    assert loaded.telemetry.to_dict() == model.telemetry.to_dict()
+    assert isinstance(loaded._U, np.memmap) == mmap
+
+    # online training does not write to the files
+    loaded.update_model(0, 5)
+    model.update_model(0, 5)
+    assert_model_equality(model, loaded)
+    assert np.allclose(loaded.SU, model.SU)
+    reloaded = load_model(tmp_path / "model", mmap=mmap)
+    assert reloaded.user_items[0, 5] == 0
+    assert not np.array_equal(reloaded.U, loaded.U)
+
+
+def test_load_model_mmap_requires_directory(tmp_path):
+    model = ElementwiseAlternatingLeastSquares(num_iter=1)
+    model.fit(sps.csr_matrix([[1.0, 0.0], [1.0, 1.0]]))
+    model.save(tmp_path / "model.joblib")
+    with pytest.raises(ValueError):
+        load_model(tmp_path / "model.joblib", mmap=True)
+    with pytest.raises(ValueError):
+        model.save(tmp_path / "model.npz", format="npz")
+
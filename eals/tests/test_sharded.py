@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from eals import ElementwiseAlternatingLeastSquares, MmapInteractions, ShardedTrainer
+from eals.jit import worker_threads
+from eals.sharded import _balanced_ranges, _Workers
+from eals.util import create_user_items
+
+
+def test_balanced_ranges():
+    # rows with 10, 0, 0, 10 and 20 elements cost 11, 1, 1, 11 and 21 with factors=1
+    indptr = np.array([0, 10, 10, 10, 20, 40])
+    assert _balanced_ranges(indptr, 1, 2) == [0, 4, 5]
+    assert _balanced_ranges(indptr, 1, 1) == [0, 5]
+    assert _balanced_ranges(np.array([0]), 1, 2) == [0, 0, 0]
+
+
+@pytest.mark.parametrize("n_workers", [1, 3])
+def test_sharded_fit_equals_fit(spawnable_eals, n_workers):
+    user_items = create_user_items(user_count=300, item_count=80, data_count=3000, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    model.fit(user_items)
+    losses = []
+    model_sharded = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    ShardedTrainer(n_workers=n_workers).fit(
+        model_sharded, user_items, callbacks=[lambda model, iter, loss: losses.append(loss)]
+    )
+    assert np.allclose(model_sharded.U, model.U)
+    assert np.allclose(model_sharded.V, model.V)
+    assert np.allclose(model_sharded.SU, model.SU)
+    assert np.allclose(model_sharded.SV, model.SV)
+    assert np.isclose(losses[-1], model.calc_loss() / user_items.nnz)
+    # the model is an ordinary model after training
+    model_sharded.update_model(0, 1)
+    model_sharded.update_model(300, 80)
+    assert model_sharded.U.shape == (301, 8)
+
+
+def test_sharded_fit_maps_mmap_interactions(spawnable_eals, tmp_path):
+    user_items = create_user_items(user_count=300, item_count=80, data_count=3000, random_seed=1)
+    interactions = MmapInteractions.save(tmp_path, user_items)
+    model = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    model.fit(user_items)
+    model_sharded = ElementwiseAlternatingLeastSquares(factors=8, num_iter=3, random_state=1)
+    ShardedTrainer(n_workers=2).fit(model_sharded, interactions)
+    assert np.allclose(model_sharded.U, model.U)
+    assert np.allclose(model_sharded.V, model.V)
+
+    # only the arrays updated by the workers are copied to shared memory
+    model_mapped = ElementwiseAlternatingLeastSquares(factors=8, num_iter=1, random_state=1)
+    model_mapped._init_data(interactions)
+    with _Workers(model_mapped, 2, worker_threads(2, None)) as workers:
+        assert sorted(workers._shared) == ["SU", "SV", "U", "V", "Wi"]
+        workers.update_users()
@@ -0,0 +1,54 @@
+import json
+import re
+
+import numpy as np
+
+from eals import ElementwiseAlternatingLeastSquares, TrainingTelemetry
+from eals.util import create_user_items
+
+
+def test_fit_and_online_telemetry():
+    user_items = create_user_items(user_count=100, item_count=30, data_count=1000, random_seed=1)
+    model = ElementwiseAlternatingLeastSquares(factors=4, num_iter=3, random_state=1)
+    model.fit(user_items)
+    telemetry = model.telemetry
+    assert isinstance(telemetry, TrainingTelemetry)
+    assert [it["iteration"] for it in telemetry.iterations] == [1, 2, 3]
+    for it in telemetry.iterations:
+        for phase in ["update_user", "update_item"]:
+            assert it[phase]["seconds"] >= 0
+        assert it["threads"] >= 1
+        assert it["memory"]["U_bytes"] == model._U.nbytes
+    assert telemetry.memory["item_users_bytes"] > 0
+
+    model.update_model(0, 1)
+    model.update_model(100, 30)
+    model.update_model_batch(np.array([1, 2]), np.array([3, 4]))
+    model.refit_dirty(neighbors=False)
+    assert telemetry.online["update_model"]["calls"] == 2
+    assert telemetry.online["update_model_batch"]["events"] == 2
+    assert telemetry.online["refit_dirty"]["calls"] == 1
+
+    assert json.loads(telemetry.to_json()) == telemetry.to_dict()
+    # a new fit() starts new telemetry
+    model.fit(user_items)
+    assert not model.telemetry.online
+
+
+def test_prometheus_format():
+    telemetry = TrainingTelemetry()
+    telemetry.record_phase(1, "update_user", 0.5, 1000, 4)
+    telemetry.record_phase(1, "update_item", 0.25, 1000, 4)
+    telemetry.record_memory({"U": 800})
+    telemetry.record_online("update_model", 0.002, 1)
+    telemetry.record_online("update_model", 0.001, 1)
+    text = telemetry.to_prometheus(labels={"model": 'a"b'})
+
+    assert 'eals_fit_phase_seconds_total{model="a\\"b",phase="update_user"} 0.5' in text
+    assert 'eals_fit_phase_nnz_per_second{model="a\\"b",phase="update_item"} 4000.0' in text
+    assert 'eals_online_events_total{model="a\\"b",method="update_model"} 2' in text
+    assert 'eals_online_max_seconds{model="a\\"b",method="update_model"} 0.002' in text
+    assert 'eals_array_bytes{model="a\\"b",array="U"} 800' in text
+    sample = re.compile(r'^[a-z_]+(\{([a-z_]+="([^"\\]|\\.)*",?)+\})? \S+$')
+    for line in text.splitlines():
+        assert line.startswith("# HELP ") or line.startswith("# TYPE ") or sample.match(line)
@@ -8,6 +8,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from Routes.modelRoutes import router as model_router
 from Routes.userRoutes import router as user_router
 from Routes.itemRoutes import router as item_router
+from eals import warmup
 import asyncio
 
 
@@ -29,5 +30,11 @@ app.include_router(user_router)
 app.include_router(item_router)
 
 
+@app.on_event("startup")
+def warmup_eals():
+    # compile (or load from the Numba cache) the eALS kernels before the first request
+    warmup()
+
+
 
 